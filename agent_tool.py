@@ -1,13 +1,24 @@
 import os
 import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from crewai.tools import tool # <-- THE CORRECT IMPORT
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
 
-# Define the directory where patient files are stored
-PATIENT_DATA_DIR = "data/"
+from patient_registry import PatientRegistry, PATIENT_DATA_DIR, REGISTRY_REFRESH_SECONDS
+from lexical_index import BM25Index, LEXICAL_INDEX_FILENAME, reciprocal_rank_fusion
+from reranker import CrossEncoderReranker
+from metrics import timed, metrics, submit_in_context
+
+# --- Shared, indexed patient registry ---
+# Reports are loaded from PATIENT_DATA_DIR on first lookup and then served
+# from in-memory indexes, instead of re-reading every file on every call.
+# Each lookup triggers an incremental refresh (at most every few seconds)
+# that only re-parses reports added or changed since the last one.
+patient_registry = PatientRegistry(PATIENT_DATA_DIR, refresh_interval=REGISTRY_REFRESH_SECONDS)
 
 @tool("Patient Data Retrieval Tool")
+@timed("patient_lookup")
 def get_patient_report(patient_name: str) -> tuple[str, list | None]:
     """
     Retrieves a patient's discharge report by their full name.
@@ -18,21 +29,10 @@ def get_patient_report(patient_name: str) -> tuple[str, list | None]:
     """
     print(f"---[Tool Called: get_patient_report with patient_name='{patient_name}']---")
 
-    found_reports_data = [] # Store the actual data dictionaries
-
     try:
-        # Loop through all files in the patient data directory
-        for filename in os.listdir(PATIENT_DATA_DIR):
-            if filename.endswith(".json"):
-                filepath = os.path.join(PATIENT_DATA_DIR, filename)
-
-                # Open and read the JSON file
-                with open(filepath, 'r') as f:
-                    report_data = json.load(f)
-
-                    # Case-insensitive check for the patient name
-                    if report_data.get("patient_name", "").lower() == patient_name.lower():
-                        found_reports_data.append(report_data) # Store the dictionary
+        # Pick up newly discharged / edited reports, then look up the name index
+        patient_registry.refresh()
+        found_reports_data = patient_registry.find_by_name(patient_name)
 
         # --- Handle the results ---
 
@@ -75,27 +75,243 @@ def get_patient_report(patient_name: str) -> tuple[str, list | None]:
 PERSIST_DIRECTORY = "db_chroma"
 EMBEDDING_MODEL_NAME = "all-mpnet-base-v2"
 
-# --- Initialize the components for the RAG tool ---
-# We initialize these components *outside* the tool function
-# so they are loaded only once when the app starts, not every time the tool is called.
+# Number of chunks handed to the LLM, and candidates fetched per retriever before fusion
+RAG_TOP_K = 4
+RAG_CANDIDATES = 10
+
+# "hybrid" (default): BM25 and vector search fused with reciprocal-rank fusion.
+# "dense" or "lexical" force a single retriever.
+RAG_RETRIEVAL_MODE = os.getenv("RAG_RETRIEVAL_MODE", "hybrid")
+
+# Two-stage retrieval: a wider candidate pool is reranked with a local
+# cross-encoder (reranker.py) before the top RAG_TOP_K are kept.
+# RAG_RERANK=0 hands the stage-one top RAG_TOP_K straight to the LLM.
+RAG_RERANK = os.getenv("RAG_RERANK", "1") == "1"
+RAG_RERANK_POOL = int(os.getenv("RAG_RERANK_POOL", "20"))
+
+# "chroma" (default) or "quantized": the int8, memory-mapped IVF store from
+# quantized_index.py, shared through the page cache by every process
+# (build it with python ingest.py --backend quantized)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+
+# Concurrent questions share batched forward passes of the embedding model
+# (batching_embeddings.py); EMBED_BATCHING=0 embeds each query on its own
+EMBED_BATCHING = os.getenv("EMBED_BATCHING", "1") != "0"
+
+# --- Lazily loaded components for the RAG tool ---
+# The embedding model and the vector database are heavy, so they are NOT
+# loaded at import time (the patient lookup path never needs them). They are
+# created on first RAG use, once per process, and shared by every session.
+_rag_lock = threading.Lock()
+_embeddings = None
+_vectordb = None
+_lexical_index = None
+_lexical_index_checked = False
+_reranker = None
+_warm_up_thread = None
+
+# Runs the dense search while the calling thread does the lexical search
+_retrieval_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="rag-retrieval")
+
+
+def get_embeddings():
+    """
+    Returns the process-wide embedding model, loading it on first use.
+    """
+    global _embeddings
+    if _embeddings is None:
+        with _rag_lock:
+            if _embeddings is None:
+                from langchain_community.embeddings import HuggingFaceEmbeddings
+                from embedding_cache import CachedEmbeddings
+                from batching_embeddings import MicroBatchingEmbeddings
+
+                # Initialize the free, local embedding model
+                # Wrapped in a persistent cache, so a repeated question never re-runs the model;
+                # cache misses from concurrent sessions are embedded together in micro-batches
+                print("---[Loading embedding model...]---")
+                model_kwargs = {'device': 'cpu'}
+                model = HuggingFaceEmbeddings(
+                    model_name=EMBEDDING_MODEL_NAME,
+                    model_kwargs=model_kwargs
+                )
+                _embeddings = CachedEmbeddings(
+                    MicroBatchingEmbeddings(model) if EMBED_BATCHING else model,
+                    model_name=EMBEDDING_MODEL_NAME,
+                )
+    return _embeddings
+
+
+def get_vectordb():
+    """
+    Returns the process-wide persistent vector database, loading it on first use.
+    """
+    global _vectordb
+    if _vectordb is None:
+        embeddings = get_embeddings()
+        with _rag_lock:
+            if _vectordb is None:
+                print(f"---[Loading Vector Database ({VECTOR_BACKEND}) from disk...]---")
+                if VECTOR_BACKEND == "quantized":
+                    from quantized_index import QuantizedVectorStore
+
+                    _vectordb = QuantizedVectorStore(PERSIST_DIRECTORY, embedding_function=embeddings)
+                else:
+                    from langchain_community.vectorstores import Chroma
+
+                    _vectordb = Chroma(
+                        persist_directory=PERSIST_DIRECTORY,
+                        embedding_function=embeddings
+                    )
+                print("---[Vector Database loaded successfully.]---")
+    return _vectordb
+
+
+def get_lexical_index():
+    """
+    Returns the BM25 index built by ingest.py, or None if the database predates it.
+    Loaded once per process; it needs no model.
+    """
+    global _lexical_index, _lexical_index_checked
+    if not _lexical_index_checked:
+        with _rag_lock:
+            if not _lexical_index_checked:
+                path = os.path.join(PERSIST_DIRECTORY, LEXICAL_INDEX_FILENAME)
+                if os.path.exists(path):
+                    _lexical_index = BM25Index.load(path)
+                    print(f"---[Lexical index loaded: {len(_lexical_index)} chunks.]---")
+                else:
+                    print("---[No lexical index found; using vector search only. Re-run ingest.py to build it.]---")
+                _lexical_index_checked = True
+    return _lexical_index
+
+
+def get_reranker() -> CrossEncoderReranker:
+    """
+    Returns the process-wide reranker (its model is loaded on first rerank).
+    """
+    global _reranker
+    if _reranker is None:
+        with _rag_lock:
+            if _reranker is None:
+                _reranker = CrossEncoderReranker()
+    return _reranker
+
+
+def dense_search(query: str, k: int) -> list:
+    """
+    Vector search, timed as two stages: embedding the query and the Chroma lookup.
+    """
+    vectordb = get_vectordb()
+    with timed("embedding"):
+        vector = get_embeddings().embed_query(query)
+    with timed("vector_search"):
+        return vectordb.similarity_search_by_vector(vector, k=k)
+
+
+@timed("lexical_search")
+def lexical_search(lexical_index: BM25Index, query: str, k: int) -> list:
+    return lexical_index.search(query, k=k)
+
+
+def _retrieve(query: str, k: int, mode: str | None) -> tuple[list, bool]:
+    """
+    retrieve_chunks(), also saying whether the lexical-only fast path was taken.
+    """
+    mode = mode or RAG_RETRIEVAL_MODE
+    lexical_index = get_lexical_index() if mode != "dense" else None
+    if lexical_index is None:
+        return dense_search(query, k), False
+
+    if mode == "lexical" or lexical_index.is_exact_term_query(query):
+        lexical_hits = lexical_search(lexical_index, query, k)
+        if lexical_hits or mode == "lexical":
+            print("---[Retrieval: lexical-only fast path]---")
+            return lexical_hits, True
+
+    candidates = max(k, RAG_CANDIDATES)
+    dense_future = submit_in_context(_retrieval_executor, dense_search, query, candidates)
+    lexical_hits = lexical_search(lexical_index, query, candidates)
+    dense_hits = dense_future.result()
+    return reciprocal_rank_fusion([dense_hits, lexical_hits], k=k), False
+
+
+def retrieve_chunks(query: str, k: int = RAG_TOP_K, mode: str | None = None) -> list:
+    """
+    Returns the top `k` reference chunks for a query (objects with
+    `page_content` and `metadata`).
+
+    In hybrid mode the BM25 and vector searches run in parallel and are fused
+    with reciprocal-rank fusion, so exact drug names and lab terms are not
+    missed. Queries made mostly of rare exact terms ("furosemide", "eGFR")
+    take a lexical-only fast path that never loads the embedding model.
+    """
+    return _retrieve(query, k, mode)[0]
+
+
+def retrieve_reranked(query: str, k: int = RAG_TOP_K, mode: str | None = None) -> tuple[list, dict]:
+    """
+    Two-stage retrieval: fetches RAG_RERANK_POOL candidates with
+    retrieve_chunks(), then reranks them (cross-encoder + MMR de-duplication)
+    down to `k`. Returns the chunks and per-stage timings in milliseconds.
+
+    Lexical fast-path results are not reranked, so exact-term queries still
+    never load a model; they keep the BM25 order.
+    """
+    start = time.perf_counter()
+    pool_size = max(k, RAG_RERANK_POOL) if RAG_RERANK else k
+    candidates, fast_path = _retrieve(query, pool_size, mode)
+    timings = {"candidates_ms": round((time.perf_counter() - start) * 1000, 2)}
+    if not RAG_RERANK or fast_path:
+        return candidates[:k], timings
+
+    chunks, stats = get_reranker().rerank(query, candidates, k)
+    metrics.observe("rerank", stats["rerank_ms"] / 1000, fallback=stats["fallback"] or "none")
+    timings.update(stats)
+    timings["total_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return chunks, timings
+
+
+def load_rag_components():
+    """
+    Loads everything get_rag_context needs (lexical index, embedding model,
+    vector database, reranker model) if it is not loaded yet. Waits for a
+    load already in progress (e.g. the warm-up thread); cheap once loaded.
+    """
+    get_lexical_index()
+    get_vectordb()
+    if RAG_RERANK:
+        get_reranker().get_model()
+
+
+def warm_up_rag(background: bool = False):
+    """
+    Optional warm-up hook: loads the embedding model and vector database ahead
+    of the first question and runs one query so the model weights are paged in.
+    With background=True it returns immediately and warms up in a daemon thread
+    (only one warm-up thread is ever started per process).
+    """
+    global _warm_up_thread
 
-# 1. Initialize the free, local embedding model
-model_kwargs = {'device': 'cpu'}
-embeddings = HuggingFaceEmbeddings(
-    model_name=EMBEDDING_MODEL_NAME,
-    model_kwargs=model_kwargs
-)
+    def _warm_up():
+        try:
+            load_rag_components()
+            get_vectordb().similarity_search("kidney", k=1)
+            print("---[RAG components warmed up.]---")
+        except Exception as e:
+            print(f"---[RAG warm-up failed: {e}]---")
 
-# 2. Load the persistent vector database
-print("---[Loading Vector Database from disk...]---")
-vectordb = Chroma(
-    persist_directory=PERSIST_DIRECTORY,
-    embedding_function=embeddings
-)
-print("---[Vector Database loaded successfully.]---")
+    if not background:
+        _warm_up()
+        return
+    with _rag_lock:
+        if _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(target=_warm_up, name="rag-warm-up", daemon=True)
+            _warm_up_thread.start()
 
 
 @tool("Nephrology Reference RAG Tool")
+@timed("rag")
 def get_rag_context(medical_query: str) -> str:
     """
     Searches the nephrology reference book for context relevant to a medical query.
@@ -104,15 +320,17 @@ def get_rag_context(medical_query: str) -> str:
     print(f"---[Tool Called: get_rag_context with query='{medical_query}']---")
 
     try:
-        # Perform a similarity search in the vector database
-        # k=4 means it will return the top 4 most relevant chunks
-        relevant_docs = vectordb.similarity_search(medical_query, k=4)
+        # Hybrid lexical + vector search for a candidate pool, reranked down
+        # to the top RAG_TOP_K = 4 chunks
+        relevant_docs, timings = retrieve_reranked(medical_query, k=RAG_TOP_K)
+        print(f"---[Retrieval timings: {timings}]---")
 
         if not relevant_docs:
             print("---[Tool Result: No relevant context found.]---")
             return "No relevant information found in the reference materials."
 
         # Format the results into a single string
+        # (prompt_builder.split_rag_context parses this format back into chunks)
         context = ""
         for i, doc in enumerate(relevant_docs):
             context += f"--- Relevant Context Chunk {i+1} (Source: {doc.metadata.get('source', 'Unknown')}) ---\n"
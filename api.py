@@ -0,0 +1,285 @@
+"""
+Async HTTP service exposing the receptionist and clinical agents.
+
+Unlike the Streamlit app, nothing is re-executed per interaction: one patient
+registry, one RAG tool (and its vector store) and one pooled HTTP client for
+Gemini and Tavily are created at startup and shared by every request.
+Clinical questions are limited to API_MAX_CONCURRENT_CLINICAL in flight;
+requests that cannot get a slot within API_QUEUE_TIMEOUT_SECONDS are
+rejected with 503 + Retry-After instead of piling up.
+
+Run with:
+    uvicorn api:app --host 0.0.0.0 --port 8000
+"""
+from dotenv import load_dotenv
+load_dotenv() # <-- Load .env file FIRST
+
+import os
+import json
+import time
+import uuid
+import asyncio
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from starlette.background import BackgroundTask
+
+from async_backends import create_http_client, AsyncGeminiClient, AsyncTavilyClient
+from clinical_pipeline import (
+    build_clinical_prompt, RAG_TIMEOUT_SECONDS, WEB_SEARCH_TIMEOUT_SECONDS, RAG_UNAVAILABLE, WEB_UNAVAILABLE,
+)
+from patient_registry import PatientRegistry, PATIENT_DATA_DIR, REGISTRY_REFRESH_SECONDS
+from logger import app_logger, log_stage, request_id_var
+from metrics import metrics, timed
+
+# --- Concurrency limits and backpressure ---
+MAX_CONCURRENT_CLINICAL = int(os.getenv("API_MAX_CONCURRENT_CLINICAL", "16"))
+QUEUE_TIMEOUT_SECONDS = float(os.getenv("API_QUEUE_TIMEOUT_SECONDS", "2.0"))
+RAG_WORKERS = int(os.getenv("API_RAG_WORKERS", "4"))
+
+
+# --- Request bodies ---
+
+class LookupRequest(BaseModel):
+    patient_name: str
+
+
+class ClarifyRequest(BaseModel):
+    patient_name: str
+    detail: str
+
+
+class ClinicalRequest(BaseModel):
+    patient_name: str
+    question: str
+    clarification: str | None = None
+
+
+def load_rag_fn():
+    """
+    The blocking RAG tool shared by all requests. API_USE_LOCAL_RAG=1 swaps
+    in the local stand-in (no vector database needed, e.g. for load tests).
+    """
+    if os.getenv("API_USE_LOCAL_RAG") == "1":
+        from local_backends import FakeReferenceRAG
+        return FakeReferenceRAG()
+    from agent_tool import get_rag_context
+    return get_rag_context.func
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.http = create_http_client()
+    app.state.llm = AsyncGeminiClient(app.state.http, os.getenv("GEMINI_API_KEY"))
+    app.state.search = AsyncTavilyClient(app.state.http, os.getenv("TAVILY_API_KEY"))
+    app.state.registry = PatientRegistry(PATIENT_DATA_DIR, refresh_interval=REGISTRY_REFRESH_SECONDS)
+    app.state.registry.ensure_loaded()
+    app.state.rag_fn = load_rag_fn()
+    app.state.rag_executor = ThreadPoolExecutor(max_workers=RAG_WORKERS, thread_name_prefix="api-rag")
+    app.state.clinical_slots = asyncio.Semaphore(MAX_CONCURRENT_CLINICAL)
+    app.state.clinical_in_flight = 0
+    app_logger.info("API service started.")
+    yield
+    await app.state.http.aclose()
+    app.state.rag_executor.shutdown(wait=False)
+
+
+app = FastAPI(title="Post-Discharge Medical AI Assistant", lifespan=lifespan)
+
+
+@app.middleware("http")
+async def tag_request(request: Request, call_next):
+    """
+    Gives every request an id (the caller's X-Request-ID, or a new one) that
+    all of its log records carry and that is echoed in the response.
+    """
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex[:16]
+    token = request_id_var.set(request_id)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = request_id
+        log_stage("http_response_start", time.perf_counter() - start, path=request.url.path,
+                  status=response.status_code)
+        return response
+    finally:
+        request_id_var.reset(token)
+
+
+class _Slot:
+    """
+    One acquired clinical slot; release() is idempotent, so it can be called
+    both when the stream finishes and as a fallback background task.
+    """
+
+    def __init__(self, state):
+        self.state = state
+        self.released = False
+        state.clinical_in_flight += 1
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.state.clinical_in_flight -= 1
+            self.state.clinical_slots.release()
+
+
+def report_choice(report: dict) -> dict:
+    return {"discharge_date": report.get("discharge_date"), "primary_diagnosis": report.get("primary_diagnosis")}
+
+
+async def refreshed_registry() -> PatientRegistry:
+    registry = app.state.registry
+    # The directory scan is blocking file I/O, keep it off the event loop
+    await asyncio.to_thread(registry.refresh)
+    return registry
+
+
+# =================================================================
+# --- "RECEPTIONIST AGENT" ENDPOINTS ---
+# =================================================================
+
+@app.post("/patients/lookup")
+async def lookup_patient(request: LookupRequest):
+    registry = await refreshed_registry()
+    with timed("patient_lookup"):
+        reports = registry.find_by_name(request.patient_name)
+    app_logger.info(f"API lookup for patient '{request.patient_name}': {len(reports)} report(s).")
+
+    if not reports:
+        raise HTTPException(status_code=404, detail=f"No patient report found for the name {request.patient_name}.")
+    if len(reports) > 1:
+        return {
+            "status": "clarification_needed",
+            "message": "Multiple patients found. Please provide the discharge date or diagnosis.",
+            "choices": [report_choice(r) for r in reports],
+        }
+    return {"status": "found", "report": reports[0]}
+
+
+@app.post("/patients/clarify")
+async def clarify_patient(request: ClarifyRequest):
+    registry = await refreshed_registry()
+    matches = registry.resolve_clarification(request.patient_name, request.detail)
+
+    if not matches:
+        raise HTTPException(status_code=404, detail="Could not find a matching report based on the details provided.")
+    if len(matches) > 1:
+        return {
+            "status": "ambiguous",
+            "message": "Your input matches multiple reports. Please be more specific.",
+            "choices": [report_choice(r) for r in matches],
+        }
+    return {"status": "found", "report": matches[0]}
+
+
+# =================================================================
+# --- "CLINICAL AI AGENT" ENDPOINT ---
+# =================================================================
+
+async def _timed_source(name: str, awaitable, timeout: float, fallback):
+    start = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(awaitable, timeout)
+        duration_ms = round((time.perf_counter() - start) * 1000, 3)
+        app_logger.info(f"Context source '{name}' finished in {duration_ms:.0f} ms.",
+                        extra={"stage": name, "duration_ms": duration_ms})
+        return result
+    except asyncio.TimeoutError:
+        app_logger.warning(f"Context source '{name}' timed out after {timeout:.1f}s; continuing without it.")
+    except Exception as e:
+        app_logger.error(f"Context source '{name}' failed: {e}; continuing without it.")
+    return fallback
+
+
+async def gather_context_async(question: str) -> list:
+    """
+    Async counterpart of clinical_pipeline.gather_clinical_context(): the RAG
+    tool runs on a bounded thread pool while the web search awaits the pooled
+    HTTP client, each with its own timeout and fallback.
+    """
+    loop = asyncio.get_running_loop()
+    rag = loop.run_in_executor(app.state.rag_executor, app.state.rag_fn, question)
+    return await asyncio.gather(
+        _timed_source("rag", rag, RAG_TIMEOUT_SECONDS, RAG_UNAVAILABLE),
+        _timed_source("web_search", app.state.search.search(question), WEB_SEARCH_TIMEOUT_SECONDS, WEB_UNAVAILABLE),
+    )
+
+
+@app.post("/clinical/ask")
+async def ask_clinical_question(request: ClinicalRequest):
+    """
+    Answers a patient's question, streaming the reply as plain text.
+    """
+    registry = await refreshed_registry()
+    reports = registry.find_by_name(request.patient_name)
+    if len(reports) > 1 and request.clarification:
+        reports = registry.resolve_clarification(request.patient_name, request.clarification)
+    if not reports:
+        raise HTTPException(status_code=404, detail=f"No patient report found for the name {request.patient_name}.")
+    if len(reports) > 1:
+        raise HTTPException(status_code=409, detail="Multiple reports match; provide 'clarification'.")
+
+    # Backpressure: wait briefly for a slot, then shed load
+    try:
+        await asyncio.wait_for(app.state.clinical_slots.acquire(), QUEUE_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        app_logger.warning("Clinical request rejected: all slots busy.")
+        return JSONResponse(status_code=503, content={"detail": "Server busy, please retry."},
+                            headers={"Retry-After": "1"})
+    slot = _Slot(app.state)
+
+    start = time.perf_counter()
+    try:
+        rag_context, web_context = await gather_context_async(request.question)
+        prompt = build_clinical_prompt(json.dumps(reports[0], indent=2), request.question, rag_context, web_context)
+    except Exception:
+        slot.release()
+        raise
+
+    async def stream_answer():
+        first_token = None
+        llm_start = time.perf_counter()
+        try:
+            async for text in app.state.llm.stream(prompt):
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                yield text
+        except Exception as e:
+            app_logger.error(f"Clinical answer stream failed: {e}")
+            yield "\n\nError: The assistant could not complete this answer. Please try again."
+        finally:
+            slot.release()
+            ttft_ms = f"{first_token * 1000:.0f} ms" if first_token is not None else "n/a"
+            total_ms = round((time.perf_counter() - start) * 1000, 3)
+            metrics.observe("clinical_turn", total_ms / 1000)
+            metrics.observe("llm", time.perf_counter() - llm_start, label="Clinical answer")
+            if first_token is not None:
+                metrics.observe("clinical_first_token", first_token)
+            app_logger.info(f"API clinical answer: time to first token {ttft_ms}, total {total_ms:.0f} ms.",
+                            extra={"stage": "clinical_answer", "duration_ms": total_ms,
+                                   "first_token_ms": round(first_token * 1000, 3) if first_token is not None else None})
+
+    return StreamingResponse(stream_answer(), media_type="text/plain; charset=utf-8",
+                             background=BackgroundTask(slot.release))
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """
+    Per-stage latency histograms in the Prometheus text format.
+    """
+    return PlainTextResponse(metrics.prometheus_text(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/health")
+async def health():
+    return {
+        "status": "ok",
+        "reports": len(app.state.registry),
+        "clinical_in_flight": app.state.clinical_in_flight,
+        "clinical_limit": MAX_CONCURRENT_CLINICAL,
+    }
@@ -2,21 +2,41 @@ from dotenv import load_dotenv
 load_dotenv() # <-- Load .env file FIRST
 
 import os
+import uuid
 import streamlit as st
 import json # Need this to parse the report string later
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_community.tools import TavilySearchResults
 
 # Import our custom tools
-from agent_tool import get_patient_report, get_rag_context
+from agent_tool import (get_patient_report, get_rag_context, patient_registry, get_embeddings, warm_up_rag,
+                        load_rag_components, RAG_RETRIEVAL_MODE)
 
 # --- IMPORT THE LOGGER ---
-from logger import app_logger
+from logger import app_logger, session_id_var, request_id_var
+
+from clinical_pipeline import (answer_clinical_question, stream_llm_response, invoke_llm,
+                               LIVE_LLM_NAME, FAKE_LLM_NAME)
+from local_backends import FakeStreamingLLM
+from metrics import metrics, timed, METRICS_DUMP_PATH
+from semantic_cache import SemanticAnswerCache, DEFAULT_SIMILARITY_THRESHOLD, DEFAULT_TTL_SECONDS, DEFAULT_MAX_ENTRIES
+from precompute import load_bundle, build_greeting_prompt, retriever_info
+
+# Stream LLM replies token by token into the chat (set LLM_STREAMING=0 to wait for the full reply)
+STREAM_RESPONSES = os.getenv("LLM_STREAMING", "1") != "0"
 
 # --- INITIALIZE "BRAIN" (LLM) AND TOOLS ---
 try:
-    llm = ChatGoogleGenerativeAI(model="gemini-pro-latest", google_api_key=os.getenv("GEMINI_API_KEY"))
+    if os.getenv("USE_LOCAL_LLM") == "1":
+        # Offline mode: deterministic local stand-in for Gemini
+        llm = FakeStreamingLLM()
+        llm_name = FAKE_LLM_NAME
+    else:
+        llm = ChatGoogleGenerativeAI(model=LIVE_LLM_NAME, google_api_key=os.getenv("GEMINI_API_KEY"))
+        llm_name = LIVE_LLM_NAME
     web_search_tool = TavilySearchResults(k=3, tavily_api_key=os.getenv("TAVILY_API_KEY"))
+    # Every search call is recorded in the "web_search" latency histogram
+    web_search = timed("web_search")(web_search_tool.invoke)
     app_logger.info("AI components initialized successfully.")
 except Exception as e:
     st.error(f"Error initializing AI components: {e}")
@@ -24,6 +44,71 @@ except Exception as e:
     st.stop()
 # -------------------------------------------
 
+
+def respond_with_llm(prompt_text: str, label: str) -> str:
+    """
+    Writes the LLM's reply into an assistant chat message, streaming tokens as
+    they arrive, and returns the complete text.
+    """
+    with st.chat_message("assistant"):
+        placeholder = st.empty()
+        if STREAM_RESPONSES:
+            text, _ = stream_llm_response(
+                llm, prompt_text, on_text=lambda partial: placeholder.markdown(partial + "▌"), label=label
+            )
+        else:
+            with st.spinner("Generating response..."):
+                text, _ = invoke_llm(llm, prompt_text, label=label)
+        placeholder.markdown(text)
+    return text
+
+
+def greet_patient(report_string: str, after_clarification: bool = False) -> str:
+    """
+    Returns the receptionist greeting for a confirmed report. A bundle from
+    precompute.py for this exact report (same LLM and retriever) is served
+    without an LLM call and kept in the session to seed the clinical agent's
+    retrieval.
+    """
+    try:
+        bundle = load_bundle(json.loads(report_string), llm_name, retriever_info(RAG_RETRIEVAL_MODE))
+    except Exception as e:
+        app_logger.error(f"Loading precomputed bundle failed: {e}")
+        bundle = None
+    st.session_state.patient_bundle = bundle
+    if bundle and bundle.get("greeting"):
+        app_logger.info(f"Served precomputed greeting for '{bundle.get('patient_name')}' "
+                        f"({len(bundle.get('seed_chunks', []))} seed chunks).")
+        return bundle["greeting"]
+    return respond_with_llm(build_greeting_prompt(report_string, after_clarification), "Receptionist greeting")
+
+
+@st.cache_resource
+def get_answer_cache() -> SemanticAnswerCache:
+    """
+    One semantic answer cache per process, shared by every session and rerun.
+    """
+    return SemanticAnswerCache(
+        lambda question: get_embeddings().embed_query(question),
+        similarity_threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", DEFAULT_SIMILARITY_THRESHOLD)),
+        ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS)),
+        max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+    )
+
+
+answer_cache = get_answer_cache()
+
+
+# Load the embedding model and vector database in the background now, so the
+# first clinical question does not wait for them (WARM_UP_RAG=0 loads them on
+# that question instead; the load never counts against the RAG timeout)
+if os.getenv("WARM_UP_RAG", "1") != "0":
+    warm_up_rag(background=True)
+
+# Write the latency histograms to disk periodically (Prometheus text + JSON summary)
+if METRICS_DUMP_PATH:
+    metrics.start_periodic_dump(METRICS_DUMP_PATH)
+
 # --- Streamlit Page Setup ---
 st.set_page_config(page_title="Post-Discharge AI Assistant", page_icon="🧑‍⚕️")
 st.title("🧑‍⚕️ Post-Discharge Medical AI Assistant")
@@ -45,6 +130,14 @@ if "clarification_needed" not in st.session_state:
     st.session_state.clarification_needed = False # Flag to show the clarification UI
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
+if "patient_bundle" not in st.session_state:
+    st.session_state.patient_bundle = None # Precomputed greeting and seed chunks for the confirmed report
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex[:12]
+
+# Tag this run's log records with the browser session
+session_id_var.set(st.session_state.session_id)
+request_id_var.set(None)
 
 # =================================================================
 # --- "RECEPTIONIST AGENT" LOGIC ---
@@ -78,16 +171,8 @@ if not st.session_state.clarification_needed:
                 st.session_state.pending_reports = None
                 app_logger.info(f"Successfully found report for patient: '{name_input}'")
 
-                # Generate initial greeting
-                summary_prompt = f"""
-                You are a friendly receptionist. A patient's report was just found.
-                Patient Report: {message}
-
-                Greet the patient by name and briefly summarize their primary diagnosis and follow-up date.
-                Then, ask them a friendly open-ended question like 'How are you feeling today?' or 'Do you have any questions about your discharge instructions?'
-                """
-                with st.spinner("Generating summary..."):
-                    initial_greeting = llm.invoke(summary_prompt).content
+                # Generate initial greeting (or serve the precomputed one)
+                initial_greeting = greet_patient(message)
                 st.session_state.chat_history.append({"role": "assistant", "content": initial_greeting})
                 st.rerun() # Rerun to show Step 2
 
@@ -122,22 +207,16 @@ if st.session_state.clarification_needed:
     if st.button("Confirm Report"):
         if clarification_detail and st.session_state.pending_reports:
             found_match = None
-            clarification_detail_lower = clarification_detail.lower()
-
-            # Search through the pending reports
-            for report in st.session_state.pending_reports:
-                diagnosis = report.get("primary_diagnosis", "").lower()
-                discharge_date = report.get("discharge_date", "").lower()
-
-                # Check if the input matches either field (case-insensitive)
-                if clarification_detail_lower in diagnosis or clarification_detail_lower == discharge_date:
-                    if found_match is not None:
-                        # Ambiguous clarification if it matches more than one
-                        st.error("Your input matches multiple reports. Please be more specific (e.g., provide the full diagnosis or exact date).")
-                        app_logger.warning(f"Ambiguous clarification provided: '{clarification_detail}'")
-                        found_match = None # Reset match
-                        break
-                    found_match = report
+
+            # Query the registry's date/diagnosis indexes for this patient's reports
+            matches = patient_registry.resolve_clarification(st.session_state.patient_name, clarification_detail)
+
+            if len(matches) > 1:
+                # Ambiguous clarification if it matches more than one
+                st.error("Your input matches multiple reports. Please be more specific (e.g., provide the full diagnosis or exact date).")
+                app_logger.warning(f"Ambiguous clarification provided: '{clarification_detail}'")
+            elif len(matches) == 1:
+                found_match = matches[0]
 
             if found_match:
                 # SUCCESS: We found the specific report
@@ -148,16 +227,8 @@ if st.session_state.clarification_needed:
                 st.session_state.pending_reports = None
                 app_logger.info(f"Clarification successful for '{st.session_state.patient_name}' using detail: '{clarification_detail}'")
 
-                # Generate initial greeting
-                summary_prompt = f"""
-                You are a friendly receptionist. A patient's report was just found after clarification.
-                Patient Report: {final_report_string}
-
-                Greet the patient by name and briefly summarize their primary diagnosis and follow-up date.
-                Then, ask them a friendly open-ended question like 'How are you feeling today?' or 'Do you have any questions about your discharge instructions?'
-                """
-                with st.spinner("Generating summary..."):
-                    initial_greeting = llm.invoke(summary_prompt).content
+                # Generate initial greeting (or serve the precomputed one)
+                initial_greeting = greet_patient(final_report_string, after_clarification=True)
                 st.session_state.chat_history.append({"role": "assistant", "content": initial_greeting})
                 st.rerun() # Rerun to show Step 2
 
@@ -193,56 +264,28 @@ if st.session_state.patient_report:
         with st.chat_message("user"):
             st.markdown(prompt)
 
+        # Each question is its own request in the structured log
+        request_id_var.set(uuid.uuid4().hex[:16])
         app_logger.info(f"Patient '{st.session_state.patient_name}' asked new clinical question: '{prompt}'")
 
-        # --- Run the "Clinical Agent" logic ---
-        with st.spinner("Clinical Agent is thinking..."):
-            # 1. Get context from our RAG tool
-            rag_context = get_rag_context.func(prompt) # We call the .func()
-            app_logger.info("Retrieved context from RAG tool.")
-
-            # 2. Get context from the web search tool
-            web_context = web_search_tool.invoke(prompt)
-            app_logger.info("Retrieved context from Web Search tool.")
-
-            # 3. Build a comprehensive prompt for the LLM
-            final_prompt = f"""
-            You are an expert AI assistant specializing in nephrology.
-            Your primary duty is to answer a patient's question.
-
-            Here is the patient's information:
-            ---
-            PATIENT DISCHARGE REPORT:
-            {st.session_state.patient_report}
-            ---
-            PATIENT'S QUESTION:
-            "{prompt}"
-            ---
-
-            Here is the context you have retrieved to answer the question:
-            ---
-            CONTEXT FROM NEPHROLOGY REFERENCE BOOK (RAG):
-            {rag_context}
-            ---
-            CONTEXT FROM WEB SEARCH:
-            {web_context}
-            ---
-
-            INSTRUCTIONS:
-            1.  Answer the patient's question based *first* on the REFERENCE BOOK context and their DISCHARGE REPORT.
-            2.  If the question is about new research or information not in the book, use the WEB SEARCH context.
-            3.  You *must* cite your sources. Use "(Source: Reference Book)" or "(Source: Web Search)".
-            4.  Be helpful, accurate, and safe.
-            5.  You *must* end your entire response with the following medical disclaimer:
-                "Disclaimer: I am an AI assistant for educational purposes only. Always consult healthcare professionals for medical advice."
-            """
-
-            # 4. Call the LLM directly
-            response = llm.invoke(final_prompt).content
-            app_logger.info("Clinical agent generated final response.")
-
-            # 5. Display the response
-            with st.chat_message("assistant"):
-                st.markdown(response)
-                # Add AI response to chat history
-                st.session_state.chat_history.append({"role": "assistant", "content": response})
\ No newline at end of file
+        # --- Run the "Clinical Agent" turn (clinical_pipeline.answer_clinical_question) ---
+        # RAG and web search run at the same time (a slow or failed web search falls back to
+        # RAG-only context). General questions are answered from a prompt with only the diagnosis
+        # and shared through the semantic cache; questions about the report get its relevant
+        # fields and the patient's pre-retrieved chunks. The reply streams into the chat.
+        with st.chat_message("assistant"):
+            placeholder = st.empty()
+            on_text = (lambda partial: placeholder.markdown(partial + "▌")) if STREAM_RESPONSES else None
+            with st.spinner("Clinical Agent is thinking..."):
+                result = answer_clinical_question(
+                    prompt, st.session_state.patient_report, llm, get_rag_context.func, web_search,
+                    stream=STREAM_RESPONSES, on_text=on_text, answer_cache=answer_cache,
+                    bundle=st.session_state.patient_bundle, rag_prepare=load_rag_components,
+                )
+            response = result["answer"]
+            placeholder.markdown(response)
+        app_logger.info("Clinical agent generated final response.")
+
+        # Add AI response to chat history
+        st.session_state.chat_history.append({"role": "assistant", "content": response})
+        app_logger.info(f"Semantic cache stats: {answer_cache.stats()}")
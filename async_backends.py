@@ -0,0 +1,109 @@
+"""
+Async clients for the LLM (Gemini) and web search (Tavily) REST APIs.
+
+Both clients share one pooled httpx.AsyncClient, so connections (and TLS
+sessions) are reused across requests instead of being opened per call.
+Base URLs are configurable so they can point at local mock backends.
+"""
+import os
+import json
+
+import httpx
+
+from metrics import timed
+
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-pro-latest")
+TAVILY_BASE_URL = os.getenv("TAVILY_BASE_URL", "https://api.tavily.com")
+
+# Connection pool shared by every backend call in the process
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "60"))
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """
+    Builds the process-wide pooled HTTP client.
+    """
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE),
+        timeout=httpx.Timeout(HTTP_TIMEOUT_SECONDS, connect=10.0),
+    )
+
+
+class AsyncGeminiClient:
+    """
+    Minimal async Gemini client: whole replies or server-sent-event streams.
+    """
+
+    def __init__(self, http: httpx.AsyncClient, api_key: str | None, model: str = GEMINI_MODEL,
+                 base_url: str = GEMINI_BASE_URL):
+        self.http = http
+        self.api_key = api_key
+        self.model = model
+        self.base_url = base_url.rstrip("/")
+
+    def _body(self, prompt: str) -> dict:
+        return {"contents": [{"role": "user", "parts": [{"text": prompt}]}]}
+
+    @staticmethod
+    def _text(payload: dict) -> str:
+        parts = []
+        for candidate in payload.get("candidates", [])[:1]:
+            for part in candidate.get("content", {}).get("parts", []):
+                parts.append(part.get("text", ""))
+        return "".join(parts)
+
+    @timed("llm", label="gemini_generate")
+    async def generate(self, prompt: str) -> str:
+        response = await self.http.post(
+            f"{self.base_url}/v1beta/models/{self.model}:generateContent",
+            params={"key": self.api_key},
+            json=self._body(prompt),
+        )
+        response.raise_for_status()
+        return self._text(response.json())
+
+    async def stream(self, prompt: str):
+        """
+        Yields text chunks as Gemini generates them.
+        """
+        async with self.http.stream(
+            "POST",
+            f"{self.base_url}/v1beta/models/{self.model}:streamGenerateContent",
+            params={"key": self.api_key, "alt": "sse"},
+            json=self._body(prompt),
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                text = self._text(json.loads(line[len("data:"):]))
+                if text:
+                    yield text
+
+
+class AsyncTavilyClient:
+    """
+    Minimal async Tavily search client returning [{"url", "content", "score"}, ...].
+    """
+
+    def __init__(self, http: httpx.AsyncClient, api_key: str | None, max_results: int = 3,
+                 base_url: str = TAVILY_BASE_URL):
+        self.http = http
+        self.api_key = api_key
+        self.max_results = max_results
+        self.base_url = base_url.rstrip("/")
+
+    @timed("web_search")
+    async def search(self, query: str) -> list[dict]:
+        response = await self.http.post(
+            f"{self.base_url}/search",
+            json={"api_key": self.api_key, "query": query, "max_results": self.max_results},
+        )
+        response.raise_for_status()
+        return [
+            {"url": r.get("url"), "content": r.get("content"), "score": r.get("score")}
+            for r in response.json().get("results", [])
+        ]
@@ -0,0 +1,164 @@
+"""
+Batch / offline evaluation of the clinical agent.
+
+Reads a JSONL file of {"patient_name", "question"} records (an optional
+"clarification" holds a discharge date or diagnosis for patients that share a
+name), runs every question through the clinical pipeline on a bounded worker
+pool and writes one JSONL record per answer with per-stage timings.
+
+For each concurrency level it prints p50/p95 latency per stage and
+questions/sec. By default Gemini, Tavily and the reference RAG tool are
+replaced by the local stand-ins in local_backends.py, so it runs offline as a
+regression and throughput benchmark.
+
+Questions go through the same turn as the app (clinical_pipeline.
+answer_clinical_question): general questions get the diagnosis-only prompt,
+personal ones the report fields plus the patient's precomputed seed chunks
+when a matching bundle exists. The semantic answer cache is not used, so
+every question is answered.
+
+Usage:
+    python batch_eval.py benchmarks/clinical_questions.jsonl --concurrency 1,4,8
+    python batch_eval.py questions.jsonl --live --rag hybrid --output answers.jsonl
+"""
+import json
+import math
+import time
+import uuid
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from patient_registry import PatientRegistry, PATIENT_DATA_DIR
+from clinical_pipeline import answer_clinical_question, build_backends, LIVE_LLM_NAME, FAKE_LLM_NAME
+from precompute import load_bundle, retriever_info
+from logger import log_context
+
+STAGES = ["rag", "web_search", "context", "prompt", "llm_first_token", "llm", "total"]
+
+
+def load_questions(path: str) -> list[dict]:
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    """
+    Nearest-rank percentile (q in 0-100); None for an empty list.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    # Smallest value with at least q% of the values at or below it (rounded so 0.07 * 100 is 7, not 8)
+    rank = math.ceil(round(q / 100 * len(ordered), 9))
+    return ordered[min(len(ordered), max(1, rank)) - 1]
+
+
+def resolve_report(registry: PatientRegistry, record: dict) -> tuple[str | None, str | None]:
+    """
+    Returns (report JSON string, error) for a question record.
+    """
+    name = record.get("patient_name", "")
+    reports = registry.find_by_name(name)
+    if len(reports) > 1 and record.get("clarification"):
+        reports = registry.resolve_clarification(name, record["clarification"])
+    if len(reports) != 1:
+        return None, f"{len(reports)} reports match '{name}'"
+    return json.dumps(reports[0], indent=2), None
+
+
+def run_one(record: dict, registry: PatientRegistry, llm, rag_fn, web_fn, stream: bool,
+            bundle_key: tuple | None = None) -> dict:
+    """
+    Answers one record. `bundle_key` is (llm name, retriever) to serve the
+    patient's precomputed bundle as the app does, or None for no bundles.
+    """
+    result = {"patient_name": record.get("patient_name"), "question": record.get("question")}
+    report, error = resolve_report(registry, record)
+    if error:
+        result["error"] = error
+        return result
+    try:
+        bundle = load_bundle(json.loads(report), *bundle_key) if bundle_key else None
+        with log_context(request_id=uuid.uuid4().hex[:16]):
+            outcome = answer_clinical_question(record["question"], report, llm, rag_fn, web_fn, stream=stream,
+                                               bundle=bundle)
+    except Exception as e:
+        result["error"] = str(e)
+        return result
+    result["answer"] = outcome["answer"]
+    result["personal"] = outcome["personal"]
+    result["timings"] = outcome["timings"]
+    return result
+
+
+def run_batch(records: list[dict], concurrency: int, registry: PatientRegistry, llm, rag_fn, web_fn,
+              stream: bool, bundle_key: tuple | None = None) -> tuple[list[dict], float]:
+    """
+    Answers every record on a pool of `concurrency` workers. Returns the
+    results (in input order) and the wall time in seconds.
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch-eval") as pool:
+        results = list(pool.map(lambda r: run_one(r, registry, llm, rag_fn, web_fn, stream, bundle_key), records))
+    return results, time.perf_counter() - start
+
+
+def summarize(results: list[dict], wall_seconds: float, concurrency: int) -> dict:
+    ok = [r for r in results if "timings" in r]
+    summary = {
+        "concurrency": concurrency,
+        "questions": len(results),
+        "errors": len(results) - len(ok),
+        "wall_seconds": round(wall_seconds, 3),
+        "questions_per_second": round(len(ok) / wall_seconds, 3) if wall_seconds > 0 else 0.0,
+        "stages": {},
+    }
+    for stage in STAGES:
+        values = [r["timings"][stage] for r in ok if r["timings"].get(stage) is not None]
+        summary["stages"][stage] = {
+            "p50_ms": round(percentile(values, 50) * 1000, 2) if values else None,
+            "p95_ms": round(percentile(values, 95) * 1000, 2) if values else None,
+        }
+    return summary
+
+
+def print_summary(summary: dict):
+    print(f"\n=== concurrency {summary['concurrency']}: {summary['questions']} questions, "
+          f"{summary['errors']} errors, {summary['wall_seconds']:.2f}s wall, "
+          f"{summary['questions_per_second']:.2f} questions/sec ===")
+    for stage, stats in summary["stages"].items():
+        if stats["p50_ms"] is None:
+            print(f"  {stage:<16} n/a")
+        else:
+            print(f"  {stage:<16} p50 {stats['p50_ms']:9.2f} ms   p95 {stats['p95_ms']:9.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("questions", help="JSONL file of {patient_name, question} records")
+    parser.add_argument("--output", default="batch_eval_results.jsonl", help="Where to write answers and timings")
+    parser.add_argument("--concurrency", default="1,4,8", help="Comma-separated worker counts to benchmark")
+    parser.add_argument("--live", action="store_true", help="Use Gemini and Tavily instead of local stand-ins")
+    parser.add_argument("--rag", default="fake", choices=["fake", "hybrid", "dense", "lexical"],
+                        help="Reference retrieval: local stand-in (default) or the real RAG tool in a given mode")
+    parser.add_argument("--stream", action="store_true", help="Stream LLM replies (measures time to first token)")
+    parser.add_argument("--data-dir", default=PATIENT_DATA_DIR, help="Patient report directory")
+    args = parser.parse_args()
+
+    records = load_questions(args.questions)
+    registry = PatientRegistry(args.data_dir)
+    llm, rag_fn, web_fn = build_backends(args.live, args.rag)
+    # Bundles seeded by the stand-in are never served, as in the app
+    bundle_key = None if args.rag == "fake" else (LIVE_LLM_NAME if args.live else FAKE_LLM_NAME, retriever_info(args.rag))
+
+    with open(args.output, 'w') as out:
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            results, wall_seconds = run_batch(records, concurrency, registry, llm, rag_fn, web_fn, args.stream,
+                                             bundle_key)
+            summary = summarize(results, wall_seconds, concurrency)
+            print_summary(summary)
+            for result in results:
+                out.write(json.dumps({"concurrency": concurrency, **result}) + "\n")
+            out.write(json.dumps({"summary": summary}) + "\n")
+
+    print(f"\nAnswers and timings written to {args.output}")
@@ -0,0 +1,134 @@
+"""
+Micro-batching for query embeddings.
+
+Concurrent sessions each embed one short question. Run one by one, every call
+pays the model's full per-call overhead, and the calls queue up behind each
+other on the CPU. MicroBatchingEmbeddings puts each embed_query() on a queue.
+A dispatcher thread collects whatever arrives within EMBED_BATCH_WAIT_MS of
+the first request (up to EMBED_BATCH_MAX_SIZE), runs a single batched forward
+pass and hands each caller its vector. A lone caller does not wait for the
+window: with no other query in flight, its batch of one runs immediately.
+"""
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "32"))
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "5"))
+
+# Dispatcher threads (batches computed at once) and torch CPU threads per batch;
+# 0 leaves torch's default (one per core)
+EMBED_BATCH_WORKERS = int(os.getenv("EMBED_BATCH_WORKERS", "1"))
+EMBED_TORCH_THREADS = int(os.getenv("EMBED_TORCH_THREADS", "0"))
+
+
+class MicroBatchingEmbeddings:
+    """
+    Wraps an embeddings model (anything with embed_documents/embed_query)
+    so that concurrent embed_query() calls are served by shared batched
+    forward passes.
+
+    Queries are embedded with `base.embed_documents`, which must embed
+    queries and documents the same way (true for HuggingFaceEmbeddings with
+    sentence-transformers models such as all-mpnet-base-v2).
+    embed_documents() is passed straight through: its callers batch already.
+    """
+
+    def __init__(self, base, max_batch_size: int = EMBED_BATCH_MAX_SIZE,
+                 max_wait_ms: float = EMBED_BATCH_WAIT_MS, workers: int = EMBED_BATCH_WORKERS,
+                 torch_threads: int = EMBED_TORCH_THREADS):
+        self.base = base
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.workers = workers
+        self.torch_threads = torch_threads
+        self._queue = queue.Queue()
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.queries = 0
+        self.largest_batch = 0
+        self._in_flight = 0
+
+    def _ensure_started(self):
+        if self._threads:
+            return
+        with self._start_lock:
+            if self._threads:
+                return
+            if self.torch_threads:
+                try:
+                    import torch
+                    torch.set_num_threads(self.torch_threads)
+                except ImportError:
+                    pass
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"embed-batcher-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def embed_query(self, text: str) -> list[float]:
+        self._ensure_started()
+        future = Future()
+        with self._stats_lock:
+            self._in_flight += 1
+        try:
+            self._queue.put((text, future))
+            return future.result()
+        finally:
+            with self._stats_lock:
+                self._in_flight -= 1
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.base.embed_documents(texts)
+
+    # --- Dispatcher ---
+
+    def _collect(self) -> list:
+        """
+        Blocks for the first request, then gathers more until the batch is
+        full or the wait window after the first one has passed.
+        """
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            with self._stats_lock:
+                others_in_flight = self._in_flight > len(batch)
+            remaining = deadline - time.monotonic() if others_in_flight else 0
+            try:
+                # Past the window, still take whatever is already queued
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # Identical questions in one batch are embedded once
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                vectors = dict(zip(texts, self.base.embed_documents(texts)))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            with self._stats_lock:
+                self.batches += 1
+                self.queries += len(batch)
+                self.largest_batch = max(self.largest_batch, len(batch))
+            for text, future in batch:
+                future.set_result(vectors[text])
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "batches": self.batches,
+                "queries": self.queries,
+                "mean_batch_size": round(self.queries / self.batches, 2) if self.batches else 0.0,
+                "largest_batch": self.largest_batch,
+                "queued": self._queue.qsize(),
+            }
@@ -0,0 +1,86 @@
+"""
+Benchmark: one-at-a-time query embedding vs. micro-batching (batching_embeddings.py).
+
+Simulates N concurrent sessions, each embedding a stream of distinct
+questions, and reports throughput and per-query latency (p50 / p95) at each
+concurrency level for:
+
+  direct  - every caller runs its own forward pass (the current path)
+  batched - MicroBatchingEmbeddings with the given batch size and wait window
+
+By default the model is local_backends.FakeEmbeddingModel (a fixed per-call
+overhead plus a per-text cost, one forward pass at a time). --model runs the
+real all-mpnet-base-v2 through HuggingFaceEmbeddings instead.
+
+Usage:
+    python benchmarks/bench_embedding_batching.py [--concurrency 1,4,16,32] [--wait-ms 5] [--model]
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from batching_embeddings import MicroBatchingEmbeddings
+from local_backends import FakeEmbeddingModel
+
+
+def run(embed_query, concurrency: int, per_client: int) -> dict:
+    latencies = []
+    lock = threading.Lock()
+
+    def client(n: int):
+        for i in range(per_client):
+            start = time.perf_counter()
+            embed_query(f"session {n} question {i}: can I eat bananas with kidney disease?")
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+    ordered = sorted(latencies)
+    return {
+        "qps": len(ordered) / wall,
+        "p50_ms": statistics.median(ordered) * 1000,
+        "p95_ms": ordered[int(0.95 * (len(ordered) - 1))] * 1000,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,2,4,8,16,32")
+    parser.add_argument("--queries", type=int, default=256, help="Queries per concurrency level")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--wait-ms", type=float, default=5.0)
+    parser.add_argument("--model", action="store_true", help="Use the real all-mpnet-base-v2 model")
+    args = parser.parse_args()
+
+    if args.model:
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        model = HuggingFaceEmbeddings(model_name="all-mpnet-base-v2", model_kwargs={'device': 'cpu'})
+    else:
+        model = FakeEmbeddingModel()
+    batched = MicroBatchingEmbeddings(model, max_batch_size=args.batch_size, max_wait_ms=args.wait_ms)
+    batched.embed_query("warm-up")
+
+    print(f"batch size {args.batch_size}, wait window {args.wait_ms} ms, {args.queries} queries per level\n")
+    print(f"{'clients':>7} | {'direct q/s':>10} {'p50 ms':>8} {'p95 ms':>8} | "
+          f"{'batched q/s':>11} {'p50 ms':>8} {'p95 ms':>8} {'mean batch':>10}")
+    for concurrency in [int(c) for c in args.concurrency.split(",")]:
+        per_client = max(1, args.queries // concurrency)
+        direct = run(model.embed_query, concurrency, per_client)
+        before = batched.stats()
+        result = run(batched.embed_query, concurrency, per_client)
+        after = batched.stats()
+        batches = after["batches"] - before["batches"]
+        mean_batch = (after["queries"] - before["queries"]) / batches if batches else 0.0
+        print(f"{concurrency:>7} | {direct['qps']:>10.1f} {direct['p50_ms']:>8.1f} {direct['p95_ms']:>8.1f} | "
+              f"{result['qps']:>11.1f} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {mean_batch:>10.1f}")
@@ -0,0 +1,124 @@
+"""
+Benchmark: caller-side cost of logging, blocking file handler vs. queue mode.
+
+Logs the same records from several threads (simulating concurrent requests)
+through two loggers writing to temporary files:
+
+  sync  - LOG_MODE=sync: FileHandler with the text format, written by the
+          calling thread
+  queue - logger.py's default: its TracebackQueueHandler in the caller
+          (copies the record and formats the message), JSON-lines
+          RotatingFileHandler written by a QueueListener thread
+
+and reports the per-call latency seen by the callers (mean, p99, max) and the
+time until the queue mode's listener has written everything.
+
+On a local SSD both cost the caller about the same (roughly 35-40 us per call
+with the defaults on one CPU; the queue handler still copies the record and
+formats the message) and the GIL dominates. --disk-delay-ms adds a sleep to
+every write, as on a slow or network volume, which is where the blocking
+handler starts to stall requests (about 1.2 ms per call at 1 ms, vs. 35 us).
+
+Usage:
+    python benchmarks/bench_logging.py [--threads 8] [--records 2000] [--gap-ms 0.5] [--disk-delay-ms 1]
+"""
+import os
+import sys
+import time
+import queue
+import logging
+import tempfile
+import argparse
+import statistics
+import threading
+from logging.handlers import QueueListener, RotatingFileHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from logger import JsonLinesFormatter, ContextFilter, TracebackQueueHandler, formatter, log_context
+
+
+class SlowDisk(logging.Filter):
+    """
+    Sleeps before each write to simulate slow storage (runs in whichever
+    thread does the write).
+    """
+
+    def __init__(self, delay_seconds: float):
+        super().__init__()
+        self.delay_seconds = delay_seconds
+
+    def filter(self, record):
+        if self.delay_seconds:
+            time.sleep(self.delay_seconds)
+        return True
+
+
+def run_threads(logger: logging.Logger, threads: int, records: int, gap_seconds: float) -> list[float]:
+    latencies = [[] for _ in range(threads)]
+
+    def worker(n: int):
+        with log_context(request_id=f"req-{n}"):
+            for i in range(records):
+                start = time.perf_counter()
+                logger.info(f"Context source 'rag' finished in {i % 300} ms.",
+                            extra={"stage": "rag", "duration_ms": float(i % 300)})
+                latencies[n].append((time.perf_counter() - start) * 1e6)
+                # The rest of the request (waiting on the LLM, search, ...)
+                time.sleep(gap_seconds)
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return [value for per_thread in latencies for value in per_thread]
+
+
+def report(name: str, latencies: list[float], wall: float):
+    ordered = sorted(latencies)
+    print(f"{name:<6} per call mean {statistics.mean(ordered):7.1f} us  p99 {ordered[int(0.99 * (len(ordered) - 1))]:8.1f} us"
+          f"  max {ordered[-1] / 1000:7.2f} ms | all written after {wall:.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--records", type=int, default=2000, help="Records per thread")
+    parser.add_argument("--gap-ms", type=float, default=0.5, help="Pause between a thread's records (request work)")
+    parser.add_argument("--disk-delay-ms", type=float, default=0.0, help="Simulated extra latency per write")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Blocking file handler
+        sync_logger = logging.getLogger("bench-sync")
+        sync_logger.propagate = False
+        sync_logger.setLevel(logging.DEBUG)
+        sync_handler = logging.FileHandler(os.path.join(tmp, "sync.log"))
+        sync_handler.setFormatter(formatter)
+        sync_handler.addFilter(ContextFilter())
+        sync_handler.addFilter(SlowDisk(args.disk_delay_ms / 1000))
+        sync_logger.addHandler(sync_handler)
+        start = time.perf_counter()
+        latencies = run_threads(sync_logger, args.threads, args.records, args.gap_ms / 1000)
+        report("sync", latencies, time.perf_counter() - start)
+        sync_handler.close()
+
+        # Queue handler + background listener
+        queue_logger = logging.getLogger("bench-queue")
+        queue_logger.propagate = False
+        queue_logger.setLevel(logging.DEBUG)
+        file_handler = RotatingFileHandler(os.path.join(tmp, "queue.jsonl"), maxBytes=50 * 1024 * 1024, backupCount=1)
+        file_handler.setFormatter(JsonLinesFormatter())
+        file_handler.addFilter(SlowDisk(args.disk_delay_ms / 1000))
+        log_queue = queue.Queue(-1)
+        queue_handler = TracebackQueueHandler(log_queue)
+        queue_handler.addFilter(ContextFilter())
+        queue_logger.addHandler(queue_handler)
+        listener = QueueListener(log_queue, file_handler)
+        listener.start()
+        start = time.perf_counter()
+        latencies = run_threads(queue_logger, args.threads, args.records, args.gap_ms / 1000)
+        listener.stop()
+        report("queue", latencies, time.perf_counter() - start)
+        file_handler.close()
@@ -0,0 +1,114 @@
+"""
+Benchmark: per-call directory scan vs. the indexed PatientRegistry.
+
+Writes synthetic discharge reports into a temporary directory and times
+patient lookups both ways at 1k, 10k and 100k reports, plus the cost of an
+incremental refresh when nothing changed and when one report was added.
+
+Usage:
+    python benchmarks/bench_patient_registry.py [--sizes 1000,10000,100000] [--lookups 5]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from patient_registry import PatientRegistry
+
+DIAGNOSES = [
+    "Chronic Kidney Disease Stage 3",
+    "Acute Kidney Injury (AKI)",
+    "Nephrotic Syndrome",
+    "Kidney Stones",
+    "Polycystic Kidney Disease",
+]
+
+
+def write_synthetic_reports(data_dir: str, count: int):
+    """
+    Writes `count` synthetic reports shaped like the files in data/.
+    """
+    rng = random.Random(42)
+    for i in range(count):
+        report = {
+            "patient_name": f"Patient {i}",
+            "discharge_date": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "primary_diagnosis": rng.choice(DIAGNOSES),
+            "medications": ["Lisinopril 10mg daily"],
+            "dietary_restrictions": "Low sodium (2g/day)",
+            "follow_up": "Nephrology clinic in 2 weeks",
+            "warning_signs": ["Swelling"],
+            "discharge_instructions": "Monitor blood pressure daily",
+        }
+        with open(os.path.join(data_dir, f"patient-{i}.json"), 'w') as f:
+            json.dump(report, f)
+
+
+def legacy_scan(data_dir: str, patient_name: str) -> list[dict]:
+    """
+    The original get_patient_report lookup: open and parse every file.
+    """
+    found = []
+    for filename in os.listdir(data_dir):
+        if filename.endswith(".json"):
+            with open(os.path.join(data_dir, filename), 'r') as f:
+                report_data = json.load(f)
+                if report_data.get("patient_name", "").lower() == patient_name.lower():
+                    found.append(report_data)
+    return found
+
+
+def run(size: int, lookups: int):
+    with tempfile.TemporaryDirectory() as data_dir:
+        write_synthetic_reports(data_dir, size)
+        names = [f"Patient {random.Random(size + i).randrange(size)}" for i in range(lookups)]
+
+        start = time.perf_counter()
+        for name in names:
+            assert len(legacy_scan(data_dir, name)) == 1
+        scan_ms = (time.perf_counter() - start) * 1000 / lookups
+
+        registry = PatientRegistry(data_dir)
+        start = time.perf_counter()
+        registry.load()
+        load_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        for name in names:
+            assert len(registry.find_by_name(name)) == 1
+        indexed_ms = (time.perf_counter() - start) * 1000 / lookups
+
+        idle_refresh = registry.refresh(force=True)
+        add_synthetic_report(data_dir, size)
+        delta_refresh = registry.refresh(force=True)
+        assert delta_refresh["added"] == 1 and len(registry) == size + 1
+
+    print(f"{size:>8} reports | scan {scan_ms:10.2f} ms/lookup | "
+          f"registry load {load_ms:10.2f} ms once | indexed {indexed_ms * 1000:8.2f} us/lookup | "
+          f"speedup x{scan_ms / max(indexed_ms, 1e-9):,.0f}")
+    print(f"{'':>8}         | refresh (no changes) {idle_refresh['duration_ms']:8.2f} ms | "
+          f"refresh (1 new report) {delta_refresh['duration_ms']:8.2f} ms")
+
+
+def add_synthetic_report(data_dir: str, index: int):
+    """
+    Adds one more report, as a new discharge landing in data/ would.
+    """
+    with open(os.path.join(data_dir, f"patient-{index}.json"), 'w') as f:
+        json.dump({"patient_name": f"Patient {index}", "discharge_date": "2024-12-31",
+                   "primary_diagnosis": DIAGNOSES[0]}, f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--lookups", type=int, default=5)
+    args = parser.parse_args()
+
+    for size in [int(s) for s in args.sizes.split(",")]:
+        run(size, args.lookups)
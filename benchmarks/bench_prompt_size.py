@@ -0,0 +1,91 @@
+"""
+Benchmark: clinical prompt size before and after token budgeting.
+
+For every question in benchmarks/clinical_questions.jsonl, builds the
+original prompt (full pretty-printed report, four ~1000-char RAG chunks, raw
+web results) and the budgeted prompt at one or more token budgets, and
+reports estimated input tokens for each.
+
+The RAG context is four 1000-char chunks cut from the passages in
+benchmarks/retrieval_queries.json with the ingest splitter's 200-char
+overlap, one of them repeated with minor edits (as when two editions of a
+book are ingested). Web results are three long snippets with Tavily-style
+relevance scores.
+
+Usage:
+    python benchmarks/bench_prompt_size.py [--budgets 800,1500]
+"""
+import os
+import sys
+import json
+import logging
+import argparse
+import statistics
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+
+from patient_registry import PatientRegistry
+from prompt_builder import estimate_tokens
+from clinical_pipeline import build_clinical_prompt
+from logger import app_logger
+
+
+def fixed_rag_context() -> str:
+    with open(os.path.join(BENCH_DIR, "retrieval_queries.json"), 'r') as f:
+        text = " ".join(json.load(f)["passages"].values())
+    chunks = [text[i * 800:i * 800 + 1000] for i in range(3)]
+    chunks.append(chunks[0].replace("loop diuretic", "diuretic"))  # near-duplicate from a second edition
+    context = ""
+    for i, chunk in enumerate(chunks):
+        context += f"--- Relevant Context Chunk {i+1} (Source: reference_docs/nephrology_reference.pdf) ---\n"
+        context += chunk
+        context += "\n---------------------------------------------------\n"
+    return context
+
+
+def fixed_web_results(question: str) -> list[dict]:
+    body = ("Kidney health information for patients. " * 12).strip()
+    return [
+        {"url": "https://example.org/a", "content": f"{question} {body}", "score": 0.95},
+        {"url": "https://example.org/b", "content": f"Related: {body}", "score": 0.61},
+        {"url": "https://example.org/c", "content": f"Loosely related forum post. {body}", "score": 0.18},
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budgets", default="800,1500")
+    args = parser.parse_args()
+    budgets = [int(b) for b in args.budgets.split(",")]
+
+    # Keep the per-prompt log lines out of the table
+    app_logger.setLevel(logging.WARNING)
+
+    registry = PatientRegistry()
+    with open(os.path.join(BENCH_DIR, "clinical_questions.jsonl"), 'r') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+
+    rag_context = fixed_rag_context()
+    sizes = {"original": []} | {f"budget {b}": [] for b in budgets}
+    print(f"{'question':<58} {'original':>9} " + " ".join(f"{'@' + str(b):>9}" for b in budgets))
+    for record in records:
+        reports = registry.find_by_name(record["patient_name"])
+        if len(reports) > 1:
+            reports = registry.resolve_clarification(record["patient_name"], record.get("clarification", ""))
+        report, question = reports[0], record["question"]
+        web_results = fixed_web_results(question)
+
+        row = [estimate_tokens(build_clinical_prompt(report, question, rag_context, web_results, token_budget=None))]
+        for budget in budgets:
+            row.append(estimate_tokens(build_clinical_prompt(report, question, rag_context, web_results, budget)))
+        for key, value in zip(sizes, row):
+            sizes[key].append(value)
+        print(f"{question[:58]:<58} " + " ".join(f"{v:>9}" for v in row))
+
+    original = statistics.mean(sizes["original"])
+    print(f"\n{'mean estimated input tokens':<58} {original:>9.0f} " + " ".join(
+        f"{statistics.mean(sizes[f'budget {b}']):>9.0f}" for b in budgets))
+    for budget in budgets:
+        mean = statistics.mean(sizes[f"budget {budget}"])
+        print(f"budget {budget}: {100 * (1 - mean / original):.0f}% fewer input tokens than the original prompt")
@@ -0,0 +1,149 @@
+"""
+Benchmark: lexical (BM25), dense and hybrid retrieval on a fixed local query set.
+
+Uses the passages and labelled queries in benchmarks/retrieval_queries.json
+and reports query latency and recall@k for each mode:
+
+  lexical - BM25 only (no model)
+  dense   - all-mpnet-base-v2 cosine search (skipped if sentence-transformers is missing)
+  hybrid  - both, fused with reciprocal-rank fusion
+  auto    - lexical-only fast path for exact-term queries, hybrid otherwise
+  rerank  - what get_rag_context does: auto over a 20-chunk candidate pool,
+            reranked by the cross-encoder in reranker.py (stage timings shown)
+
+--filler N adds N synthetic distractor chunks to measure latency at scale
+(the dense modes index only the labelled passages).
+
+Usage:
+    python benchmarks/bench_retrieval.py [--k 4] [--filler 20000]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lexical_index import BM25Index, SearchHit, reciprocal_rank_fusion, tokenize
+from reranker import CrossEncoderReranker
+
+QUERY_SET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "retrieval_queries.json")
+CANDIDATES = 10
+RERANK_POOL = 20
+
+
+def load_dense_search(passages: dict):
+    """
+    Returns a dense search function over the passages, or None without sentence-transformers.
+    """
+    try:
+        import numpy as np
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        return None
+
+    model = SentenceTransformer("all-mpnet-base-v2", device="cpu")
+    ids = list(passages)
+    matrix = model.encode([passages[i] for i in ids], normalize_embeddings=True)
+
+    def dense_search(query: str, k: int) -> list[SearchHit]:
+        vector = model.encode([query], normalize_embeddings=True)[0]
+        scores = matrix @ vector
+        best = np.argsort(-scores)[:k]
+        return [SearchHit(ids[i], passages[ids[i]], {}, float(scores[i])) for i in best]
+
+    return dense_search
+
+
+def add_filler(index: BM25Index, passages: dict, count: int):
+    """
+    Adds distractor chunks: mostly words outside the query set's topic, with
+    about 5% of words borrowed from the passages so postings lists grow too.
+    """
+    rng = random.Random(7)
+    corpus_words = sorted({t for text in passages.values() for t in tokenize(text)})
+    other_words = ["".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(4, 10))) for _ in range(20000)]
+    index.add_documents(
+        (f"filler-{i}", " ".join(rng.choice(corpus_words) if rng.random() < 0.05 else rng.choice(other_words)
+                                 for _ in range(150)), {})
+        for i in range(count)
+    )
+
+
+def evaluate(name: str, search, queries: list, k: int):
+    latencies, recalls = [], []
+    for item in queries:
+        start = time.perf_counter()
+        hits = search(item["query"], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found = {hit.id for hit in hits}
+        recalls.append(len(found & set(item["relevant"])) / len(item["relevant"]))
+    p95 = sorted(latencies)[int(0.95 * (len(latencies) - 1))]
+    print(f"{name:<8} recall@{k} {statistics.mean(recalls):.3f} | "
+          f"latency mean {statistics.mean(latencies):8.2f} ms  p95 {p95:8.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--filler", type=int, default=0, help="Synthetic distractor chunks to add")
+    args = parser.parse_args()
+
+    with open(QUERY_SET, 'r') as f:
+        data = json.load(f)
+    passages, queries = data["passages"], data["queries"]
+
+    index = BM25Index()
+    start = time.perf_counter()
+    index.add_documents((pid, text, {}) for pid, text in passages.items())
+    add_filler(index, passages, args.filler)
+    print(f"Lexical index: {len(index)} chunks, {len(index.postings)} terms, "
+          f"built in {(time.perf_counter() - start) * 1000:.1f} ms (including filler generation)")
+
+    def lexical(query, k):
+        return index.search(query, k=k)
+
+    evaluate("lexical", lexical, queries, args.k)
+
+    dense_search = load_dense_search(passages)
+    if dense_search is None:
+        print("dense    skipped (sentence-transformers not installed)")
+        fast = sum(index.is_exact_term_query(q["query"]) for q in queries)
+        print(f"auto     {fast}/{len(queries)} queries would take the lexical-only fast path")
+        sys.exit(0)
+
+    def dense(query, k):
+        return dense_search(query, k)
+
+    def hybrid(query, k):
+        return reciprocal_rank_fusion([dense_search(query, CANDIDATES), index.search(query, k=CANDIDATES)], k=k)
+
+    def auto(query, k):
+        if index.is_exact_term_query(query):
+            hits = index.search(query, k=k)
+            if hits:
+                return hits
+        return hybrid(query, k)
+
+    evaluate("dense", dense, queries, args.k)
+    evaluate("hybrid", hybrid, queries, args.k)
+    evaluate("auto", auto, queries, args.k)
+
+    reranker = CrossEncoderReranker()
+    reranker.get_model()
+    stage_ms = {"candidates": [], "rerank": []}
+
+    def rerank(query, k):
+        start = time.perf_counter()
+        candidates = auto(query, RERANK_POOL)
+        stage_ms["candidates"].append((time.perf_counter() - start) * 1000)
+        hits, stats = reranker.rerank(query, candidates, k)
+        stage_ms["rerank"].append(stats["rerank_ms"])
+        return hits
+
+    evaluate("rerank", rerank, queries, args.k)
+    print(f"         stage means: candidates {statistics.mean(stage_ms['candidates']):.2f} ms, "
+          f"rerank {statistics.mean(stage_ms['rerank']):.2f} ms, {reranker.fallbacks} fallback(s) to stage-one order")
@@ -0,0 +1,68 @@
+"""
+Benchmark: cold-start cost of importing agent_tool.
+
+Each scenario runs in a fresh Python process and reports wall time and peak
+RSS:
+
+  import only      - what the receptionist / patient-lookup path pays now
+                     that the embedding model and Chroma load lazily
+  import + warm-up - the previous eager behaviour (model and DB loaded up
+                     front), i.e. the cost that moved to the first RAG use
+  first lookup     - import plus one get_patient_report call
+
+Usage:
+    python benchmarks/bench_startup.py [--repeat 3]
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+SCENARIOS = {
+    "import only": "import agent_tool",
+    "import + warm-up": "import agent_tool; agent_tool.warm_up_rag()",
+    "first lookup": "import agent_tool; agent_tool.get_patient_report.func('John Smith')",
+}
+
+# Runs inside the child process; prints one JSON line with the measurements
+CHILD_TEMPLATE = """
+import json, time, resource, io, contextlib
+start = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    {statement}
+elapsed = time.perf_counter() - start
+# ru_maxrss is KiB on Linux and bytes on macOS
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+rss_mb = rss / 1024 / 1024 if __import__("sys").platform == "darwin" else rss / 1024
+print(json.dumps({{"seconds": elapsed, "rss_mb": rss_mb}}))
+"""
+
+
+def run_scenario(statement: str) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD_TEMPLATE.format(statement=statement)],
+        cwd=REPO_ROOT, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr else "child process failed")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for name, statement in SCENARIOS.items():
+        try:
+            runs = [run_scenario(statement) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print(f"{name:<18} failed: {e}")
+            continue
+        seconds = statistics.median(r["seconds"] for r in runs)
+        rss_mb = statistics.median(r["rss_mb"] for r in runs)
+        print(f"{name:<18} {seconds:8.2f} s   peak RSS {rss_mb:8.1f} MB   (median of {args.repeat})")
@@ -0,0 +1,176 @@
+"""
+Benchmark: Chroma vs. the quantized, memory-mapped IVF store (quantized_index.py).
+
+Generates clustered, normalized 768-dim vectors (like all-mpnet-base-v2
+embeddings of book chunks) and queries that are perturbed chunks, then for
+each backend reports:
+
+  build   - seconds to add every vector and persist the index
+  disk    - on-disk size of the index
+  memory  - resident memory a fresh process gains by opening the index and
+            running every query, split into private memory (RssAnon, paid
+            by every process) and file-backed pages (RssFile, memory-mapped
+            index files shared by all processes through the page cache)
+  latency - per-query p50 / p95
+  recall  - recall@4 against exact float32 search
+
+Build and query each run in their own process, so memory is that of a reader
+such as a Streamlit worker. Chroma is skipped if chromadb is not installed.
+
+Usage:
+    python benchmarks/bench_vector_backends.py [--chunks 50000] [--queries 200]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+
+DIM = 768
+K = 4
+
+
+def make_data(workdir: str, chunks: int, queries: int, seed: int = 3):
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(max(8, chunks // 100), DIM)).astype(np.float32)
+    vectors = topics[rng.integers(0, len(topics), chunks)] + 0.8 * rng.normal(size=(chunks, DIM)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    picked = vectors[rng.choice(chunks, queries, replace=False)]
+    query_vectors = picked + 0.3 * rng.normal(size=picked.shape).astype(np.float32)
+    query_vectors /= np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    truth = np.argsort(-(query_vectors @ vectors.T), axis=1)[:, :K]
+    np.save(os.path.join(workdir, "vectors.npy"), vectors)
+    np.save(os.path.join(workdir, "queries.npy"), query_vectors)
+    np.save(os.path.join(workdir, "truth.npy"), truth)
+
+
+def memory_kb() -> dict:
+    with open("/proc/self/status", 'r') as f:
+        fields = dict(line.split(":", 1) for line in f)
+    return {key: int(fields[key].split()[0]) for key in ("RssAnon", "RssFile")}
+
+
+def dir_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+# --- Backends (run inside the child process) ---
+
+def build_quantized(index_dir: str, vectors: np.ndarray):
+    from quantized_index import QuantizedVectorStore
+
+    store = QuantizedVectorStore(index_dir)
+    ids = [str(i) for i in range(len(vectors))]
+    store.add_embeddings(ids, [f"chunk {i}" for i in ids], [{"source": "bench"} for _ in ids], vectors)
+    store.persist()
+
+
+def open_quantized(index_dir: str):
+    from quantized_index import QuantizedVectorStore
+
+    store = QuantizedVectorStore(index_dir)
+    return lambda vector: [int(hit.id) for hit in store.similarity_search_by_vector(vector, k=K)]
+
+
+def build_chroma(index_dir: str, vectors: np.ndarray):
+    import chromadb
+
+    collection = chromadb.PersistentClient(path=index_dir).get_or_create_collection(
+        "bench", metadata={"hnsw:space": "cosine"})
+    for start in range(0, len(vectors), 5000):
+        batch = vectors[start:start + 5000]
+        ids = [str(i) for i in range(start, start + len(batch))]
+        collection.add(ids=ids, embeddings=batch.tolist(), documents=[f"chunk {i}" for i in ids],
+                       metadatas=[{"source": "bench"} for _ in ids])
+
+
+def open_chroma(index_dir: str):
+    import chromadb
+
+    collection = chromadb.PersistentClient(path=index_dir).get_collection("bench")
+    return lambda vector: [int(i) for i in collection.query(query_embeddings=[vector.tolist()], n_results=K)["ids"][0]]
+
+
+BACKENDS = {"chroma": (build_chroma, open_chroma), "quantized": (build_quantized, open_quantized)}
+
+
+def child(role: str, backend: str, workdir: str):
+    build, open_index = BACKENDS[backend]
+    index_dir = os.path.join(workdir, f"index-{backend}")
+    if role == "build":
+        vectors = np.load(os.path.join(workdir, "vectors.npy"))
+        start = time.perf_counter()
+        build(index_dir, vectors)
+        print(json.dumps({"build_seconds": time.perf_counter() - start, "disk_bytes": dir_bytes(index_dir)}))
+        return
+
+    queries = np.load(os.path.join(workdir, "queries.npy"))
+    truth = np.load(os.path.join(workdir, "truth.npy"))
+    baseline = memory_kb()
+    search = open_index(index_dir)
+    latencies, recalls = [], []
+    for vector, relevant in zip(queries, truth):
+        start = time.perf_counter()
+        found = search(vector)
+        latencies.append(time.perf_counter() - start)
+        recalls.append(len(set(found) & set(relevant.tolist())) / K)
+    memory = memory_kb()
+    print(json.dumps({
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p95_ms": float(np.percentile(latencies, 95) * 1000),
+        "recall": float(np.mean(recalls)),
+        "private_mb": (memory["RssAnon"] - baseline["RssAnon"]) / 1024,
+        "shared_mb": (memory["RssFile"] - baseline["RssFile"]) / 1024,
+    }))
+
+
+def run_child(role: str, backend: str, workdir: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", role, "--backend", backend, "--workdir", workdir],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--child", choices=["build", "query"], help=argparse.SUPPRESS)
+    parser.add_argument("--backend", choices=list(BACKENDS), help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.backend, args.workdir)
+        sys.exit(0)
+
+    workdir = tempfile.mkdtemp(prefix="bench-vectors-")
+    try:
+        make_data(workdir, args.chunks, args.queries)
+        print(f"{args.chunks} chunks x {DIM} dims (float32 payload {args.chunks * DIM * 4 / 2**20:.0f} MB), "
+              f"{args.queries} queries, recall@{K} vs exact search\n")
+        print(f"{'backend':<10} {'build s':>8} {'disk MB':>8} {'priv MB':>8} {'shrd MB':>8} "
+              f"{'p50 ms':>8} {'p95 ms':>8} {'recall@4':>9}")
+        for backend in BACKENDS:
+            if backend == "chroma":
+                try:
+                    import chromadb  # noqa: F401
+                except ImportError:
+                    print(f"{backend:<10} skipped (chromadb not installed)")
+                    continue
+            built = run_child("build", backend, workdir)
+            queried = run_child("query", backend, workdir)
+            print(f"{backend:<10} {built['build_seconds']:8.2f} {built['disk_bytes'] / 2**20:8.1f} "
+                  f"{queried['private_mb']:8.1f} {queried['shared_mb']:8.1f} {queried['p50_ms']:8.2f} "
+                  f"{queried['p95_ms']:8.2f} {queried['recall']:9.3f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
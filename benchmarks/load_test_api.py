@@ -0,0 +1,130 @@
+"""
+Load test for api.py against local mock backends.
+
+Starts benchmarks/mock_backends.py (fake Gemini + Tavily) and the API service
+(with API_USE_LOCAL_RAG=1) as uvicorn subprocesses, then fires clinical
+questions at a fixed concurrency and reports requests/sec, time to first
+byte and total latency percentiles, plus how many requests were shed (503).
+
+Usage:
+    python benchmarks/load_test_api.py [--requests 200] [--concurrency 32] [--limit 16]
+    python benchmarks/load_test_api.py --url http://localhost:8000   # an already running API
+"""
+import os
+import sys
+import math
+import time
+import asyncio
+import argparse
+import subprocess
+
+import httpx
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+QUESTIONS = [
+    ("Jane Doe", "Why should I avoid ibuprofen?"),
+    ("Sophia Lee", "When can I restart metformin?"),
+    ("Daniel Smith", "What does furosemide do?"),
+    ("Sarah Chen", "What warning signs should I watch for?"),
+]
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    # Nearest rank: smallest value with at least q% of the values at or below it
+    rank = math.ceil(round(q / 100 * len(ordered), 9))
+    return ordered[min(len(ordered), max(1, rank)) - 1]
+
+
+def start_server(module: str, port: int, env: dict) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", module, "--port", str(port), "--log-level", "warning"],
+        cwd=REPO_ROOT, env={**os.environ, **env}, stdout=subprocess.DEVNULL,
+    )
+
+
+async def wait_until_up(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+async def one_request(client: httpx.AsyncClient, base_url: str, i: int) -> dict:
+    name, question = QUESTIONS[i % len(QUESTIONS)]
+    start = time.perf_counter()
+    first_byte = None
+    async with client.stream("POST", f"{base_url}/clinical/ask", json={"patient_name": name, "question": question}) as response:
+        async for _ in response.aiter_bytes():
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+    return {"status": response.status_code, "ttfb": first_byte, "total": time.perf_counter() - start}
+
+
+async def run_load(base_url: str, requests: int, concurrency: int) -> tuple[list[dict], float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        async def bounded(i):
+            async with semaphore:
+                return await one_request(client, base_url, i)
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(bounded(i) for i in range(requests)))
+    return results, time.perf_counter() - start
+
+
+def report(results: list[dict], wall_seconds: float, concurrency: int):
+    ok = [r for r in results if r["status"] == 200]
+    shed = sum(1 for r in results if r["status"] == 503)
+    print(f"concurrency {concurrency}: {len(results)} requests in {wall_seconds:.2f}s -> "
+          f"{len(ok) / wall_seconds:.1f} req/s ok, {shed} shed (503), "
+          f"{len(results) - len(ok) - shed} other errors")
+    if not ok:
+        return
+    for label, key in (("TTFB", "ttfb"), ("total", "total")):
+        values = [r[key] for r in ok if r[key] is not None]
+        print(f"  {label:<6} p50 {percentile(values, 50) * 1000:8.1f} ms   p95 {percentile(values, 95) * 1000:8.1f} ms"
+              f"   p99 {percentile(values, 99) * 1000:8.1f} ms")
+
+
+async def main(args):
+    processes = []
+    base_url = args.url
+    try:
+        if base_url is None:
+            mock_port, api_port = args.port + 1, args.port
+            processes.append(start_server("benchmarks.mock_backends:app", mock_port, {}))
+            processes.append(start_server("api:app", api_port, {
+                "GEMINI_BASE_URL": f"http://127.0.0.1:{mock_port}",
+                "TAVILY_BASE_URL": f"http://127.0.0.1:{mock_port}",
+                "API_USE_LOCAL_RAG": "1",
+                "API_MAX_CONCURRENT_CLINICAL": str(args.limit),
+            }))
+            base_url = f"http://127.0.0.1:{api_port}"
+            await wait_until_up(f"http://127.0.0.1:{mock_port}/docs")
+        await wait_until_up(f"{base_url}/health")
+
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            results, wall_seconds = await run_load(base_url, args.requests, concurrency)
+            report(results, wall_seconds, concurrency)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", default="8,32,64", help="Comma-separated client concurrency levels")
+    parser.add_argument("--limit", type=int, default=16, help="API_MAX_CONCURRENT_CLINICAL for the spawned API")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--url", default=None, help="Test an already running API instead of spawning one")
+    asyncio.run(main(parser.parse_args()))
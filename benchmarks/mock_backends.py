@@ -0,0 +1,57 @@
+"""
+Local mock of the Gemini and Tavily REST APIs for load testing api.py.
+
+Latencies are configurable through environment variables:
+    MOCK_LLM_FIRST_TOKEN_MS (default 300), MOCK_LLM_TOKENS (40),
+    MOCK_LLM_TOKEN_MS (15), MOCK_SEARCH_MS (400)
+
+Run with:
+    uvicorn benchmarks.mock_backends:app --port 8901
+"""
+import os
+import json
+import asyncio
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+FIRST_TOKEN_SECONDS = float(os.getenv("MOCK_LLM_FIRST_TOKEN_MS", "300")) / 1000
+TOKENS = int(os.getenv("MOCK_LLM_TOKENS", "40"))
+TOKEN_SECONDS = float(os.getenv("MOCK_LLM_TOKEN_MS", "15")) / 1000
+SEARCH_SECONDS = float(os.getenv("MOCK_SEARCH_MS", "400")) / 1000
+
+app = FastAPI(title="Mock Gemini + Tavily")
+
+
+def gemini_payload(text: str) -> dict:
+    return {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}}]}
+
+
+@app.post("/v1beta/models/{model_action}")
+async def gemini(model_action: str, request: Request):
+    await request.json()
+    if model_action.endswith(":streamGenerateContent"):
+        async def events():
+            await asyncio.sleep(FIRST_TOKEN_SECONDS)
+            for i in range(TOKENS):
+                if i:
+                    await asyncio.sleep(TOKEN_SECONDS)
+                yield f"data: {json.dumps(gemini_payload(f'token{i} '))}\r\n\r\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    await asyncio.sleep(FIRST_TOKEN_SECONDS + TOKENS * TOKEN_SECONDS)
+    return gemini_payload(" ".join(f"token{i}" for i in range(TOKENS)))
+
+
+@app.post("/search")
+async def tavily_search(request: Request):
+    body = await request.json()
+    await asyncio.sleep(SEARCH_SECONDS)
+    return {
+        "query": body.get("query"),
+        "results": [
+            {"title": f"Result {i + 1}", "url": f"https://example.org/{i + 1}",
+             "content": f"Mock search result {i + 1} for {body.get('query')}", "score": 0.9 - 0.1 * i}
+            for i in range(body.get("max_results", 3))
+        ],
+    }
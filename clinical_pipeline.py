@@ -0,0 +1,317 @@
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from logger import app_logger, log_stage
+from metrics import metrics, profile_if_slow, submit_in_context
+from prompt_builder import build_budgeted_prompt, build_general_prompt, estimate_tokens, DEFAULT_TOKEN_BUDGET
+from semantic_cache import SemanticAnswerCache
+
+# LLM names recorded with precomputed greetings (precompute.py); the app uses the same live model
+LIVE_LLM_NAME = "gemini-pro-latest"
+FAKE_LLM_NAME = "fake"
+
+# --- Per-source time limits for the context-gathering stage (seconds) ---
+RAG_TIMEOUT_SECONDS = 20.0
+WEB_SEARCH_TIMEOUT_SECONDS = 8.0
+
+# Upper bound for the one-time RAG model / database load (see rag_prepare), which
+# does not count against RAG_TIMEOUT_SECONDS
+RAG_LOAD_TIMEOUT_SECONDS = 180.0
+
+# Fallback text handed to the LLM when a source times out or fails
+RAG_UNAVAILABLE = "Reference book context is unavailable for this question."
+WEB_UNAVAILABLE = "Web search results are unavailable for this question; answer from the reference book only."
+
+
+def _timed_call(fn, query, prepare=None, prepared=None):
+    if prepare is not None:
+        try:
+            prepare()
+        finally:
+            prepared.set()
+    start = time.perf_counter()
+    result = fn(query)
+    return result, time.perf_counter() - start
+
+
+def gather_clinical_context(query: str, rag_fn, web_fn,
+                            rag_timeout: float = RAG_TIMEOUT_SECONDS,
+                            web_timeout: float = WEB_SEARCH_TIMEOUT_SECONDS,
+                            rag_prepare=None) -> dict:
+    """
+    Runs the RAG lookup and the web search for a question at the same time.
+
+    Each source gets its own timeout, measured from when the fan-out started.
+    Every turn has its own two-thread pool, so both sources start at once
+    instead of queueing behind other sessions' turns. A slow or failing
+    source is replaced by a short "unavailable" note, so a web search problem
+    degrades the answer to RAG-only context instead of blocking it.
+
+    `rag_prepare` (e.g. agent_tool.load_rag_components) runs first on the RAG
+    thread, and the RAG timeout only starts once it returns: the one-time
+    model and database load after a cold start (up to
+    RAG_LOAD_TIMEOUT_SECONDS) does not cost the first question its context.
+
+    Returns a dict with "rag_context", "web_context" and per-source "timings"
+    (seconds, or None if the source did not finish in time).
+    """
+    start = time.perf_counter()
+    sources = {
+        "rag": (rag_fn, rag_timeout, RAG_UNAVAILABLE),
+        "web_search": (web_fn, web_timeout, WEB_UNAVAILABLE),
+    }
+    # Not a `with` block: a source that overruns its timeout never blocks the
+    # answer, we stop waiting for it and its thread finishes in the background.
+    executor = ThreadPoolExecutor(max_workers=len(sources), thread_name_prefix="clinical-context")
+    rag_prepared = threading.Event()
+    # Each source runs in a copy of the caller's context, so its log records keep the request/session ids
+    # (and a profiled turn includes it)
+    futures = {
+        "rag": submit_in_context(executor, _timed_call, rag_fn, query, rag_prepare, rag_prepared),
+        "web_search": submit_in_context(executor, _timed_call, web_fn, query),
+    }
+    executor.shutdown(wait=False)
+
+    results, timings = {}, {}
+    for name, (_, timeout, fallback) in sources.items():
+        source_start = start
+        if name == "rag" and rag_prepare is not None:
+            rag_prepared.wait(RAG_LOAD_TIMEOUT_SECONDS)
+            source_start = time.perf_counter()
+        remaining = max(0.0, source_start + timeout - time.perf_counter())
+        try:
+            results[name], timings[name] = futures[name].result(timeout=remaining)
+            app_logger.info(f"Context source '{name}' finished in {timings[name] * 1000:.0f} ms.",
+                            extra={"stage": name, "duration_ms": round(timings[name] * 1000, 3)})
+        except FutureTimeoutError:
+            results[name], timings[name] = fallback, None
+            app_logger.warning(f"Context source '{name}' timed out after {timeout:.1f}s; continuing without it.",
+                               extra={"stage": name, "timed_out": True})
+        except Exception as e:
+            results[name], timings[name] = fallback, None
+            app_logger.error(f"Context source '{name}' failed: {e}; continuing without it.")
+
+    log_stage("context", time.perf_counter() - start)
+    metrics.observe("context", time.perf_counter() - start)
+    return {
+        "rag_context": results["rag"],
+        "web_context": results["web_search"],
+        "timings": timings,
+    }
+
+
+def stream_llm_response(llm, prompt: str, on_text=None, label: str = "LLM") -> tuple[str, dict]:
+    """
+    Streams an LLM reply chunk by chunk.
+
+    `on_text` is called with the accumulated text after every chunk (e.g. to
+    update a Streamlit placeholder). Returns the complete text and timings:
+    "time_to_first_token" and "total" in seconds.
+    """
+    start = time.perf_counter()
+    first_token = None
+    parts = []
+    for chunk in llm.stream(prompt):
+        text = chunk.content if hasattr(chunk, "content") else str(chunk)
+        if not text:
+            continue
+        if first_token is None:
+            first_token = time.perf_counter() - start
+        parts.append(text)
+        if on_text is not None:
+            on_text("".join(parts))
+
+    timings = {"time_to_first_token": first_token, "total": time.perf_counter() - start}
+    metrics.observe("llm", timings["total"], label=label)
+    if first_token is not None:
+        metrics.observe("llm_first_token", first_token, label=label)
+    ttft_ms = f"{first_token * 1000:.0f} ms" if first_token is not None else "n/a"
+    app_logger.info(f"{label} streamed: time to first token {ttft_ms}, total {timings['total'] * 1000:.0f} ms.",
+                    extra={"stage": "llm", "label": label, "duration_ms": round(timings["total"] * 1000, 3),
+                           "first_token_ms": round(first_token * 1000, 3) if first_token is not None else None})
+    return "".join(parts), timings
+
+
+def invoke_llm(llm, prompt: str, label: str = "LLM") -> tuple[str, dict]:
+    """
+    Non-streaming counterpart of stream_llm_response(). The first token only
+    becomes visible with the full reply, so both timings are the same.
+    """
+    start = time.perf_counter()
+    text = llm.invoke(prompt).content
+    total = time.perf_counter() - start
+    metrics.observe("llm", total, label=label)
+    app_logger.info(f"{label} generated in {total * 1000:.0f} ms (no streaming).",
+                    extra={"stage": "llm", "label": label, "duration_ms": round(total * 1000, 3)})
+    return text, {"time_to_first_token": total, "total": total}
+
+
+def build_clinical_prompt(patient_report, question: str, rag_context, web_context,
+                          token_budget: int | None = DEFAULT_TOKEN_BUDGET) -> str:
+    """
+    Builds the clinical agent's prompt from the patient's report (JSON string
+    or dict), their question and the retrieved context.
+
+    The prompt is assembled within `token_budget` estimated input tokens (see
+    prompt_builder.build_budgeted_prompt). token_budget=None gives the
+    original prompt with the full report and untrimmed context.
+    """
+    if token_budget is not None:
+        report = json.loads(patient_report) if isinstance(patient_report, str) else patient_report
+        prompt, _ = build_budgeted_prompt(report, question, rag_context, web_context, token_budget)
+        return prompt
+
+    if not isinstance(patient_report, str):
+        patient_report = json.dumps(patient_report, indent=2)
+    return f"""
+    You are an expert AI assistant specializing in nephrology.
+    Your primary duty is to answer a patient's question.
+
+    Here is the patient's information:
+    ---
+    PATIENT DISCHARGE REPORT:
+    {patient_report}
+    ---
+    PATIENT'S QUESTION:
+    "{question}"
+    ---
+
+    Here is the context you have retrieved to answer the question:
+    ---
+    CONTEXT FROM NEPHROLOGY REFERENCE BOOK (RAG):
+    {rag_context}
+    ---
+    CONTEXT FROM WEB SEARCH:
+    {web_context}
+    ---
+
+    INSTRUCTIONS:
+    1.  Answer the patient's question based *first* on the REFERENCE BOOK context and their DISCHARGE REPORT.
+    2.  If the question is about new research or information not in the book, use the WEB SEARCH context.
+    3.  You *must* cite your sources. Use "(Source: Reference Book)" or "(Source: Web Search)".
+    4.  Be helpful, accurate, and safe.
+    5.  You *must* end your entire response with the following medical disclaimer:
+        "Disclaimer: I am an AI assistant for educational purposes only. Always consult healthcare professionals for medical advice."
+    """
+
+
+def answer_clinical_question(question: str, patient_report, llm, rag_fn, web_fn,
+                             stream: bool = False, on_text=None, answer_cache=None, bundle: dict | None = None,
+                             rag_prepare=None) -> dict:
+    """
+    Runs one clinical agent turn, for the Streamlit app and offline runs alike.
+
+    General questions (no report field needed, see
+    SemanticAnswerCache.is_patient_specific_question) are answered from a
+    prompt with only the diagnosis, so their answers can be shared through
+    `answer_cache` (a SemanticAnswerCache, optional). Personal questions get
+    the relevant report fields, plus the patient's pre-retrieved chunks from
+    `bundle` (precompute.py, optional). Context gathering is concurrent (see
+    gather_clinical_context for `rag_prepare`); `stream`/`on_text` as in
+    stream_llm_response.
+
+    Returns {"answer", "prompt", "prompt_tokens", "personal", "cached",
+    "timings"}; timings are seconds per stage ("rag", "web_search",
+    "context", "prompt", "llm_first_token", "llm", "total"), None for stages
+    a cached answer skipped.
+    """
+    start = time.perf_counter()
+    report = json.loads(patient_report) if isinstance(patient_report, str) else patient_report
+    diagnosis = report.get("primary_diagnosis", "")
+    personal = SemanticAnswerCache.is_patient_specific_question(question, report)
+    timings = dict.fromkeys(["rag", "web_search", "context", "prompt", "llm_first_token", "llm"])
+
+    # Reuse an earlier answer to a near-identical general question about the same diagnosis
+    cached = None
+    if answer_cache is not None and not personal:
+        try:
+            cached = answer_cache.lookup(question, diagnosis, report)
+        except Exception as e:
+            app_logger.error(f"Semantic cache lookup failed: {e}")
+    if cached:
+        app_logger.info(f"Served answer from semantic cache (similarity {cached['similarity']:.3f}, "
+                        f"matched '{cached['cached_question']}').")
+        if on_text is not None:
+            on_text(cached["answer"])
+        timings["total"] = time.perf_counter() - start
+        return {"answer": cached["answer"], "prompt": None, "prompt_tokens": 0, "personal": False,
+                "cached": True, "timings": timings}
+
+    # With PROFILE_SLOW_SECONDS set, a slow turn is saved as a cProfile profile
+    with profile_if_slow("clinical_turn"):
+        context = gather_clinical_context(question, rag_fn, web_fn, rag_prepare=rag_prepare)
+        context_done = time.perf_counter()
+
+        # With the report for questions about it, with only the diagnosis for general (cacheable) ones
+        if personal:
+            rag_context = context["rag_context"]
+            if bundle:
+                from precompute import seed_rag_context
+
+                # Add the patient's pre-retrieved chunks that match the question
+                rag_context = seed_rag_context(bundle, question, rag_context)
+            prompt = build_clinical_prompt(report, question, rag_context, context["web_context"])
+        else:
+            prompt, _ = build_general_prompt(diagnosis, question, context["rag_context"], context["web_context"])
+        prompt_done = time.perf_counter()
+
+        if stream:
+            answer, llm_timings = stream_llm_response(llm, prompt, on_text=on_text, label="Clinical answer")
+        else:
+            answer, llm_timings = invoke_llm(llm, prompt, label="Clinical answer")
+
+    timings.update({
+        "rag": context["timings"]["rag"],
+        "web_search": context["timings"]["web_search"],
+        "context": context_done - start,
+        "prompt": prompt_done - context_done,
+        "llm_first_token": llm_timings["time_to_first_token"],
+        "llm": llm_timings["total"],
+        "total": time.perf_counter() - start,
+    })
+    metrics.observe("clinical_turn", timings["total"])
+    log_stage("clinical_turn", timings["total"], personal=personal,
+              timings_ms={k: round(v * 1000, 3) if v is not None else None for k, v in timings.items()})
+
+    # Answers to general questions (generated without the report) are shared with similar questions
+    if answer_cache is not None and not personal:
+        try:
+            answer_cache.store(question, diagnosis, answer, timings["total"], report)
+        except Exception as e:
+            app_logger.error(f"Semantic cache store failed: {e}")
+    return {"answer": answer, "prompt": prompt, "prompt_tokens": estimate_tokens(prompt), "personal": personal,
+            "cached": False, "timings": timings}
+
+
+def build_backends(live: bool, rag_mode: str):
+    """
+    Returns (llm, rag_fn, web_fn) for offline runs (batch_eval, precompute):
+    Gemini and Tavily with live=True, else the local stand-ins; the RAG tool
+    in `rag_mode`, or the reference stand-in for rag_mode="fake".
+    """
+    if live:
+        from dotenv import load_dotenv
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        from langchain_community.tools import TavilySearchResults
+
+        load_dotenv()
+        llm = ChatGoogleGenerativeAI(model=LIVE_LLM_NAME, google_api_key=os.getenv("GEMINI_API_KEY"))
+        web_fn = TavilySearchResults(k=3, tavily_api_key=os.getenv("TAVILY_API_KEY")).invoke
+    else:
+        from local_backends import FakeStreamingLLM, FakeWebSearch
+
+        llm = FakeStreamingLLM()
+        web_fn = FakeWebSearch().invoke
+
+    if rag_mode == "fake":
+        from local_backends import FakeReferenceRAG
+
+        rag_fn = FakeReferenceRAG()
+    else:
+        import agent_tool
+        agent_tool.RAG_RETRIEVAL_MODE = rag_mode
+        rag_fn = agent_tool.get_rag_context.func
+    return llm, rag_fn, web_fn
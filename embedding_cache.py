@@ -0,0 +1,221 @@
+import os
+import mmap
+import hashlib
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+
+try:
+    import fcntl  # Serializes appends between processes (not available on Windows)
+except ImportError:
+    fcntl = None
+
+# Define the directory where cached vectors are stored
+EMBEDDING_CACHE_DIR = "embedding_cache"
+
+# Number of vectors kept in the in-memory LRU tier
+DEFAULT_MEMORY_ITEMS = 4096
+
+VECTORS_FILENAME = "vectors.f32"
+INDEX_FILENAME = "index.tsv"
+FLOAT_SIZE = array('f').itemsize
+
+
+def normalize_text(text: str) -> str:
+    """
+    Canonical form of a text for cache keys: NFC, stripped, whitespace collapsed.
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class EmbeddingDiskStore:
+    """
+    Append-only on-disk vector store for one embedding model.
+
+    Vectors live back to back as raw float32 in `vectors.f32`, which is read
+    through a memory map. `index.tsv` maps each key to its row and is only
+    appended after the vector bytes are on disk, so a crash can at worst leave
+    an unreferenced vector behind (a partially written one is cut off before
+    the next append).
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.vectors_path = os.path.join(directory, VECTORS_FILENAME)
+        self.index_path = os.path.join(directory, INDEX_FILENAME)
+        self.dim = None
+        self._rows = {}     # key -> row number
+        self._mmap = None
+        self._mapped_size = 0
+        self._lock = threading.Lock()
+        self._load_index()
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return
+        vectors_size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        with open(self.index_path, 'r') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) != 3:
+                    continue  # Partially written last line
+                key, row, dim = parts[0], int(parts[1]), int(parts[2])
+                # Ignore rows whose vector bytes are not fully on disk
+                if (row + 1) * dim * FLOAT_SIZE <= vectors_size:
+                    self._rows[key] = row
+                    self.dim = dim
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _remap(self):
+        size = os.path.getsize(self.vectors_path)
+        if self._mmap is not None:
+            self._mmap.close()
+        with open(self.vectors_path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mapped_size = size
+
+    def get(self, key: str) -> list[float] | None:
+        row = self._rows.get(key)
+        if row is None:
+            return None
+        with self._lock:
+            start = row * self.dim * FLOAT_SIZE
+            end = start + self.dim * FLOAT_SIZE
+            if end > self._mapped_size:
+                self._remap()
+            return array('f', self._mmap[start:end]).tolist()
+
+    def put_many(self, items: list[tuple[str, list[float]]]):
+        """
+        Appends vectors for keys that are not stored yet.
+        """
+        with self._lock:
+            items = [(key, vector) for key, vector in items if key not in self._rows]
+            if not items:
+                return
+            if self.dim is None:
+                self.dim = len(items[0][1])
+
+            with open(self.vectors_path, 'ab') as vectors_file, open(self.index_path, 'a') as index_file:
+                if fcntl is not None:
+                    fcntl.flock(vectors_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    vectors_file.seek(0, os.SEEK_END)
+                    row_size = self.dim * FLOAT_SIZE
+                    first_row = vectors_file.tell() // row_size
+                    # Drop the partial row a crash mid-write may have left, so new rows start on a boundary
+                    if vectors_file.tell() != first_row * row_size:
+                        vectors_file.truncate(first_row * row_size)
+                    data = array('f')
+                    for _, vector in items:
+                        data.extend(vector)
+                    vectors_file.write(data.tobytes())
+                    vectors_file.flush()
+
+                    lines = []
+                    for offset, (key, _) in enumerate(items):
+                        self._rows[key] = first_row + offset
+                        lines.append(f"{key}\t{first_row + offset}\t{self.dim}\n")
+                    index_file.write("".join(lines))
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(vectors_file.fileno(), fcntl.LOCK_UN)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embeddings model with a two-tier cache keyed by model name and
+    a hash of the normalized text: an in-memory LRU in front of a persistent
+    memory-mapped float32 store. Cache hits skip the model entirely.
+    """
+
+    def __init__(self, base: Embeddings, model_name: str, cache_dir: str = EMBEDDING_CACHE_DIR,
+                 memory_items: int = DEFAULT_MEMORY_ITEMS):
+        self.base = base
+        self.model_name = model_name
+        safe_model_name = "".join(c if c.isalnum() or c in "-_." else "_" for c in model_name)
+        self.disk = EmbeddingDiskStore(os.path.join(cache_dir, safe_model_name))
+        self.memory_items = memory_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def cache_key(self, text: str, kind: str) -> str:
+        # Queries and documents are kept apart: some models embed them differently
+        payload = f"{self.model_name}\0{kind}\0{normalize_text(text)}"
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _get(self, key: str) -> list[float] | None:
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return vector
+
+        vector = self.disk.get(key)
+        with self._lock:
+            if vector is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, vector)
+        return vector
+
+    def _remember(self, key: str, vector: list[float]):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _put_many(self, items: list[tuple[str, list[float]]]):
+        self.disk.put_many(items)
+        with self._lock:
+            for key, vector in items:
+                self._remember(key, vector)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys = [self.cache_key(text, "document") for text in texts]
+        vectors = [self._get(key) for key in keys]
+
+        # Embed each distinct missing text once, in a single batch
+        missing = {}
+        for key, text, vector in zip(keys, texts, vectors):
+            if vector is None:
+                missing.setdefault(key, text)
+        if missing:
+            new_vectors = self.base.embed_documents(list(missing.values()))
+            computed = dict(zip(missing, new_vectors))
+            self._put_many(list(computed.items()))
+            vectors = [vector if vector is not None else computed[key] for key, vector in zip(keys, vectors)]
+        return vectors
+
+    def embed_query(self, text: str) -> list[float]:
+        key = self.cache_key(text, "query")
+        vector = self._get(key)
+        if vector is None:
+            vector = self.base.embed_query(text)
+            self._put_many([(key, vector)])
+        return vector
+
+    def stats(self) -> dict:
+        """
+        Hit/miss counters for the cache tiers.
+        """
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "memory_items": len(self._memory),
+            "disk_items": len(self.disk),
+        }
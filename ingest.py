@@ -1,43 +1,389 @@
 import os
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from pypdf import PdfReader
 from langchain_community.vectorstores import Chroma
 from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.document_loaders import PyPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+from embedding_cache import CachedEmbeddings
+from lexical_index import BM25Index, LEXICAL_INDEX_FILENAME, chunk_id
+from quantized_index import QuantizedVectorStore
+
 # Define the path for the persistent vector database
 PERSIST_DIRECTORY = "db_chroma"
 
-# Define the path to the reference PDF document
-SOURCE_DOCUMENT = os.path.join("reference_docs", "nephrology_reference.pdf")
-
-# Load the document
-print(f"Loading document: {SOURCE_DOCUMENT}")
-loader = PyPDFLoader(SOURCE_DOCUMENT)
-documents = loader.load()
-
-# Split the document into chunks
-print("Splitting document into chunks...")
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-texts = text_splitter.split_documents(documents)
-
-# Initialize the free, local embedding model
-print("Initializing embedding model...")
-model_name = "all-mpnet-base-v2"
-model_kwargs = {'device': 'cpu'}
-embeddings = HuggingFaceEmbeddings(
-    model_name=model_name,
-    model_kwargs=model_kwargs
-)
-
-# Create the vector database from the text chunks
-print("Creating vector database...")
-vectordb = Chroma.from_documents(
-    documents=texts,
-    embedding=embeddings,
-    persist_directory=PERSIST_DIRECTORY
-)
-
-# Persist the database to disk
-vectordb.persist()
-
-print(f"Ingestion complete! Database saved to {PERSIST_DIRECTORY}")
\ No newline at end of file
+# Define the directory holding the reference PDF documents
+SOURCE_DIRECTORY = "reference_docs"
+
+# Progress is recorded here so an interrupted ingest can resume
+CHECKPOINT_FILENAME = "ingest_checkpoint.json"
+
+EMBEDDING_MODEL_NAME = "all-mpnet-base-v2"
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+DEFAULT_BATCH_SIZE = 64
+
+# Pages parsed per worker task, so one large book is split across the pool
+DEFAULT_PAGES_PER_TASK = 20
+
+# Vector store written by the ingest: "chroma" or "quantized" (quantized_index.py)
+VECTOR_BACKENDS = ("chroma", "quantized")
+
+
+def file_fingerprint(path: str) -> dict:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def page_ranges(path: str, pages_per_task: int) -> list[tuple[int, int]]:
+    """
+    Splits a PDF's pages into [first, last) ranges of `pages_per_task`.
+    """
+    page_count = len(PdfReader(path).pages)
+    return [(first, min(first + pages_per_task, page_count)) for first in range(0, page_count, pages_per_task)]
+
+
+def load_and_split_pages(path: str, first: int, last: int) -> tuple[list[tuple[str, dict]], float]:
+    """
+    Extracts pages [first, last) of a PDF and splits them into chunks (one
+    document per page with {"source", "page"} metadata, as PyPDFLoader
+    produces, so the chunks do not depend on how pages are grouped). Runs
+    inside a worker process, so it returns plain (text, metadata) pairs that
+    pickle cheaply, along with the seconds the worker spent on it.
+    """
+    start = time.perf_counter()
+    reader = PdfReader(path)
+    texts, metadatas = [], []
+    for page_number in range(first, last):
+        texts.append(reader.pages[page_number].extract_text() or "")
+        metadatas.append({"source": path, "page": page_number})
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    chunks = [(doc.page_content, doc.metadata) for doc in text_splitter.create_documents(texts, metadatas=metadatas)]
+    return chunks, time.perf_counter() - start
+
+
+# --- Checkpointing ---
+
+def load_checkpoint(path: str) -> dict:
+    if not os.path.exists(path):
+        return {"files": {}}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_checkpoint(path: str, checkpoint: dict):
+    # Write to a temp file and rename, so a crash never leaves a truncated checkpoint
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+# --- Pipeline stages ---
+
+class StageTimer:
+    """
+    Accumulates wall time and item counts for one pipeline stage.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.seconds = 0.0
+        self.items = 0
+
+    def add(self, seconds: float, items: int):
+        self.seconds += seconds
+        self.items += items
+
+    def report(self) -> str:
+        rate = self.items / self.seconds if self.seconds > 0 else 0.0
+        return f"{self.name:<20} {self.items:>8} chunks in {self.seconds:8.2f}s ({rate:,.1f} chunks/sec)"
+
+
+def find_existing_ids(vectordb, ids: list[str]) -> set[str]:
+    """
+    Returns the subset of `ids` that is already stored in the collection.
+    """
+    if not ids:
+        return set()
+    return set(vectordb.get(ids=ids, include=[])["ids"])
+
+
+def unique_chunks_by_id(chunks: list[tuple[str, dict]], source: str) -> dict:
+    """
+    Maps chunk id -> (text, metadata), collapsing repeated text within a file (e.g. running headers).
+    """
+    unique_chunks = {}
+    for text, metadata in chunks:
+        unique_chunks.setdefault(chunk_id(text, source), (text, metadata))
+    return unique_chunks
+
+
+def embed_new_chunks(vectordb, unique_chunks: dict, batch_size: int,
+                     dedup_timer: StageTimer, embed_timer: StageTimer) -> list[str]:
+    """
+    Skips chunks whose id (source + text hash) is already stored, then embeds
+    and stores the rest in batches. Returns the ids of every chunk of the file.
+    """
+    all_ids = list(unique_chunks)
+
+    for start in range(0, len(all_ids), batch_size):
+        batch_ids = all_ids[start:start + batch_size]
+
+        t0 = time.perf_counter()
+        existing_ids = find_existing_ids(vectordb, batch_ids)
+        new_ids = [i for i in batch_ids if i not in existing_ids]
+        dedup_timer.add(time.perf_counter() - t0, len(batch_ids))
+
+        if not new_ids:
+            continue
+
+        t0 = time.perf_counter()
+        vectordb.add_texts(
+            texts=[unique_chunks[i][0] for i in new_ids],
+            metadatas=[unique_chunks[i][1] for i in new_ids],
+            ids=new_ids,
+        )
+        embed_timer.add(time.perf_counter() - t0, len(new_ids))
+
+    return all_ids
+
+
+def remove_stale_chunks(vectordb, source: str, current_ids: list[str]) -> list[str]:
+    """
+    Deletes chunks of a re-ingested file whose text no longer appears in it.
+    Returns the deleted ids.
+    """
+    stored_ids = vectordb.get(where={"source": source}, include=[])["ids"]
+    stale_ids = sorted(set(stored_ids) - set(current_ids))
+    if stale_ids:
+        vectordb.delete(ids=stale_ids)
+    return stale_ids
+
+
+def purge_removed_sources(vectordb, source_dir: str, pdf_paths: list[str]) -> dict[str, list[str]]:
+    """
+    Deletes the chunks of PDFs from `source_dir` that are no longer on disk.
+    Returns {source: deleted ids}.
+    """
+    current = set(pdf_paths)
+    removed = {}
+    stored = vectordb.get(include=["metadatas"])
+    for stored_id, metadata in zip(stored["ids"], stored["metadatas"]):
+        source = (metadata or {}).get("source")
+        if (source and source not in current
+                and os.path.normpath(os.path.dirname(source)) == os.path.normpath(source_dir)):
+            removed.setdefault(source, []).append(stored_id)
+    for ids in removed.values():
+        vectordb.delete(ids=ids)
+    return removed
+
+
+def load_lexical_index(persist_dir: str) -> BM25Index:
+    """
+    Loads the BM25 index that mirrors the Chroma collection. If it does not
+    exist yet (a database built before hybrid retrieval), it is backfilled
+    from the chunks already stored in Chroma.
+    """
+    path = os.path.join(persist_dir, LEXICAL_INDEX_FILENAME)
+    if os.path.exists(path):
+        return BM25Index.load(path)
+
+    lexical_index = BM25Index()
+    if os.path.exists(os.path.join(persist_dir, "chroma.sqlite3")):
+        stored = Chroma(persist_directory=persist_dir).get(include=["documents", "metadatas"])
+        lexical_index.add_documents(zip(stored["ids"], stored["documents"], stored["metadatas"]))
+        if len(lexical_index):
+            print(f"Backfilled lexical index with {len(lexical_index)} existing chunks.")
+            lexical_index.save(path)
+    return lexical_index
+
+
+def backfill_quantized_store(persist_dir: str) -> QuantizedVectorStore:
+    """
+    Opens the quantized store. If it is empty but a Chroma collection exists,
+    the stored chunks and their vectors are copied over (no re-embedding).
+    """
+    store = QuantizedVectorStore(persist_dir)
+    if len(store) == 0 and os.path.exists(os.path.join(persist_dir, "chroma.sqlite3")):
+        stored = Chroma(persist_directory=persist_dir).get(include=["documents", "metadatas", "embeddings"])
+        if stored["ids"]:
+            store.add_embeddings(stored["ids"], stored["documents"], stored["metadatas"], stored["embeddings"])
+            stats = store.persist()
+            print(f"Backfilled quantized index from Chroma: {stats}")
+    return store
+
+
+def run_ingest(source_dir: str = SOURCE_DIRECTORY, persist_dir: str = PERSIST_DIRECTORY,
+               workers: int | None = None, batch_size: int = DEFAULT_BATCH_SIZE, resume: bool = True,
+               backend: str = "chroma", pages_per_task: int = DEFAULT_PAGES_PER_TASK):
+    """
+    Ingests every PDF in `source_dir` into the vector store in `persist_dir`
+    (Chroma, or the quantized index with backend="quantized").
+
+    PDFs are parsed and split in a process pool, `pages_per_task` pages per
+    task, so a single large book uses every worker. The main process embeds
+    each file in batches once all of its pages are done. Chunks already
+    present (by source and text) are skipped, and files recorded in the
+    checkpoint with an unchanged size and mtime are not even parsed, so a
+    re-run only embeds new or changed text. Chunks of PDFs that were removed
+    from `source_dir` are deleted.
+    """
+    pdf_paths = sorted(
+        os.path.join(source_dir, name) for name in os.listdir(source_dir) if name.lower().endswith(".pdf")
+    )
+    if not pdf_paths:
+        print(f"No PDF files found in {source_dir}")
+
+    os.makedirs(persist_dir, exist_ok=True)
+    # Each backend keeps its own checkpoint: a file ingested into Chroma is not yet in the quantized index
+    checkpoint_name = CHECKPOINT_FILENAME if backend == "chroma" else f"ingest_checkpoint_{backend}.json"
+    checkpoint_path = os.path.join(persist_dir, checkpoint_name)
+    checkpoint = load_checkpoint(checkpoint_path) if resume else {"files": {}}
+    lexical_index_path = os.path.join(persist_dir, LEXICAL_INDEX_FILENAME)
+    lexical_index = load_lexical_index(persist_dir)
+    if backend == "quantized":
+        backfill_quantized_store(persist_dir)
+
+    pending_paths = [p for p in pdf_paths if checkpoint["files"].get(p, {}).get("fingerprint") != file_fingerprint(p)]
+    print(f"Found {len(pdf_paths)} PDF(s) in {source_dir}; {len(pdf_paths) - len(pending_paths)} unchanged since last ingest.")
+
+    # Initialize the free, local embedding model (behind the shared on-disk cache), if anything needs embedding
+    embeddings = None
+    if pending_paths:
+        print("Initializing embedding model...")
+        model_kwargs = {'device': 'cpu'}
+        embeddings = CachedEmbeddings(
+            HuggingFaceEmbeddings(
+                model_name=EMBEDDING_MODEL_NAME,
+                model_kwargs=model_kwargs
+            ),
+            model_name=EMBEDDING_MODEL_NAME,
+        )
+    if backend == "quantized":
+        vectordb = QuantizedVectorStore(persist_dir, embedding_function=embeddings)
+    else:
+        vectordb = Chroma(persist_directory=persist_dir, embedding_function=embeddings)
+
+    # Drop the chunks of PDFs that are no longer in the source directory
+    removed = purge_removed_sources(vectordb, source_dir, pdf_paths)
+    for source, removed_ids in removed.items():
+        print(f"Removed {len(removed_ids)} chunks of {source} (no longer in {source_dir})")
+        lexical_index.remove_documents(removed_ids)
+        checkpoint["files"].pop(source, None)
+    if removed:
+        lexical_index.save(lexical_index_path)
+        if backend == "quantized":
+            vectordb.persist()
+        save_checkpoint(checkpoint_path, checkpoint)
+
+    if not pending_paths:
+        print("Nothing to ingest.")
+        return
+
+    split_timer = StageTimer("parse+split/worker")
+    dedup_timer = StageTimer("dedup")
+    embed_timer = StageTimer("embed+store")
+    lexical_timer = StageTimer("lexical index")
+    persist_timer = StageTimer("quantized persist")
+    run_start = time.perf_counter()
+
+    def ingest_file(path: str, chunks: list[tuple[str, dict]]):
+        print(f"Embedding {len(chunks)} chunks from {path}...")
+        unique_chunks = unique_chunks_by_id(chunks, path)
+        ids = embed_new_chunks(vectordb, unique_chunks, batch_size, dedup_timer, embed_timer)
+        stale_ids = remove_stale_chunks(vectordb, path, ids)
+        if stale_ids:
+            print(f"Removed {len(stale_ids)} stale chunks from a previous version of {path}")
+
+        # Keep the sparse BM25 index in step with the collection
+        t0 = time.perf_counter()
+        lexical_index.remove_documents(stale_ids)
+        added = lexical_index.add_documents((i, text, metadata) for i, (text, metadata) in unique_chunks.items())
+        lexical_index.save(lexical_index_path)
+        lexical_timer.add(time.perf_counter() - t0, added)
+
+        if backend == "quantized":
+            # The quantized store only writes its buffered chunks on persist(), so
+            # write a new generation before recording the file as done
+            t0 = time.perf_counter()
+            index_stats = vectordb.persist()
+            persist_timer.add(time.perf_counter() - t0, len(ids))
+            if index_stats:
+                print(f"Quantized index updated: {index_stats}")
+        checkpoint["files"][path] = {"fingerprint": file_fingerprint(path), "chunks": len(ids)}
+        save_checkpoint(checkpoint_path, checkpoint)
+
+    print(f"Parsing and splitting {len(pending_paths)} PDF(s), {pages_per_task} pages per task, "
+          f"with {workers or os.cpu_count()} worker(s)...")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        submitted = {}
+        page_chunks = {}     # path -> {first page of a task: chunks}
+        tasks_left = {}      # path -> tasks still running
+        for path in pending_paths:
+            try:
+                ranges = page_ranges(path, pages_per_task)
+            except Exception as e:
+                print(f"Failed to load {path}: {e}")
+                continue
+            if not ranges:
+                ingest_file(path, [])
+                continue
+            page_chunks[path], tasks_left[path] = {}, len(ranges)
+            for first, last in ranges:
+                submitted[pool.submit(load_and_split_pages, path, first, last)] = (path, first)
+
+        for future in as_completed(submitted):
+            path, first = submitted[future]
+            if path not in page_chunks:
+                continue    # an earlier task of this file failed
+            try:
+                chunks, worker_seconds = future.result()
+            except Exception as e:
+                print(f"Failed to load {path} (pages from {first}): {e}")
+                del page_chunks[path]
+                continue
+            # Worker time, so the rate is per parser process
+            split_timer.add(worker_seconds, len(chunks))
+            page_chunks[path][first] = chunks
+            tasks_left[path] -= 1
+            if tasks_left[path] == 0:
+                parts = page_chunks.pop(path)
+                ingest_file(path, [chunk for first_page in sorted(parts) for chunk in parts[first_page]])
+
+    # Persist the database to disk
+    vectordb.persist()
+
+    print(f"Ingestion complete in {time.perf_counter() - run_start:.2f}s! Database saved to {persist_dir}")
+    timers = (split_timer, dedup_timer, embed_timer, lexical_timer)
+    for timer in timers + ((persist_timer,) if backend == "quantized" else ()):
+        print("  " + timer.report())
+    print(f"  embedding cache: {embeddings.stats()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or update the nephrology reference vector database.")
+    parser.add_argument("--source-dir", default=SOURCE_DIRECTORY, help="Directory of reference PDFs")
+    parser.add_argument("--persist-dir", default=PERSIST_DIRECTORY, help="Chroma persistence directory")
+    parser.add_argument("--workers", type=int, default=None, help="Parser processes (default: CPU count)")
+    parser.add_argument("--pages-per-task", type=int, default=DEFAULT_PAGES_PER_TASK,
+                        help="PDF pages parsed per worker task")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Chunks per embedding batch")
+    parser.add_argument("--no-resume", action="store_true", help="Ignore the checkpoint and re-check every PDF")
+    parser.add_argument("--backend", default="chroma", choices=VECTOR_BACKENDS,
+                        help="Vector store to build (quantized: int8 memory-mapped IVF index)")
+    args = parser.parse_args()
+
+    run_ingest(
+        source_dir=args.source_dir,
+        persist_dir=args.persist_dir,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        resume=not args.no_resume,
+        backend=args.backend,
+        pages_per_task=args.pages_per_task,
+    )
@@ -0,0 +1,203 @@
+import os
+import re
+import json
+import math
+import base64
+import hashlib
+import heapq
+from array import array
+from collections import Counter, namedtuple
+
+# Stored next to the Chroma collection it mirrors
+LEXICAL_INDEX_FILENAME = "lexical_index.json"
+
+# Keeps drug names, lab terms and stages intact: "eGFR", "Stage-3", "co-amoxiclav"
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+
+STOPWORDS = frozenset("""
+a an and are as at be but by can could do does for from had has have how i if in into is it its
+me my of on or should so than that the their them then there these they this to too was we
+were what when where which while who why will with would you your
+""".split())
+
+# A single search result, shaped like a LangChain Document for the formatting code
+SearchHit = namedtuple("SearchHit", ["id", "page_content", "metadata", "score"])
+
+
+def chunk_id(text: str, source: str | None = None) -> str:
+    """
+    Id of a chunk, in the vector store and in the lexical index: a hash of its
+    source file and text. Identical text in one file is stored once; the same
+    text in two files gets two ids, so re-ingesting or removing one file never
+    touches the other's chunks. Without a source it is a plain content hash.
+    """
+    key = text if source is None else f"{source}\0{text}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def tokenize(text: str) -> list[str]:
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def _encode(values: array) -> str:
+    return base64.b64encode(values.tobytes()).decode("ascii")
+
+
+def _decode(typecode: str, data: str) -> array:
+    values = array(typecode)
+    values.frombytes(base64.b64decode(data))
+    return values
+
+
+class BM25Index:
+    """
+    Compact sparse inverted index with Okapi BM25 scoring.
+
+    Each term maps to two parallel typed arrays (document numbers and term
+    frequencies) instead of per-posting Python objects, and is persisted as
+    base64 of those arrays. Documents are keyed by chunk id, the same id used
+    in the vector store, so both can be updated together.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs = []              # doc number -> (chunk id, text, metadata)
+        self.doc_lengths = array('I')
+        self.doc_numbers = {}       # chunk id -> doc number
+        self.postings = {}          # term -> (array of doc numbers, array of term frequencies)
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __contains__(self, doc_id: str):
+        return doc_id in self.doc_numbers
+
+    # --- Building ---
+
+    def add_documents(self, items) -> int:
+        """
+        Adds (chunk id, text, metadata) items, skipping ids already indexed.
+        Returns the number of documents added.
+        """
+        added = 0
+        for doc_id, text, metadata in items:
+            if doc_id in self.doc_numbers:
+                continue
+            doc_number = len(self.docs)
+            tokens = tokenize(text)
+            self.docs.append((doc_id, text, metadata))
+            self.doc_numbers[doc_id] = doc_number
+            self.doc_lengths.append(len(tokens))
+            self.total_length += len(tokens)
+            for term, tf in Counter(tokens).items():
+                doc_list, tf_list = self.postings.setdefault(term, (array('I'), array('H')))
+                doc_list.append(doc_number)
+                tf_list.append(min(tf, 65535))
+            added += 1
+        return added
+
+    def remove_documents(self, doc_ids) -> int:
+        """
+        Drops documents and renumbers the rest (an ingest-time operation).
+        """
+        doc_ids = set(doc_ids) & set(self.doc_numbers)
+        if not doc_ids:
+            return 0
+        remaining = [doc for doc in self.docs if doc[0] not in doc_ids]
+        self.__init__(self.k1, self.b)
+        self.add_documents(remaining)
+        return len(doc_ids)
+
+    # --- Persistence ---
+
+    def save(self, path: str):
+        data = {
+            "k1": self.k1,
+            "b": self.b,
+            "docs": [{"id": doc_id, "text": text, "metadata": metadata} for doc_id, text, metadata in self.docs],
+            "postings": {
+                term: [_encode(doc_list), _encode(tf_list)] for term, (doc_list, tf_list) in self.postings.items()
+            },
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(path, 'r') as f:
+            data = json.load(f)
+        index = cls(data["k1"], data["b"])
+        for doc_number, doc in enumerate(data["docs"]):
+            index.docs.append((doc["id"], doc["text"], doc["metadata"]))
+            index.doc_numbers[doc["id"]] = doc_number
+        lengths = [0] * len(index.docs)
+        for term, (doc_data, tf_data) in data["postings"].items():
+            doc_list, tf_list = _decode('I', doc_data), _decode('H', tf_data)
+            index.postings[term] = (doc_list, tf_list)
+            for doc_number, tf in zip(doc_list, tf_list):
+                lengths[doc_number] += tf
+        index.doc_lengths = array('I', lengths)
+        index.total_length = sum(lengths)
+        return index
+
+    # --- Querying ---
+
+    def document_frequency(self, term: str) -> int:
+        posting = self.postings.get(term)
+        return len(posting[0]) if posting else 0
+
+    def idf(self, term: str) -> float:
+        df = self.document_frequency(term)
+        return math.log(1 + (len(self.docs) - df + 0.5) / (df + 0.5))
+
+    def is_exact_term_query(self, query: str, max_terms: int = 4, rare_fraction: float = 0.05) -> bool:
+        """
+        True when the query is mostly exact, rare terms (drug names, lab
+        terms like "eGFR"), where lexical matching alone is reliable: at most
+        `max_terms` content words, and at least half of them appear in the
+        index in no more than `rare_fraction` of the chunks.
+        """
+        terms = tokenize(query)
+        if not terms or len(terms) > max_terms or not self.docs:
+            return False
+        max_df = max(1, int(rare_fraction * len(self.docs)))
+        rare = sum(1 for t in terms if 0 < self.document_frequency(t) <= max_df)
+        return rare * 2 >= len(terms)
+
+    def search(self, query: str, k: int = 4) -> list[SearchHit]:
+        if not self.docs:
+            return []
+        average_length = self.total_length / len(self.docs) or 1.0
+        scores = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = self.idf(term)
+            for doc_number, tf in zip(*posting):
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_number] / average_length)
+                scores[doc_number] = scores.get(doc_number, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [SearchHit(self.docs[n][0], self.docs[n][1], self.docs[n][2], score) for n, score in best]
+
+
+def reciprocal_rank_fusion(ranked_lists, k: int = 4, rrf_k: int = 60) -> list:
+    """
+    Fuses ranked result lists with reciprocal-rank fusion: every list adds
+    1 / (rrf_k + rank) to a result, keyed by its text (the same chunk from
+    either retriever, or the same text from two books, counts once). Returns
+    the top `k` results (the first object seen for each text).
+    """
+    scores, first_seen = {}, {}
+    for ranked in ranked_lists:
+        for rank, hit in enumerate(ranked, start=1):
+            key = chunk_id(hit.page_content)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            first_seen.setdefault(key, hit)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [first_seen[key] for key in best]
@@ -0,0 +1,163 @@
+"""
+Local stand-ins for the network backends (Gemini, Tavily), the reference
+RAG tool and the local models, so the app and its pipelines can be exercised without API keys,
+network access or a built vector database.
+"""
+import re
+import time
+import random
+import threading
+
+DISCLAIMER = (
+    "Disclaimer: I am an AI assistant for educational purposes only. "
+    "Always consult healthcare professionals for medical advice."
+)
+
+
+class FakeMessage:
+    """
+    Minimal stand-in for a LangChain message / message chunk: only `.content`.
+    """
+
+    def __init__(self, content: str):
+        self.content = content
+
+    def __repr__(self):
+        return f"FakeMessage({self.content!r})"
+
+
+class FakeStreamingLLM:
+    """
+    Deterministic local LLM with the same invoke()/stream() surface as
+    ChatGoogleGenerativeAI.
+
+    The reply is built from the prompt, and `first_token_delay` /
+    `token_delay` simulate generation latency so streaming behaviour and
+    timings can be tested offline.
+    """
+
+    def __init__(self, first_token_delay: float = 0.3, token_delay: float = 0.02):
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.calls = 0
+
+    def _reply(self, prompt: str) -> str:
+        question = re.search(r'PATIENT\'S QUESTION:\s*"(.*?)"', prompt, re.S)
+        if question:
+            return (
+                f"Here is some general guidance about \"{question.group(1).strip()}\" based on the "
+                "reference material (Source: Reference Book).\n\n" + DISCLAIMER
+            )
+        name = re.search(r'"patient_name":\s*"(.*?)"', prompt)
+        greeting_name = name.group(1) if name else "there"
+        return f"Hello {greeting_name}! I found your discharge report. How are you feeling today?"
+
+    def stream(self, prompt: str):
+        self.calls += 1
+        time.sleep(self.first_token_delay)
+        for i, token in enumerate(re.findall(r"\S+\s*", self._reply(prompt))):
+            if i:
+                time.sleep(self.token_delay)
+            yield FakeMessage(token)
+
+    def invoke(self, prompt: str) -> FakeMessage:
+        return FakeMessage("".join(chunk.content for chunk in self.stream(prompt)))
+
+
+class FakeWebSearch:
+    """
+    Stand-in for TavilySearchResults: invoke(query) returns a list of
+    {"url", "content", "score"} results after `delay` seconds.
+    """
+
+    def __init__(self, delay: float = 0.4, results: int = 3):
+        self.delay = delay
+        self.results = results
+        self.calls = 0
+
+    def invoke(self, query: str) -> list[dict]:
+        self.calls += 1
+        time.sleep(self.delay)
+        return [
+            {
+                "url": f"https://example.org/kidney-health/{i + 1}",
+                "content": f"General patient information related to '{query}' (result {i + 1}).",
+                "score": round(0.9 - 0.1 * i, 2),
+            }
+            for i in range(self.results)
+        ]
+
+
+class FakeReferenceRAG:
+    """
+    Stand-in for get_rag_context: returns fixed reference chunks in the same
+    text format after `delay` seconds (simulating embedding + vector search).
+    """
+
+    def __init__(self, delay: float = 0.15, chunks: int = 4):
+        self.delay = delay
+        self.chunks = chunks
+        self.calls = 0
+
+    def __call__(self, query: str) -> str:
+        self.calls += 1
+        time.sleep(self.delay)
+        context = ""
+        for i in range(self.chunks):
+            context += f"--- Relevant Context Chunk {i+1} (Source: local-reference) ---\n"
+            context += f"Reference text about kidney care relevant to: {query}"
+            context += "\n---------------------------------------------------\n"
+        return context
+
+
+class FakeCrossEncoder:
+    """
+    Stand-in for a sentence-transformers CrossEncoder: predict(pairs) scores
+    each (query, passage) pair by shared words, taking `pair_delay` seconds
+    per pair to simulate model cost.
+    """
+
+    def __init__(self, pair_delay: float = 0.002):
+        self.pair_delay = pair_delay
+        self.calls = 0
+
+    def predict(self, pairs, batch_size: int = 32) -> list[float]:
+        self.calls += 1
+        time.sleep(self.pair_delay * len(pairs))
+        scores = []
+        for query, passage in pairs:
+            query_words = set(re.findall(r"\w+", query.lower()))
+            passage_words = set(re.findall(r"\w+", passage.lower()))
+            scores.append(4.0 * len(query_words & passage_words) / max(1, len(query_words)) - 2.0)
+        return scores
+
+
+class FakeEmbeddingModel:
+    """
+    Stand-in for HuggingFaceEmbeddings on a CPU: each call costs a fixed
+    `call_overhead` plus `per_item` per text, and calls run one at a time
+    (like forward passes competing for the same cores). Vectors are
+    deterministic pseudo-random unit vectors of `dim` floats.
+    """
+
+    def __init__(self, call_overhead: float = 0.015, per_item: float = 0.002, dim: int = 768):
+        self.call_overhead = call_overhead
+        self.per_item = per_item
+        self.dim = dim
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _vector(self, text: str) -> list[float]:
+        rng = random.Random(text)
+        vector = [rng.gauss(0.0, 1.0) for _ in range(self.dim)]
+        norm = sum(v * v for v in vector) ** 0.5
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        with self._lock:
+            self.calls += 1
+            time.sleep(self.call_overhead + self.per_item * len(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
@@ -1,5 +1,22 @@
-import logging
+import os
 import sys
+import json
+import time
+import queue
+import copy
+import atexit
+import logging
+import contextvars
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# "queue" (default): callers only put records on an in-memory queue and a
+# background listener thread formats and writes them, to a size-rotated
+# JSON-lines file. "sync": the original blocking handlers and chat_log.log.
+LOG_MODE = os.getenv("LOG_MODE", "queue")
+LOG_FILE = os.getenv("LOG_FILE", "chat_log.jsonl" if LOG_MODE == "queue" else "chat_log.log")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
 
 # Define the log format
 LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
@@ -7,11 +24,104 @@ LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 # Create a formatter
 formatter = logging.Formatter(LOG_FORMAT)
 
-# --- Setup File Handler (logs to a file) ---
-# This will save all logs (DEBUG level and up) to 'chat_log.log'
-file_handler = logging.FileHandler("chat_log.log")
+# --- Request / session context ---
+# Set by the API per request and by the Streamlit app per session; every
+# record logged while they are set carries them.
+request_id_var = contextvars.ContextVar("request_id", default=None)
+session_id_var = contextvars.ContextVar("session_id", default=None)
+
+
+@contextmanager
+def log_context(request_id: str | None = None, session_id: str | None = None):
+    """
+    Tags every record logged inside the block (in this thread or asyncio
+    task) with the given request and/or session id.
+    """
+    tokens = []
+    if request_id is not None:
+        tokens.append((request_id_var, request_id_var.set(request_id)))
+    if session_id is not None:
+        tokens.append((session_id_var, session_id_var.set(session_id)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Copies the current request and session ids onto the record. Runs in the
+    calling thread, before the record is queued.
+    """
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        record.session_id = session_id_var.get()
+        return True
+
+
+# Attributes every LogRecord has; anything else was passed with extra={...}
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    One JSON object per line: timestamp, level, logger, message, request and
+    session ids, plus any extra fields (e.g. stage, duration_ms).
+    """
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 6),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "session_id": getattr(record, "session_id", None),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and key not in entry:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, default=str)
+
+
+class TracebackQueueHandler(QueueHandler):
+    """
+    QueueHandler whose prepare() keeps the traceback out of the message: the
+    stock one formats the whole record into msg and drops exc_info. The
+    traceback is formatted here, in the calling thread, into exc_text (and
+    stack_info is kept), so the listener's formatters can still emit it
+    separately.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = formatter.formatException(record.exc_info)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+if LOG_MODE == "queue":
+    # --- Setup File Handler (size-rotated JSON lines, written by the listener) ---
+    file_handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+    file_handler.setFormatter(JsonLinesFormatter())
+else:
+    # --- Setup File Handler (logs to a file) ---
+    # This will save all logs (DEBUG level and up) to 'chat_log.log'
+    file_handler = logging.FileHandler(LOG_FILE)
+    file_handler.setFormatter(formatter)
 file_handler.setLevel(logging.DEBUG)
-file_handler.setFormatter(formatter)
 
 # --- Setup Stream Handler (logs to the terminal) ---
 # This will print INFO level logs and up to your terminal
@@ -19,22 +129,54 @@ stream_handler = logging.StreamHandler(sys.stdout)
 stream_handler.setLevel(logging.INFO)
 stream_handler.setFormatter(formatter)
 
+# --- Background writer ---
+# The only handler callers touch is a QueueHandler: logging costs a record
+# copy, the message (and traceback) formatting and a queue put; the listener
+# thread does the JSON formatting and the disk/terminal I/O.
+log_queue = None
+queue_handler = None
+queue_listener = None
+if LOG_MODE == "queue":
+    log_queue = queue.Queue(-1)
+    queue_handler = TracebackQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    queue_listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    queue_listener.start()
+    # Flush whatever is still queued when the process exits
+    atexit.register(queue_listener.stop)
+else:
+    file_handler.addFilter(ContextFilter())
+
 def get_logger(name):
     """
-    Sets up and returns a logger with both file and stream handlers.
+    Sets up and returns a logger with both file and stream handlers
+    (behind the queue handler in queue mode).
     """
     # Get the logger
     logger = logging.getLogger(name)
-    
+
     # Set the overall level to the lowest (DEBUG) to allow handlers to filter
     logger.setLevel(logging.DEBUG)
-    
+
     # Add handlers only if they haven't been added already
     if not logger.hasHandlers():
-        logger.addHandler(file_handler)
-        logger.addHandler(stream_handler)
-        
+        if queue_handler is not None:
+            logger.addHandler(queue_handler)
+        else:
+            logger.addHandler(file_handler)
+            logger.addHandler(stream_handler)
+
     return logger
 
+
+def log_stage(stage: str, seconds: float, logger=None, **fields):
+    """
+    Logs how long a pipeline stage took, as a structured record
+    (stage, duration_ms and any extra fields) for latency analysis.
+    """
+    duration_ms = round(seconds * 1000, 3)
+    (logger or app_logger).info(f"Stage '{stage}' finished in {duration_ms:.0f} ms.",
+                                extra={"stage": stage, "duration_ms": duration_ms, **fields})
+
 # Create a main logger for our app
-app_logger = get_logger("MedicalAIAssistant")
\ No newline at end of file
+app_logger = get_logger("MedicalAIAssistant")
@@ -0,0 +1,343 @@
+"""
+In-process latency metrics and an opt-in profiler for slow requests.
+
+    from metrics import timed, metrics
+
+    @timed("rag")                       # decorator (sync or async functions)
+    def get_rag_context(...): ...
+
+    with timed("llm", label="Clinical answer"):   # context manager
+        ...
+
+Every observation goes into a histogram per (stage, labels): cumulative
+buckets for Prometheus plus a window of recent samples for p50/p95/p99.
+metrics.prometheus_text() renders the Prometheus text format (served at
+/metrics by api.py); METRICS_DUMP_PATH makes the Streamlit app write it, and
+a JSON summary, to disk every METRICS_DUMP_SECONDS instead.
+
+PROFILE_SLOW_SECONDS=<n> turns on profile_if_slow(): the wrapped block runs
+under cProfile, and the first run slower than n seconds is saved to
+PROFILE_DIR as a .prof file (pstats / snakeviz) with its top functions logged.
+cProfile only sees its own thread, so work the request hands to worker
+threads (RAG, web search, embedding, rerank) must be submitted with
+submit_in_context(): it runs under its own profiler there and is merged into
+the request's profile. Threads started by libraries (torch, HTTP clients) are
+not covered; attach py-spy for those.
+"""
+import os
+import json
+import math
+import time
+import pstats
+import cProfile
+import asyncio
+import functools
+import threading
+import contextvars
+from io import StringIO
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+
+from logger import app_logger
+
+# Upper bounds (seconds) of the cumulative histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Recent samples kept per series for the percentiles
+QUANTILE_WINDOW = 2048
+
+METRIC_NAME = "medical_ai_stage_duration_seconds"
+
+METRICS_DUMP_PATH = os.getenv("METRICS_DUMP_PATH")
+METRICS_DUMP_SECONDS = float(os.getenv("METRICS_DUMP_SECONDS", "60"))
+
+PROFILE_SLOW_SECONDS = float(os.getenv("PROFILE_SLOW_SECONDS", "0")) or None
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MAX_CAPTURES = int(os.getenv("PROFILE_MAX_CAPTURES", "1"))
+
+
+def _quantile(ordered: list[float], q: float) -> float:
+    # Nearest rank, as in batch_eval.percentile
+    rank = math.ceil(round(q * len(ordered), 9))
+    return ordered[min(len(ordered), max(1, rank)) - 1]
+
+
+class Histogram:
+    """
+    Latency histogram for one series: count, sum, cumulative buckets and a
+    sliding window of recent samples for percentiles.
+    """
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS, window: int = QUANTILE_WINDOW):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)   # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self.bucket_counts[bisect_left(self.buckets, seconds)] += 1
+            self.count += 1
+            self.sum += seconds
+            self.recent.append(seconds)
+
+    def summary(self) -> dict:
+        with self._lock:
+            ordered = sorted(self.recent)
+            count, total = self.count, self.sum
+        summary = {"count": count, "sum": round(total, 6)}
+        for name, q in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99)):
+            summary[name] = round(_quantile(ordered, q), 6) if ordered else None
+        return summary
+
+
+class _Timer:
+    """
+    What timed() returns: a context manager that also decorates sync and
+    async functions.
+    """
+
+    def __init__(self, registry, stage: str, labels: dict):
+        self.registry = registry
+        self.stage = stage
+        self.labels = labels
+        self._starts = threading.local()
+
+    def __enter__(self):
+        self._starts.__dict__.setdefault("stack", []).append(time.perf_counter())
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._starts.stack.pop()
+        self.registry.observe(self.stage, elapsed, error=exc_type is not None, **self.labels)
+        return False
+
+    def __call__(self, func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    result = await func(*args, **kwargs)
+                except BaseException:
+                    self.registry.observe(self.stage, time.perf_counter() - start, error=True, **self.labels)
+                    raise
+                self.registry.observe(self.stage, time.perf_counter() - start, **self.labels)
+                return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self:
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def escape_label_value(value: str) -> str:
+    """
+    Escapes a label value for the Prometheus text format.
+    """
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsRegistry:
+    """
+    All latency series of the process, keyed by stage and labels.
+    """
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+        self._dump_thread = None
+
+    def observe(self, stage: str, seconds: float, error: bool = False, **labels):
+        labels = {"stage": stage, **{k: str(v) for k, v in labels.items()}}
+        if error:
+            labels["outcome"] = "error"
+        key = tuple(sorted(labels.items()))
+        histogram = self._series.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._series.setdefault(key, Histogram(self.buckets))
+        histogram.observe(seconds)
+
+    def timed(self, stage: str, **labels) -> _Timer:
+        """
+        Times a block (`with timed("rag"):`) or every call of a function
+        (`@timed("rag")`) into the `stage` series.
+        """
+        return _Timer(self, stage, labels)
+
+    def snapshot(self) -> list[dict]:
+        """
+        Returns [{"labels", "count", "sum", "p50", "p95", "p99"}, ...] in seconds.
+        """
+        with self._lock:
+            series = list(self._series.items())
+        return [{"labels": dict(key), **histogram.summary()} for key, histogram in sorted(series)]
+
+    def prometheus_text(self) -> str:
+        """
+        Renders every series in the Prometheus text exposition format: a
+        histogram plus p50/p95/p99 gauges over the recent window.
+        """
+        with self._lock:
+            series = sorted(self._series.items())
+        lines = [
+            f"# HELP {METRIC_NAME} Duration of pipeline stages in seconds.",
+            f"# TYPE {METRIC_NAME} histogram",
+        ]
+        quantile_lines = []
+        for key, histogram in series:
+            label_text = ",".join(f'{k}="{escape_label_value(v)}"' for k, v in key)
+            with histogram._lock:
+                counts, count, total = list(histogram.bucket_counts), histogram.count, histogram.sum
+            cumulative = 0
+            for bound, bucket_count in zip(list(self.buckets) + ["+Inf"], counts):
+                cumulative += bucket_count
+                lines.append(f'{METRIC_NAME}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f"{METRIC_NAME}_sum{{{label_text}}} {total:.6f}")
+            lines.append(f"{METRIC_NAME}_count{{{label_text}}} {count}")
+            summary = histogram.summary()
+            for name in ("p50", "p95", "p99"):
+                if summary[name] is not None:
+                    quantile_lines.append(
+                        f'{METRIC_NAME}_recent{{{label_text},quantile="0.{name[1:]}"}} {summary[name]:.6f}'
+                    )
+        if quantile_lines:
+            lines.append(f"# HELP {METRIC_NAME}_recent Percentiles over the last {QUANTILE_WINDOW} samples per series.")
+            lines.append(f"# TYPE {METRIC_NAME}_recent gauge")
+            lines.extend(quantile_lines)
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str):
+        """
+        Writes the Prometheus text to `path` and a JSON summary next to it
+        (each replaced atomically, so readers never see half a file).
+        """
+        for target, content in ((path, self.prometheus_text()),
+                                (os.path.splitext(path)[0] + ".json", json.dumps(self.snapshot(), indent=2))):
+            tmp_path = f"{target}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(content)
+            os.replace(tmp_path, target)
+
+    def start_periodic_dump(self, path: str, interval: float = METRICS_DUMP_SECONDS):
+        """
+        Dumps the metrics every `interval` seconds from a daemon thread
+        (started at most once per process).
+        """
+        def _loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.dump(path)
+                except Exception as e:
+                    app_logger.error(f"Metrics dump to {path} failed: {e}")
+
+        with self._lock:
+            if self._dump_thread is None:
+                self._dump_thread = threading.Thread(target=_loop, name="metrics-dump", daemon=True)
+                self._dump_thread.start()
+                app_logger.info(f"Dumping metrics to {path} every {interval:.0f}s.")
+
+
+# Process-wide registry
+metrics = MetricsRegistry()
+timed = metrics.timed
+
+
+# --- Opt-in profiling of a slow request ---
+# One request is profiled at a time; concurrent requests run unprofiled.
+_profile_lock = threading.Lock()
+_profile_captures = 0
+
+# The capture of the request being profiled: {"lock", "profiles"}. Context
+# variables follow work submitted with submit_in_context() to worker threads.
+_active_capture = contextvars.ContextVar("active_profile_capture", default=None)
+
+
+def profiled(func):
+    """
+    Wraps a callable that runs on a worker thread: while the request that
+    submitted it is being captured by profile_if_slow(), it runs under its own
+    profiler whose stats are merged into the request's profile.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        capture = _active_capture.get()
+        if capture is None:
+            return func(*args, **kwargs)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+: the request's profiler already covers every thread
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            with capture["lock"]:
+                capture["profiles"].append(profiler)
+    return wrapper
+
+
+def submit_in_context(executor, func, *args, **kwargs):
+    """
+    executor.submit() in a copy of the caller's context, so the worker's log
+    records keep the request/session ids and a profiled request's worker time
+    shows up in its profile.
+    """
+    return executor.submit(contextvars.copy_context().run, profiled(func), *args, **kwargs)
+
+
+@contextmanager
+def profile_if_slow(name: str, threshold: float | None = None):
+    """
+    With PROFILE_SLOW_SECONDS set, profiles the block and keeps the profile
+    if it took longer than the threshold (up to PROFILE_MAX_CAPTURES per
+    process). Without it, does nothing.
+
+    The profile covers the calling thread plus worker calls submitted with
+    submit_in_context() that finished before the block ended. Main-thread
+    functions that wait on those workers show the wait as their own time.
+    """
+    global _profile_captures
+    threshold = threshold if threshold is not None else PROFILE_SLOW_SECONDS
+    if threshold is None or _profile_captures >= PROFILE_MAX_CAPTURES or not _profile_lock.acquire(blocking=False):
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    capture = {"lock": threading.Lock(), "profiles": []}
+    token = _active_capture.set(capture)
+    start = time.perf_counter()
+    try:
+        profiler.enable()
+        yield
+    finally:
+        profiler.disable()
+        _active_capture.reset(token)
+        elapsed = time.perf_counter() - start
+        try:
+            if elapsed >= threshold and _profile_captures < PROFILE_MAX_CAPTURES:
+                _profile_captures += 1
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                path = os.path.join(PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.prof")
+                top = StringIO()
+                stats = pstats.Stats(profiler, stream=top)
+                with capture["lock"]:
+                    worker_profiles = list(capture["profiles"])
+                for worker_profile in worker_profiles:
+                    stats.add(worker_profile)
+                stats.dump_stats(path)
+                stats.sort_stats("cumulative").print_stats(15)
+                app_logger.warning(f"Slow '{name}' ({elapsed:.2f}s, {len(worker_profiles)} worker call(s)) profiled to {path}:\n{top.getvalue()}",
+                                   extra={"stage": name, "duration_ms": round(elapsed * 1000, 3), "profile": path})
+        finally:
+            _profile_lock.release()
@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import threading
+from collections import namedtuple
+
+# Define the directory where patient files are stored
+PATIENT_DATA_DIR = "data/"
+
+# How often (at most) the shared registries check the directory for new or changed reports
+REGISTRY_REFRESH_SECONDS = 2.0
+
+
+def normalize_key(value) -> str:
+    """
+    Normalizes a name, date or diagnosis for index lookups:
+    case-insensitive and with runs of whitespace collapsed.
+    """
+    if not isinstance(value, str):
+        return ""
+    return " ".join(value.split()).casefold()
+
+
+# An immutable, fully built view of the registry. Readers grab the current
+# snapshot once and only ever see a complete set of reports and indexes.
+RegistrySnapshot = namedtuple(
+    "RegistrySnapshot",
+    ["reports", "by_name", "by_discharge_date", "by_diagnosis"],
+)
+
+EMPTY_SNAPSHOT = RegistrySnapshot([], {}, {}, {})
+
+
+class PatientRegistry:
+    """
+    Holds every discharge report from the patient data directory in memory.
+
+    The reports are indexed by normalized patient name, discharge date and
+    primary diagnosis, so a lookup is a dictionary access instead of opening
+    and parsing every JSON file on disk.
+
+    refresh() keeps the registry in step with the directory: it compares each
+    file's mtime and size with what was last parsed and only re-reads files
+    that were added or changed, dropping deleted ones. The new indexes are
+    built on the side and swapped in with a single assignment.
+    """
+
+    def __init__(self, data_dir: str = PATIENT_DATA_DIR, refresh_interval: float = 0.0):
+        self.data_dir = data_dir
+        # Minimum seconds between two directory checks made by refresh()
+        self.refresh_interval = refresh_interval
+        self._refresh_lock = threading.Lock()
+        self._snapshot = None
+        self._files = {}            # filename -> (mtime_ns, size, report dict)
+        self._last_check = 0.0
+        self.refresh_count = 0
+        self.last_refresh_stats = None
+
+    # --- Loading ---
+
+    def load(self):
+        """
+        Forgets everything and re-parses every .json report in the data directory.
+        """
+        with self._refresh_lock:
+            self._files = {}
+            self._refresh_locked()
+
+    def refresh(self, force: bool = False) -> dict | None:
+        """
+        Re-parses only the files that were added or changed since the last
+        refresh and drops deleted ones.
+
+        Returns the stats of this refresh, or None if it was skipped because
+        the last check is more recent than `refresh_interval`.
+        """
+        if not force and self._snapshot is not None and time.monotonic() - self._last_check < self.refresh_interval:
+            return None
+        with self._refresh_lock:
+            return self._refresh_locked()
+
+    def ensure_loaded(self):
+        """
+        Loads the registry on first use.
+        """
+        if self._snapshot is None:
+            self.refresh(force=True)
+
+    def _refresh_locked(self) -> dict:
+        start = time.perf_counter()
+        files = dict(self._files)
+        added = changed = removed = failed = 0
+
+        seen = set()
+        with os.scandir(self.data_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".json") or not entry.is_file():
+                    continue
+                seen.add(entry.name)
+                stat = entry.stat()
+                previous = files.get(entry.name)
+                if previous is not None and previous[0] == stat.st_mtime_ns and previous[1] == stat.st_size:
+                    continue
+
+                try:
+                    with open(entry.path, 'r') as f:
+                        report = json.load(f)
+                except (OSError, ValueError) as e:
+                    # Most likely a file that is still being written: keep the
+                    # previous version (if any) and retry on the next refresh.
+                    print(f"---[Patient Registry: Skipping unreadable report {entry.name}: {e}]---")
+                    failed += 1
+                    continue
+
+                files[entry.name] = (stat.st_mtime_ns, stat.st_size, report)
+                if previous is None:
+                    added += 1
+                else:
+                    changed += 1
+
+        for filename in list(files):
+            if filename not in seen:
+                del files[filename]
+                removed += 1
+
+        if added or changed or removed or self._snapshot is None:
+            self._files = files
+            # Single reference assignment: readers see either the old or the new snapshot
+            self._snapshot = self._build_snapshot(files)
+
+        self._last_check = time.monotonic()
+        self.refresh_count += 1
+        self.last_refresh_stats = {
+            "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+            "files_scanned": len(seen),
+            "added": added,
+            "changed": changed,
+            "removed": removed,
+            "failed": failed,
+            "reports": len(self._snapshot.reports),
+        }
+        if added or changed or removed:
+            print(f"---[Patient Registry: Refreshed {self.data_dir} {self.last_refresh_stats}]---")
+        return self.last_refresh_stats
+
+    @staticmethod
+    def _build_snapshot(files: dict) -> RegistrySnapshot:
+        reports = [files[filename][2] for filename in sorted(files)]
+
+        by_name, by_date, by_diagnosis = {}, {}, {}
+        for report_id, report in enumerate(reports):
+            by_name.setdefault(normalize_key(report.get("patient_name", "")), []).append(report_id)
+            by_date.setdefault(normalize_key(report.get("discharge_date", "")), []).append(report_id)
+            by_diagnosis.setdefault(normalize_key(report.get("primary_diagnosis", "")), []).append(report_id)
+
+        return RegistrySnapshot(reports, by_name, by_date, by_diagnosis)
+
+    def snapshot(self) -> RegistrySnapshot:
+        """
+        Returns the current, fully built snapshot (loading it on first use).
+        """
+        self.ensure_loaded()
+        return self._snapshot or EMPTY_SNAPSHOT
+
+    def __len__(self):
+        return len(self.snapshot().reports)
+
+    # --- Lookups ---
+
+    def _lookup(self, index_name: str, value) -> list[dict]:
+        snap = self.snapshot()
+        index = getattr(snap, index_name)
+        return [snap.reports[i] for i in index.get(normalize_key(value), [])]
+
+    def find_by_name(self, patient_name: str) -> list[dict]:
+        """
+        Returns every report whose patient name matches (case-insensitive).
+        """
+        return self._lookup("by_name", patient_name)
+
+    def find_by_discharge_date(self, discharge_date: str) -> list[dict]:
+        """
+        Returns every report with exactly this discharge date (YYYY-MM-DD).
+        """
+        return self._lookup("by_discharge_date", discharge_date)
+
+    def find_by_diagnosis(self, diagnosis: str) -> list[dict]:
+        """
+        Returns every report whose primary diagnosis matches exactly (case-insensitive).
+        """
+        return self._lookup("by_diagnosis", diagnosis)
+
+    def resolve_clarification(self, patient_name: str, detail: str) -> list[dict]:
+        """
+        Narrows the reports for a patient name using a discharge date or diagnosis.
+
+        An exact date or diagnosis match is answered from the secondary indexes.
+        If nothing matches exactly, falls back to a partial diagnosis match over
+        that patient's reports only. Returns the list of matching reports, so the
+        caller can tell a unique match from an ambiguous or failed one.
+        """
+        snap = self.snapshot()
+        candidate_ids = set(snap.by_name.get(normalize_key(patient_name), []))
+        if not candidate_ids:
+            return []
+
+        detail_key = normalize_key(detail)
+        exact_ids = set(snap.by_discharge_date.get(detail_key, [])) | set(snap.by_diagnosis.get(detail_key, []))
+        matched_ids = candidate_ids & exact_ids
+
+        if not matched_ids:
+            # Partial diagnosis match, e.g. "stage 3" for "Chronic Kidney Disease Stage 3"
+            matched_ids = {
+                i for i in candidate_ids
+                if detail_key and detail_key in normalize_key(snap.reports[i].get("primary_diagnosis", ""))
+            }
+
+        return [snap.reports[i] for i in sorted(matched_ids)]
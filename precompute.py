@@ -0,0 +1,339 @@
+"""
+Precomputes a context bundle for every discharge report in data/.
+
+Each bundle (patient_bundles/<report hash>.json) holds:
+  - the compact report JSON,
+  - the receptionist greeting, generated ahead of time,
+  - reference chunks retrieved for the patient's diagnosis, medications and
+    warning signs.
+
+The Streamlit app then greets a patient without an LLM call (Step 1) and
+adds the pre-retrieved chunks to the context of their questions (Step 2).
+
+Bundles are keyed on a hash of the report content, so a re-run only
+processes new or edited reports. Bundles of reports that no longer exist are
+removed. Greetings come from the local fake LLM unless --live is given;
+chunks come from the RAG tool (--rag hybrid|dense|lexical). --rag fake uses
+the reference stand-in for offline runs; the app never serves those bundles.
+
+Usage:
+    python precompute.py [--workers 8] [--live] [--rag hybrid] [--force]
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from patient_registry import PATIENT_DATA_DIR
+from clinical_pipeline import invoke_llm, build_backends, LIVE_LLM_NAME, FAKE_LLM_NAME
+from prompt_builder import compact_json, split_rag_context, dedupe_chunks, estimate_tokens
+from lexical_index import BM25Index
+from logger import app_logger
+
+# Define the directory where precomputed bundles are stored
+BUNDLE_DIR = "patient_bundles"
+
+# Bump when the bundle contents or the greeting prompt change
+BUNDLE_VERSION = 1
+
+# Pre-retrieved chunks kept per patient, and how many are added to a question's context
+SEED_CHUNKS = 8
+SEED_CHUNKS_PER_QUESTION = 2
+
+FAKE_RAG_BACKEND = "fake"
+
+# Leading words of a medications entry that are instructions, not part of the drug name
+MEDICATION_INSTRUCTION_WORDS = {"hold", "stop", "start", "restart", "resume", "continue", "discontinue",
+                                "take", "new", "all", "any"}
+
+
+def report_hash(report: dict) -> str:
+    """
+    Content hash of a report (key order and whitespace do not matter).
+    """
+    canonical = json.dumps(report, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(f"{BUNDLE_VERSION}\0{canonical}".encode("utf-8")).hexdigest()
+
+
+def bundle_path(digest: str, bundle_dir: str = BUNDLE_DIR) -> str:
+    return os.path.join(bundle_dir, f"{digest}.json")
+
+
+def retriever_info(rag_mode: str) -> dict:
+    """
+    Identifies what retrieved a bundle's chunks: the reference stand-in, or
+    the RAG tool's vector backend and embedding model.
+    """
+    if rag_mode == "fake":
+        return {"backend": FAKE_RAG_BACKEND, "embedding_model": None, "mode": rag_mode}
+    import agent_tool
+    return {"backend": agent_tool.VECTOR_BACKEND, "embedding_model": agent_tool.EMBEDDING_MODEL_NAME, "mode": rag_mode}
+
+
+def same_retriever(recorded: dict | None, current: dict) -> bool:
+    # The retrieval mode only changes the ranking, not where chunks come from
+    return bool(recorded) and all(recorded.get(key) == current[key] for key in ("backend", "embedding_model"))
+
+
+def build_greeting_prompt(report_string: str, after_clarification: bool = False) -> str:
+    found = "just found after clarification" if after_clarification else "just found"
+    return f"""
+    You are a friendly receptionist. A patient's report was {found}.
+    Patient Report: {report_string}
+
+    Greet the patient by name and briefly summarize their primary diagnosis and follow-up date.
+    Then, ask them a friendly open-ended question like 'How are you feeling today?' or 'Do you have any questions about your discharge instructions?'
+    """
+
+
+def medication_name(entry: str) -> str:
+    """
+    Drug name(s) of a medications entry: the text before the dose, without
+    instruction words, plus bracketed brand or generic names.
+    "Renvela (Sevelamer) 1600mg with meals" -> "Renvela Sevelamer",
+    "Hold Metformin" -> "Metformin".
+    """
+    head = re.split(r"\d", str(entry), maxsplit=1)[0]
+    aliases = []
+    for group in re.findall(r"\(([^)]*)\)", head):
+        names = [name.strip() for name in group.split(",")]
+        if all(re.fullmatch(r"[A-Z][\w-]*( [A-Z][\w-]*)?", name) for name in names):
+            aliases.extend(names)
+    words = re.sub(r"\([^)]*\)?", " ", head).split()
+    while words and words[0].lower() in MEDICATION_INSTRUCTION_WORDS:
+        words.pop(0)
+    return " ".join(words + aliases)
+
+
+def seed_queries(report: dict) -> list[str]:
+    """
+    Reference-book queries for what most of this patient's questions will be about.
+    """
+    diagnosis = report.get("primary_diagnosis", "")
+    medications = [name for name in map(medication_name, report.get("medications", [])) if name]
+    warning_signs = [str(w) for w in report.get("warning_signs", [])]
+    queries = [diagnosis]
+    if medications:
+        queries.append(f"{diagnosis} medications {' '.join(medications)}")
+    if warning_signs:
+        queries.append(f"{diagnosis} warning signs {', '.join(warning_signs)}")
+    return [q for q in queries if q.strip()]
+
+
+# --- Building bundles ---
+
+def build_bundle(report: dict, source_file: str, llm, llm_name: str, rag_fn, retriever: dict) -> dict:
+    """
+    Generates the greeting and retrieves the seed chunks for one report.
+    Raises if retrieval fails or finds nothing, so no seedless bundle is
+    written (the report is reported as failed and retried on the next run).
+    """
+    start = time.perf_counter()
+    report_string = json.dumps(report, indent=2)
+    greeting_prompt = build_greeting_prompt(report_string)
+    greeting, llm_timings = invoke_llm(llm, greeting_prompt, label="Precomputed greeting")
+
+    rag_start = time.perf_counter()
+    chunks = []
+    for query in seed_queries(report):
+        context = rag_fn(query)
+        # The RAG tool reports failures as text; a bundle without seeds would look up to date forever
+        if str(context).startswith("Error:"):
+            raise RuntimeError(f"retrieval failed for '{query}': {context}")
+        chunks.extend(c for c in split_rag_context(context) if c.get("source"))
+    if not chunks:
+        raise RuntimeError("no reference chunks retrieved (is the vector database built? run python ingest.py)")
+    chunks = dedupe_chunks(chunks)[:SEED_CHUNKS]
+    rag_seconds = time.perf_counter() - rag_start
+
+    return {
+        "version": BUNDLE_VERSION,
+        "report_hash": report_hash(report),
+        "source_file": source_file,
+        "patient_name": report.get("patient_name"),
+        "compact_report": compact_json(report),
+        "greeting": greeting,
+        "llm": llm_name,
+        "rag": retriever,
+        "seed_chunks": chunks,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "cost": {
+            "greeting_seconds": round(llm_timings["total"], 4),
+            "greeting_prompt_tokens": estimate_tokens(greeting_prompt),
+            "greeting_tokens": estimate_tokens(greeting),
+            "rag_seconds": round(rag_seconds, 4),
+            "rag_queries": len(seed_queries(report)),
+            "total_seconds": round(time.perf_counter() - start, 4),
+        },
+    }
+
+
+def write_bundle(bundle: dict, bundle_dir: str = BUNDLE_DIR):
+    path = bundle_path(bundle["report_hash"], bundle_dir)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(bundle, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_reports(data_dir: str) -> list[tuple[str, dict]]:
+    reports = []
+    for name in sorted(os.listdir(data_dir)):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(data_dir, name), 'r') as f:
+                reports.append((name, json.load(f)))
+        except (OSError, ValueError) as e:
+            print(f"Skipping unreadable report {name}: {e}")
+    return reports
+
+
+def run_precompute(data_dir: str = PATIENT_DATA_DIR, bundle_dir: str = BUNDLE_DIR, workers: int = 8,
+                   live: bool = False, rag_mode: str = "hybrid", force: bool = False) -> dict:
+    """
+    Builds bundles for new or changed reports on `workers` threads and prunes
+    bundles of reports that are gone. Returns a summary with per-patient costs.
+    """
+    run_start = time.perf_counter()
+    os.makedirs(bundle_dir, exist_ok=True)
+    llm, rag_fn, _ = build_backends(live, rag_mode)
+    llm_name = LIVE_LLM_NAME if live else FAKE_LLM_NAME
+    retriever = retriever_info(rag_mode)
+
+    reports = load_reports(data_dir)
+    wanted = {report_hash(report): (name, report) for name, report in reports}
+
+    pending = []
+    for digest, (name, report) in wanted.items():
+        existing = load_bundle_file(bundle_path(digest, bundle_dir))
+        if (force or existing is None or existing.get("llm") != llm_name
+                or not same_retriever(existing.get("rag"), retriever)):
+            pending.append((name, report))
+    print(f"{len(reports)} report(s) in {data_dir}; {len(wanted) - len(pending)} bundle(s) up to date, "
+          f"{len(pending)} to build with {workers} worker(s).")
+
+    def work(item):
+        name, report = item
+        try:
+            bundle = build_bundle(report, name, llm, llm_name, rag_fn, retriever)
+            write_bundle(bundle, bundle_dir)
+            return name, bundle["cost"], None
+        except Exception as e:
+            return name, None, str(e)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="precompute") as pool:
+        results = list(pool.map(work, pending))
+
+    removed = 0
+    for filename in os.listdir(bundle_dir):
+        if filename.endswith(".json") and filename[:-len(".json")] not in wanted:
+            os.remove(os.path.join(bundle_dir, filename))
+            removed += 1
+
+    costs = {name: cost for name, cost, error in results if cost is not None}
+    errors = {name: error for name, _, error in results if error is not None}
+    summary = {
+        "reports": len(reports),
+        "built": len(costs),
+        "up_to_date": len(wanted) - len(pending),
+        "removed": removed,
+        "errors": errors,
+        "wall_seconds": round(time.perf_counter() - run_start, 3),
+        "per_patient": costs,
+    }
+    return summary
+
+
+def print_summary(summary: dict):
+    if summary["per_patient"]:
+        print(f"\n{'report':<20} {'greeting s':>10} {'rag s':>8} {'total s':>8} {'prompt tok':>10} {'reply tok':>9}")
+    for name, cost in sorted(summary["per_patient"].items()):
+        print(f"{name:<20} {cost['greeting_seconds']:>10.3f} {cost['rag_seconds']:>8.3f} {cost['total_seconds']:>8.3f} "
+              f"{cost['greeting_prompt_tokens']:>10} {cost['greeting_tokens']:>9}")
+    costs = list(summary["per_patient"].values())
+    if costs:
+        total = sum(c["total_seconds"] for c in costs)
+        tokens = sum(c["greeting_prompt_tokens"] + c["greeting_tokens"] for c in costs)
+        print(f"\nPer patient: {total / len(costs):.3f}s of work, ~{tokens / len(costs):.0f} LLM tokens (estimated).")
+    for name, error in summary["errors"].items():
+        print(f"FAILED {name}: {error}")
+    print(f"Built {summary['built']}, {summary['up_to_date']} up to date, removed {summary['removed']} stale, "
+          f"{len(summary['errors'])} failed; total {summary['wall_seconds']:.2f}s wall.")
+
+
+# --- Serving bundles (used by app.py) ---
+
+def load_bundle_file(path: str) -> dict | None:
+    try:
+        with open(path, 'r') as f:
+            bundle = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return bundle if bundle.get("version") == BUNDLE_VERSION else None
+
+
+def load_bundle(report: dict, llm_name: str, retriever: dict, bundle_dir: str = BUNDLE_DIR) -> dict | None:
+    """
+    Returns the precomputed bundle for exactly this report content, generated
+    with the same LLM and seeded by the same retriever (never the reference
+    stand-in), or None.
+    """
+    bundle = load_bundle_file(bundle_path(report_hash(report), bundle_dir))
+    if bundle is None or bundle.get("llm") != llm_name:
+        return None
+    recorded = bundle.get("rag") or {}
+    if recorded.get("backend") == FAKE_RAG_BACKEND or not same_retriever(recorded, retriever):
+        app_logger.warning(f"Ignoring precomputed bundle for '{bundle.get('patient_name')}': "
+                           f"seeded by {recorded or 'an unknown retriever'}, expected {retriever}.")
+        return None
+    return bundle
+
+
+def format_chunks(chunks: list[dict]) -> str:
+    """
+    Formats chunks like get_rag_context does.
+    """
+    context = ""
+    for i, chunk in enumerate(chunks):
+        context += f"--- Relevant Context Chunk {i+1} (Source: {chunk.get('source') or 'Unknown'}) ---\n"
+        context += chunk["content"]
+        context += "\n---------------------------------------------------\n"
+    return context
+
+
+def seed_rag_context(bundle: dict | None, question: str, rag_context) -> str:
+    """
+    Adds the patient's pre-retrieved chunks that match the question (BM25
+    over the seed set) to the retrieved context. If retrieval returned
+    nothing usable, the best seed chunks stand in for it.
+    """
+    if not bundle or not bundle.get("seed_chunks"):
+        return rag_context
+    seeds = bundle["seed_chunks"]
+    index = BM25Index()
+    index.add_documents((str(i), chunk["content"], {}) for i, chunk in enumerate(seeds))
+
+    retrieved = [c for c in split_rag_context(rag_context) if c.get("source")]
+    limit = SEED_CHUNKS_PER_QUESTION if retrieved else SEED_CHUNKS_PER_QUESTION * 2
+    matches = [seeds[int(hit.id)] for hit in index.search(question, k=limit)]
+    if not matches:
+        return rag_context
+    return format_chunks(dedupe_chunks(retrieved + matches))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", default=PATIENT_DATA_DIR, help="Patient report directory")
+    parser.add_argument("--bundle-dir", default=BUNDLE_DIR, help="Where bundles are written")
+    parser.add_argument("--workers", type=int, default=8, help="Reports processed in parallel")
+    parser.add_argument("--live", action="store_true", help="Generate greetings with Gemini instead of the fake LLM")
+    parser.add_argument("--rag", default="hybrid", choices=["hybrid", "dense", "lexical", "fake"],
+                        help="Retrieval mode of the RAG tool, or 'fake' for the offline stand-in (not served by the app)")
+    parser.add_argument("--force", action="store_true", help="Rebuild every bundle")
+    args = parser.parse_args()
+
+    print_summary(run_precompute(args.data_dir, args.bundle_dir, args.workers, args.live, args.rag, args.force))
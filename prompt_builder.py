@@ -0,0 +1,324 @@
+import os
+import re
+import json
+import math
+import textwrap
+
+from logger import app_logger
+
+# Input-token budget for the clinical prompt (estimated, see estimate_tokens)
+DEFAULT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))
+
+# Rough characters-per-token ratio for English text; good enough for budgeting
+CHARS_PER_TOKEN = 4
+
+# Share of the context budget the reference book gets before web results
+RAG_BUDGET_SHARE = 0.75
+
+# RAG chunks whose word 3-grams overlap this much with a kept chunk are dropped
+CHUNK_OVERLAP_THRESHOLD = 0.5
+
+# Sent when no retrieved context fits; counted in the fixed part of the prompt
+NO_RAG_CONTEXT = "No relevant information found in the reference materials."
+NO_WEB_CONTEXT = "No web search results."
+
+MAX_WEB_SNIPPET_CHARS = 400
+MIN_WEB_SCORE = 0.3
+
+# Always sent, whatever the question
+CORE_REPORT_FIELDS = ("patient_name", "primary_diagnosis")
+
+# Words in a question that make a report field relevant
+REPORT_FIELD_KEYWORDS = {
+    "discharge_date": ("discharge", "discharged", "date", "when", "how long", "since"),
+    "medications": ("medication", "medicine", "meds", "drug", "pill", "dose", "dosage", "tablet",
+                    "prescription", "take", "taking", "side effect", "restart", "stop"),
+    "dietary_restrictions": ("eat", "food", "diet", "drink", "fluid", "water", "salt", "sodium",
+                             "potassium", "protein", "meal", "alcohol", "coffee", "fruit", "banana"),
+    "follow_up": ("follow", "appointment", "clinic", "visit", "doctor", "see", "check", "lab", "test", "blood"),
+    "warning_signs": ("warning", "sign", "symptom", "emergency", "worse", "swelling", "pain", "breath",
+                      "dizzy", "urine", "fever", "worried", "normal"),
+    "discharge_instructions": ("instruction", "should i", "can i", "exercise", "activity", "monitor",
+                               "weigh", "blood pressure", "home", "work", "normal"),
+}
+
+# Common words that say nothing about which field a question is about; ignored
+# when matching question words against report values
+VALUE_STOPWORDS = {"what", "when", "with", "your", "that", "this", "have", "from", "about", "should",
+                   "after", "before", "daily", "does", "will", "them", "they", "there", "which", "also"}
+
+RAG_CHUNK_PATTERN = re.compile(
+    r"--- Relevant Context Chunk \d+ \(Source: (?P<source>.*?)\) ---\n(?P<content>.*?)\n-{10,}\n?", re.S
+)
+
+PROMPT_TEMPLATE = textwrap.dedent("""\
+    You are an expert AI assistant specializing in nephrology.
+    Your primary duty is to answer a patient's question.
+
+    PATIENT DISCHARGE REPORT (relevant fields, JSON):
+    {report}
+
+    PATIENT'S QUESTION:
+    "{question}"
+
+    CONTEXT FROM NEPHROLOGY REFERENCE BOOK (RAG):
+    {rag_context}
+
+    CONTEXT FROM WEB SEARCH:
+    {web_context}
+
+    INSTRUCTIONS:
+    1. Answer the patient's question based *first* on the REFERENCE BOOK context and their DISCHARGE REPORT.
+    2. If the question is about new research or information not in the book, use the WEB SEARCH context.
+    3. You *must* cite your sources. Use "(Source: Reference Book)" or "(Source: Web Search)".
+    4. Be helpful, accurate, and safe.
+    5. You *must* end your entire response with the following medical disclaimer:
+       "Disclaimer: I am an AI assistant for educational purposes only. Always consult healthcare professionals for medical advice."
+    """)
+
+# For general questions: no report fields, so the answer can be shared (semantic cache)
+GENERAL_PROMPT_TEMPLATE = textwrap.dedent("""\
+    You are an expert AI assistant specializing in nephrology.
+    Your primary duty is to answer a general question from a patient diagnosed with: {diagnosis}
+
+    PATIENT'S QUESTION:
+    "{question}"
+
+    CONTEXT FROM NEPHROLOGY REFERENCE BOOK (RAG):
+    {rag_context}
+
+    CONTEXT FROM WEB SEARCH:
+    {web_context}
+
+    INSTRUCTIONS:
+    1. Answer for any patient with this diagnosis, based *first* on the REFERENCE BOOK context. You do not have this patient's report: do not guess their medications, doses, dates or test results, and suggest they check their discharge instructions for anything specific to them.
+    2. If the question is about new research or information not in the book, use the WEB SEARCH context.
+    3. You *must* cite your sources. Use "(Source: Reference Book)" or "(Source: Web Search)".
+    4. Be helpful, accurate, and safe.
+    5. You *must* end your entire response with the following medical disclaimer:
+       "Disclaimer: I am an AI assistant for educational purposes only. Always consult healthcare professionals for medical advice."
+    """)
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text: str, tokens: int) -> str:
+    """
+    Cuts text to about `tokens` tokens, preferring a sentence or word boundary.
+    """
+    max_chars = tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    boundary = max(cut.rfind(". "), cut.rfind("\n"))
+    if boundary < max_chars // 2:
+        boundary = cut.rfind(" ")
+    return cut[:boundary + 1].rstrip() + " ..." if boundary > 0 else cut
+
+
+# --- Report ---
+
+def _keyword_pattern(keywords) -> re.Pattern:
+    # Whole words only ("eat" must not match "treat"), allowing a plural "s"/"es"
+    alternatives = "|".join(re.escape(k) for k in sorted(keywords, key=len, reverse=True))
+    return re.compile(rf"\b(?:{alternatives})(?:e?s)?\b")
+
+
+REPORT_FIELD_PATTERNS = {field: _keyword_pattern(keywords) for field, keywords in REPORT_FIELD_KEYWORDS.items()}
+
+
+def select_report_fields(report: dict, question: str) -> dict:
+    """
+    Keeps the core fields plus those relevant to the question: by keyword
+    (whole words), or because the question mentions one of the field's values
+    (e.g. a drug name). A question that matches no field (e.g. "What is
+    eGFR?") gets the core fields only.
+    """
+    question_lower = question.lower()
+    question_words = set(re.findall(r"[a-z]{4,}", question_lower)) - VALUE_STOPWORDS
+    selected = {field: report[field] for field in CORE_REPORT_FIELDS if field in report}
+    for field, pattern in REPORT_FIELD_PATTERNS.items():
+        if field not in report:
+            continue
+        value_words = set(re.findall(r"[a-z]{4,}", json.dumps(report[field]).lower()))
+        if pattern.search(question_lower) or value_words & question_words:
+            selected[field] = report[field]
+    return selected
+
+
+def compact_json(data) -> str:
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+# --- RAG chunks ---
+
+def split_rag_context(rag_context) -> list[dict]:
+    """
+    Turns the RAG tool's formatted text back into [{"source", "content"}, ...].
+    Text that is not in the chunk format (e.g. an error or fallback note) is
+    kept as a single chunk.
+    """
+    if isinstance(rag_context, list):
+        return rag_context
+    chunks = [
+        {"source": m.group("source"), "content": m.group("content").strip()}
+        for m in RAG_CHUNK_PATTERN.finditer(rag_context or "")
+    ]
+    if not chunks and rag_context:
+        chunks = [{"source": None, "content": str(rag_context).strip()}]
+    return chunks
+
+
+def _shingles(text: str, n: int = 3) -> set:
+    words = re.findall(r"\w+", text.lower())
+    return {tuple(words[i:i + n]) for i in range(max(1, len(words) - n + 1))}
+
+
+def dedupe_chunks(chunks: list[dict], threshold: float = CHUNK_OVERLAP_THRESHOLD) -> list[dict]:
+    """
+    Drops chunks whose word 3-grams overlap heavily with an earlier (higher
+    ranked) chunk, e.g. neighbouring splits sharing their 200-char overlap.
+    """
+    kept, kept_shingles = [], []
+    for chunk in chunks:
+        shingles = _shingles(chunk["content"])
+        overlap = max(
+            (len(shingles & other) / min(len(shingles), len(other)) for other in kept_shingles if other),
+            default=0.0,
+        )
+        if overlap < threshold:
+            kept.append(chunk)
+            kept_shingles.append(shingles)
+    return kept
+
+
+# --- Web results ---
+
+def rank_web_results(web_context) -> list[dict]:
+    """
+    Normalizes web search output to [{"url", "content", "score"}, ...],
+    best score first, dropping low-relevance results.
+    """
+    if isinstance(web_context, str):
+        return [{"url": None, "content": web_context, "score": None}] if web_context.strip() else []
+    results = [r for r in (web_context or []) if isinstance(r, dict) and r.get("content")]
+    results = [r for r in results if r.get("score") is None or r["score"] >= MIN_WEB_SCORE]
+    return sorted(results, key=lambda r: -(r.get("score") or 0.0))
+
+
+# --- Assembly ---
+
+def _budget_context(rag_context, web_context, remaining: int) -> tuple[str, str, dict]:
+    """
+    Fits de-duplicated RAG chunks in rank order (up to RAG_BUDGET_SHARE, more
+    if the web needs less), then web snippets by relevance score, each
+    trimmed to MAX_WEB_SNIPPET_CHARS, into `remaining` estimated tokens.
+    """
+    # Reference book chunks
+    all_chunks = split_rag_context(rag_context)
+    chunks = dedupe_chunks(all_chunks)
+    web_results = rank_web_results(web_context)
+    rag_allowance = remaining if not web_results else int(remaining * RAG_BUDGET_SHARE)
+    rag_parts, rag_tokens = [], 0
+    for chunk in chunks:
+        source = f" (Source: {chunk['source']})" if chunk.get("source") else ""
+        text = f"[Chunk {len(rag_parts) + 1}{source}] {chunk['content']}"
+        available = rag_allowance - rag_tokens
+        if estimate_tokens(text) > available:
+            if rag_parts or available < 50:
+                break
+            text = truncate_to_tokens(text, available)
+        rag_parts.append(text)
+        rag_tokens += estimate_tokens(text) + 1
+
+    # Web snippets get what the reference book left over
+    web_allowance = remaining - rag_tokens
+    web_parts, web_tokens = [], 0
+    for result in web_results:
+        snippet = truncate_to_tokens(result["content"].strip(), MAX_WEB_SNIPPET_CHARS // CHARS_PER_TOKEN)
+        text = f"- {snippet}" + (f" ({result['url']})" if result.get("url") else "")
+        if web_tokens + estimate_tokens(text) > web_allowance:
+            break
+        web_parts.append(text)
+        web_tokens += estimate_tokens(text) + 1
+
+    counts = {
+        "rag_chunks": f"{len(rag_parts)}/{len(all_chunks)}",
+        "web_results": f"{len(web_parts)}/{len(web_results)}",
+    }
+    return (
+        "\n".join(rag_parts) or NO_RAG_CONTEXT,
+        "\n".join(web_parts) or NO_WEB_CONTEXT,
+        counts,
+    )
+
+
+def _prompt_stats(prompt: str, token_budget: int, **extra) -> dict:
+    return {
+        "token_budget": token_budget,
+        "estimated_tokens": estimate_tokens(prompt),
+        "budget_used": round(estimate_tokens(prompt) / token_budget, 3) if token_budget else None,
+        "chars": len(prompt),
+        "over_budget": max(0, estimate_tokens(prompt) - token_budget),
+        **extra,
+    }
+
+
+def build_budgeted_prompt(report: dict, question: str, rag_context, web_context,
+                          token_budget: int = DEFAULT_TOKEN_BUDGET) -> tuple[str, dict]:
+    """
+    Assembles the clinical prompt within an estimated input-token budget.
+
+    The template, the question and the relevant report fields (compact JSON)
+    come first; if they alone exceed the budget, the selected non-core fields
+    are dropped, last selected first. What remains of the budget goes to the
+    retrieved context (see _budget_context). Returns the prompt and its size
+    stats; "over_budget" is the estimated overrun when even the template,
+    question and core fields do not fit.
+    """
+    fields = select_report_fields(report, question)
+    dropped = []
+
+    def fixed_tokens():
+        return estimate_tokens(PROMPT_TEMPLATE.format(report=compact_json(fields), question=question,
+                                                      rag_context=NO_RAG_CONTEXT, web_context=NO_WEB_CONTEXT))
+
+    while fixed_tokens() > token_budget:
+        optional = [f for f in fields if f not in CORE_REPORT_FIELDS]
+        if not optional:
+            break
+        dropped.append(optional[-1])
+        del fields[optional[-1]]
+
+    report_text = compact_json(fields)
+    rag_text, web_text, counts = _budget_context(rag_context, web_context, max(0, token_budget - fixed_tokens()))
+
+    prompt = PROMPT_TEMPLATE.format(report=report_text, question=question, rag_context=rag_text, web_context=web_text)
+    stats = _prompt_stats(prompt, token_budget, report_fields=sorted(fields), dropped_fields=dropped, **counts)
+    if stats["over_budget"]:
+        app_logger.warning(f"Clinical prompt is {stats['over_budget']} tokens over its {token_budget}-token budget.")
+    app_logger.info(f"Clinical prompt built: {stats}")
+    return prompt, stats
+
+
+def build_general_prompt(diagnosis: str, question: str, rag_context, web_context,
+                         token_budget: int = DEFAULT_TOKEN_BUDGET) -> tuple[str, dict]:
+    """
+    Like build_budgeted_prompt, but with the diagnosis as the only patient
+    detail. Answers to it contain nothing from the report, so they can be
+    shared with other patients with the same diagnosis.
+    """
+    fixed_tokens = estimate_tokens(GENERAL_PROMPT_TEMPLATE.format(diagnosis=diagnosis, question=question,
+                                                                  rag_context=NO_RAG_CONTEXT,
+                                                                  web_context=NO_WEB_CONTEXT))
+    rag_text, web_text, counts = _budget_context(rag_context, web_context, max(0, token_budget - fixed_tokens))
+
+    prompt = GENERAL_PROMPT_TEMPLATE.format(diagnosis=diagnosis, question=question,
+                                            rag_context=rag_text, web_context=web_text)
+    stats = _prompt_stats(prompt, token_budget, report_fields=[], **counts)
+    if stats["over_budget"]:
+        app_logger.warning(f"General clinical prompt is {stats['over_budget']} tokens over its {token_budget}-token budget.")
+    app_logger.info(f"General clinical prompt built: {stats}")
+    return prompt, stats
@@ -0,0 +1,370 @@
+"""
+Quantized, memory-mapped vector store: an alternative to Chroma for the
+reference chunks (VECTOR_BACKEND=quantized in agent_tool.py,
+--backend quantized in ingest.py).
+
+Vectors are L2-normalized and stored twice in `<persist_dir>/quantized_index/`:
+
+  codes.i8     int8 codes (one scale per vector) - scanned at query time
+  vectors.f32  the float32 originals - only the top candidates are read back
+               for exact re-scoring
+
+Both are read through read-only memory maps, so every process that opens the
+store shares the same page-cache copy instead of loading its own. Rows are
+grouped by an IVF (inverted file) index: a query is compared with the
+`nlist` k-means centroids and only the rows of the `nprobe` nearest lists are
+scored with the int8 codes; the best `rescore` of those are re-scored exactly.
+
+It implements the subset of the LangChain Chroma interface that ingest.py
+and agent_tool.py use (add_texts, get, delete, persist, similarity_search,
+similarity_search_by_vector). Writes are buffered in memory and persist()
+rebuilds the files (and the IVF lists) in a new generation directory
+(`quantized_index/gen-*/`). The CURRENT file names the live generation and is
+replaced atomically once the new one is complete, so a reader always loads
+one whole generation; the previous one is kept for readers still loading it.
+"""
+import os
+import json
+import mmap
+import time
+import shutil
+
+import numpy as np
+
+from lexical_index import SearchHit, chunk_id as content_id
+
+QUANTIZED_INDEX_DIRNAME = "quantized_index"
+MANIFEST_FILENAME = "manifest.json"
+CURRENT_FILENAME = "CURRENT"
+FORMAT_VERSION = 1
+
+# Generations kept besides the live one, for readers that are still loading them
+KEEP_OLD_GENERATIONS = 1
+
+# IVF lists probed per query, and int8-scored candidates re-scored exactly
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "32"))
+RESCORE_CANDIDATES = int(os.getenv("IVF_RESCORE_CANDIDATES", "64"))
+
+# k-means training for the IVF centroids
+KMEANS_ITERATIONS = 12
+KMEANS_SAMPLE = 25000
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def quantize(vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Symmetric int8 quantization with one scale per vector: vector ~= codes * scale.
+    """
+    scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def train_ivf(vectors: np.ndarray, nlist: int, iterations: int = KMEANS_ITERATIONS,
+              sample: int = KMEANS_SAMPLE, seed: int = 0) -> np.ndarray:
+    """
+    Spherical k-means on (a sample of) the normalized vectors; returns the
+    normalized centroids.
+    """
+    rng = np.random.default_rng(seed)
+    train = vectors if len(vectors) <= sample else vectors[rng.choice(len(vectors), sample, replace=False)]
+    centroids = train[rng.choice(len(train), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(train @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, train)
+        empty = np.bincount(assignment, minlength=nlist) == 0
+        if empty.any():
+            # Re-seed empty lists with random points
+            sums[empty] = train[rng.choice(len(train), int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids.astype(np.float32)
+
+
+def default_nlist(count: int) -> int:
+    return max(1, min(4096, int(round(4 * np.sqrt(count)))))
+
+
+class QuantizedVectorStore:
+    """
+    int8 IVF vector store over memory-mapped files (see the module docstring).
+    """
+
+    def __init__(self, persist_directory: str, embedding_function=None, nprobe: int = IVF_NPROBE,
+                 rescore: int = RESCORE_CANDIDATES):
+        self.persist_directory = persist_directory
+        self.path = os.path.join(persist_directory, QUANTIZED_INDEX_DIRNAME)
+        self.embedding_function = embedding_function
+        self.nprobe = nprobe
+        self.rescore = rescore
+        self._pending = {}      # id -> (text, metadata, vector) added since the last persist()
+        self._deleted = set()   # persisted ids deleted since the last persist()
+        self._load()
+
+    # --- Loading ---
+
+    def _current_generation(self) -> str | None:
+        """
+        Directory of the live generation, or None if nothing was persisted yet.
+        An index written before generations existed lives directly in self.path.
+        """
+        try:
+            with open(os.path.join(self.path, CURRENT_FILENAME), 'r') as f:
+                return os.path.join(self.path, f.read().strip())
+        except FileNotFoundError:
+            legacy = os.path.exists(os.path.join(self.path, MANIFEST_FILENAME))
+            return self.path if legacy else None
+
+    def _load(self, attempts: int = 3):
+        for attempt in range(attempts):
+            try:
+                return self._load_generation(self._current_generation())
+            except FileNotFoundError:
+                # The generation was replaced and cleaned up while we read it: load the new one
+                if attempt == attempts - 1:
+                    raise
+
+    def _load_generation(self, generation: str | None):
+        self.ids, self.documents, self.metadatas = [], [], []
+        self.row_of = {}
+        self.dim = None
+        self.generation = generation
+        self.codes = self.scales = self.vectors = self.centroids = self.offsets = None
+        if generation is None:
+            return
+
+        with open(os.path.join(generation, MANIFEST_FILENAME), 'r') as f:
+            manifest = json.load(f)
+        count, self.dim = manifest["count"], manifest["dim"]
+        ids, documents, metadatas = [], [], []
+        with open(os.path.join(generation, "chunks.jsonl"), 'r') as f:
+            for line in f:
+                chunk = json.loads(line)
+                ids.append(chunk["id"])
+                documents.append(chunk["text"])
+                metadatas.append(chunk["metadata"])
+        if len(ids) != count:
+            raise ValueError(f"Quantized index {generation} is inconsistent: manifest says {count} chunks, "
+                             f"chunks.jsonl has {len(ids)}")
+        expected_sizes = {"codes.i8": count * self.dim, "scales.f32": count * 4, "vectors.f32": count * self.dim * 4}
+        for name, size in (expected_sizes.items() if count else ()):
+            actual = os.path.getsize(os.path.join(generation, name))
+            if actual != size:
+                raise ValueError(f"Quantized index {generation} is inconsistent: {name} has {actual} bytes, "
+                                 f"expected {size} for {count} chunks")
+        self.ids, self.documents, self.metadatas = ids, documents, metadatas
+        self.row_of = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        if not count:
+            return
+
+        def mapped(name, dtype, shape):
+            return np.memmap(os.path.join(generation, name), dtype=dtype, mode='r', shape=shape)
+
+        self.codes = mapped("codes.i8", np.int8, (count, self.dim))
+        self.scales = mapped("scales.f32", np.float32, (count,))
+        self.vectors = mapped("vectors.f32", np.float32, (count, self.dim))
+        if hasattr(mmap, "MADV_RANDOM"):
+            # Only a few scattered rows are re-scored per query: no read-ahead
+            self.vectors._mmap.madvise(mmap.MADV_RANDOM)
+        # Centroids and list offsets are small: keep them in memory
+        self.centroids = np.fromfile(os.path.join(generation, "centroids.f32"), dtype=np.float32).reshape(-1, self.dim)
+        self.offsets = np.fromfile(os.path.join(generation, "offsets.i64"), dtype=np.int64)
+
+    def __len__(self):
+        return len(self.ids) - len(self._deleted) + len(self._pending)
+
+    # --- Chroma-compatible writes ---
+
+    def add_texts(self, texts: list[str], metadatas: list[dict] | None = None, ids: list[str] | None = None):
+        """
+        Embeds and buffers new chunks; they are written (and searchable) after persist().
+        """
+        texts = list(texts)
+        vectors = self.embedding_function.embed_documents(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [content_id(text, metadata.get("source")) for text, metadata in zip(texts, metadatas)]
+        for chunk_id, text, metadata, vector in zip(ids, texts, metadatas, vectors):
+            if chunk_id in self.row_of:
+                # Replaces the persisted copy on the next persist()
+                self._deleted.add(chunk_id)
+            self._pending[chunk_id] = (text, metadata, vector)
+        return list(ids)
+
+    def add_embeddings(self, ids: list[str], texts: list[str], metadatas: list[dict], vectors):
+        """
+        Buffers chunks whose vectors are already computed (e.g. copied from Chroma).
+        """
+        for chunk_id, text, metadata, vector in zip(ids, texts, metadatas, vectors):
+            if chunk_id in self.row_of:
+                # Replaces the persisted copy on the next persist()
+                self._deleted.add(chunk_id)
+            self._pending[chunk_id] = (text, metadata, vector)
+
+    def delete(self, ids: list[str]):
+        for chunk_id in ids:
+            self._pending.pop(chunk_id, None)
+            if chunk_id in self.row_of:
+                self._deleted.add(chunk_id)
+
+    def get(self, ids: list[str] | None = None, where: dict | None = None, include: list | None = None) -> dict:
+        """
+        Returns {"ids", "documents", "metadatas"} for live chunks, optionally
+        restricted to `ids` and to metadata equal to every `where` item.
+        """
+        include = ["documents", "metadatas"] if include is None else include
+        if ids is None:
+            candidates = [i for i in self.ids if i not in self._deleted] + list(self._pending)
+        else:
+            candidates = [i for i in ids if i in self._pending or (i in self.row_of and i not in self._deleted)]
+
+        result = {"ids": [], "documents": [], "metadatas": []}
+        for chunk_id in candidates:
+            text, metadata = self._chunk(chunk_id)
+            if where and any(metadata.get(key) != value for key, value in where.items()):
+                continue
+            result["ids"].append(chunk_id)
+            if "documents" in include:
+                result["documents"].append(text)
+            if "metadatas" in include:
+                result["metadatas"].append(metadata)
+        return result
+
+    def _chunk(self, chunk_id: str) -> tuple[str, dict]:
+        if chunk_id in self._pending:
+            text, metadata, _ = self._pending[chunk_id]
+            return text, metadata
+        row = self.row_of[chunk_id]
+        return self.documents[row], self.metadatas[row]
+
+    def persist(self, nlist: int | None = None) -> dict | None:
+        """
+        Writes the live chunks to a new generation (re-training the IVF
+        lists) and makes it the live one. Returns build stats, or None if
+        nothing changed.
+        """
+        if not self._pending and not self._deleted:
+            return None
+        start = time.perf_counter()
+
+        keep_rows = [row for row, chunk_id in enumerate(self.ids) if chunk_id not in self._deleted]
+        ids = [self.ids[row] for row in keep_rows] + list(self._pending)
+        documents = [self.documents[row] for row in keep_rows] + [p[0] for p in self._pending.values()]
+        metadatas = [self.metadatas[row] for row in keep_rows] + [p[1] for p in self._pending.values()]
+        parts = []
+        if keep_rows:
+            parts.append(np.asarray(self.vectors[keep_rows], dtype=np.float32))
+        if self._pending:
+            parts.append(normalize_rows(np.asarray([p[2] for p in self._pending.values()], dtype=np.float32)))
+        vectors = np.vstack(parts) if parts else np.zeros((0, self.dim or 0), dtype=np.float32)
+
+        stats = self._write(ids, documents, metadatas, vectors, nlist)
+        self._pending, self._deleted = {}, set()
+        self._load()
+        stats["build_seconds"] = round(time.perf_counter() - start, 3)
+        return stats
+
+    def _write(self, ids, documents, metadatas, vectors: np.ndarray, nlist: int | None) -> dict:
+        count, dim = vectors.shape
+        os.makedirs(self.path, exist_ok=True)
+        generation_name = f"gen-{time.time_ns()}-{os.getpid()}"
+        tmp_path = os.path.join(self.path, generation_name)
+        os.makedirs(tmp_path)
+
+        nlist = min(nlist or default_nlist(count), count) if count else 0
+        if count:
+            centroids = train_ivf(vectors, nlist)
+            assignment = np.argmax(vectors @ centroids.T, axis=1)
+            # Store rows grouped by list, so a probed list is one contiguous slice
+            order = np.argsort(assignment, kind="stable")
+            vectors, assignment = vectors[order], assignment[order]
+            ids = [ids[i] for i in order]
+            documents = [documents[i] for i in order]
+            metadatas = [metadatas[i] for i in order]
+            offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=nlist))]).astype(np.int64)
+            codes, scales = quantize(vectors)
+
+            codes.tofile(os.path.join(tmp_path, "codes.i8"))
+            scales.tofile(os.path.join(tmp_path, "scales.f32"))
+            vectors.astype(np.float32).tofile(os.path.join(tmp_path, "vectors.f32"))
+            centroids.tofile(os.path.join(tmp_path, "centroids.f32"))
+            offsets.tofile(os.path.join(tmp_path, "offsets.i64"))
+
+        with open(os.path.join(tmp_path, "chunks.jsonl"), 'w') as f:
+            for chunk_id, text, metadata in zip(ids, documents, metadatas):
+                f.write(json.dumps({"id": chunk_id, "text": text, "metadata": metadata}) + "\n")
+        with open(os.path.join(tmp_path, MANIFEST_FILENAME), 'w') as f:
+            json.dump({"version": FORMAT_VERSION, "count": count, "dim": dim, "nlist": nlist}, f)
+
+        # Point CURRENT at the complete generation in one atomic rename
+        pointer_tmp = os.path.join(self.path, f"{CURRENT_FILENAME}.tmp-{os.getpid()}")
+        with open(pointer_tmp, 'w') as f:
+            f.write(generation_name)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(pointer_tmp, os.path.join(self.path, CURRENT_FILENAME))
+        self._remove_old_generations(generation_name)
+        return {"chunks": count, "dim": dim, "nlist": nlist}
+
+    def _remove_old_generations(self, live: str):
+        """
+        Deletes all but the newest KEEP_OLD_GENERATIONS earlier generations,
+        and the files of a pre-generation index. Open memory maps keep deleted
+        files alive for their readers.
+        """
+        old = sorted((name for name in os.listdir(self.path) if name.startswith("gen-") and name != live),
+                     key=lambda name: int(name.split("-")[1]), reverse=True)
+        for name in old[KEEP_OLD_GENERATIONS:]:
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+        for name in (MANIFEST_FILENAME, "chunks.jsonl", "codes.i8", "scales.f32", "vectors.f32",
+                     "centroids.f32", "offsets.i64"):
+            legacy = os.path.join(self.path, name)
+            if os.path.isfile(legacy):
+                os.remove(legacy)
+
+    # --- Search ---
+
+    def similarity_search_by_vector(self, embedding, k: int = 4) -> list[SearchHit]:
+        """
+        IVF probe + int8 scoring, then exact re-scoring of the best candidates.
+        Scores are cosine similarities.
+        """
+        if self.codes is None:
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+        lists = np.argsort(-(self.centroids @ query))[:self.nprobe]
+        rows = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in np.sort(lists)])
+        if rows.size == 0:
+            return []
+
+        approx = (self.codes[rows].astype(np.float32) @ query) * self.scales[rows]
+        shortlist_size = min(max(self.rescore, k), rows.size)
+        shortlist = np.sort(rows[np.argpartition(-approx, shortlist_size - 1)[:shortlist_size]])
+
+        exact = self.vectors[shortlist] @ query
+        best = np.argsort(-exact)[:k]
+        return [
+            SearchHit(self.ids[shortlist[i]], self.documents[shortlist[i]], self.metadatas[shortlist[i]], float(exact[i]))
+            for i in best
+        ]
+
+    def similarity_search(self, query: str, k: int = 4) -> list[SearchHit]:
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k=k)
+
+    def stats(self) -> dict:
+        generation = self.generation
+        files = []
+        if generation and os.path.isdir(generation):
+            files = [name for name in os.listdir(generation) if os.path.isfile(os.path.join(generation, name))]
+        return {
+            "chunks": len(self.ids),
+            "dim": self.dim,
+            "nlist": 0 if self.centroids is None else len(self.centroids),
+            "generation": os.path.basename(generation) if generation else None,
+            "disk_bytes": sum(os.path.getsize(os.path.join(generation, name)) for name in files),
+        }
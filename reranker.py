@@ -0,0 +1,138 @@
+"""
+Second retrieval stage: cross-encoder reranking of a candidate pool.
+
+Stage one (retrieve_chunks in agent_tool.py) fetches a wide, cheap candidate
+pool. Here a small cross-encoder scores every (query, chunk) pair in batches
+on the CPU, and an MMR-style selection picks the top-k, skipping chunks that
+mostly repeat one already picked. Scoring runs under a hard time budget: if it
+is not done in time, the stage-one order is returned instead.
+"""
+import os
+import math
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from lexical_index import tokenize
+from metrics import submit_in_context
+from logger import app_logger
+
+RERANKER_MODEL_NAME = os.getenv("RERANKER_MODEL_NAME", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+
+# Hard limit on scoring time per query (the model load on first use included)
+RERANK_BUDGET_SECONDS = float(os.getenv("RERANK_BUDGET_SECONDS", "0.5"))
+RERANK_BATCH_SIZE = 16
+# Concurrent scoring jobs; the model already uses several CPU threads per batch
+RERANK_WORKERS = int(os.getenv("RERANK_WORKERS", "2"))
+
+# Relevance vs. novelty trade-off of the MMR selection (1.0 = relevance only)
+MMR_LAMBDA = 0.7
+
+# Candidates this similar (term-set Jaccard) to a picked chunk are dropped outright
+DUPLICATE_SIMILARITY = 0.8
+
+
+def _term_set(text: str) -> frozenset:
+    return frozenset(tokenize(text))
+
+
+def _jaccard(a: frozenset, b: frozenset) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def mmr_select(candidates: list, scores: list[float], k: int, mmr_lambda: float = MMR_LAMBDA,
+               duplicate_similarity: float = DUPLICATE_SIMILARITY) -> list:
+    """
+    Greedy maximal-marginal-relevance selection: each pick maximizes
+    mmr_lambda * relevance - (1 - mmr_lambda) * (overlap with picked chunks).
+    Relevance is the cross-encoder logit squashed to 0-1; overlap is the
+    Jaccard similarity of the chunks' term sets. Near-duplicates of a picked
+    chunk are never picked, even if that leaves fewer than k.
+    """
+    relevance = [1.0 / (1.0 + math.exp(-s)) for s in scores]
+    terms = [_term_set(c.page_content) for c in candidates]
+    remaining = list(range(len(candidates)))
+    picked = []
+    while remaining and len(picked) < k:
+        best = max(
+            remaining,
+            key=lambda i: mmr_lambda * relevance[i]
+            - (1 - mmr_lambda) * max((_jaccard(terms[i], terms[j]) for j in picked), default=0.0),
+        )
+        picked.append(best)
+        remaining = [i for i in remaining if i != best and _jaccard(terms[i], terms[best]) < duplicate_similarity]
+    return [candidates[i] for i in picked]
+
+
+class CrossEncoderReranker:
+    """
+    Reranks retrieval candidates with a local cross-encoder.
+
+    The model (sentence-transformers CrossEncoder, or any object with a
+    predict(pairs, batch_size=...) method passed as `model`) is loaded on
+    first use. Scoring runs on a small worker pool and is abandoned between
+    batches once the budget is spent (time spent queued for a worker
+    counts), so a slow rerank never holds up the answer.
+    """
+
+    def __init__(self, model=None, model_name: str = RERANKER_MODEL_NAME,
+                 budget_seconds: float = RERANK_BUDGET_SECONDS, batch_size: int = RERANK_BATCH_SIZE,
+                 mmr_lambda: float = MMR_LAMBDA):
+        self.model_name = model_name
+        self.budget_seconds = budget_seconds
+        self.batch_size = batch_size
+        self.mmr_lambda = mmr_lambda
+        self._model = model
+        self._model_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=RERANK_WORKERS, thread_name_prefix="rag-rerank")
+        self.fallbacks = 0
+
+    def get_model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+
+                    print(f"---[Loading reranker model {self.model_name}...]---")
+                    self._model = CrossEncoder(self.model_name, device="cpu")
+        return self._model
+
+    def _score(self, query: str, candidates: list, deadline: float) -> list[float] | None:
+        model = self.get_model()
+        pairs = [(query, c.page_content) for c in candidates]
+        scores = []
+        for i in range(0, len(pairs), self.batch_size):
+            if time.monotonic() > deadline:
+                return None
+            scores.extend(float(s) for s in model.predict(pairs[i:i + self.batch_size], batch_size=self.batch_size))
+        return scores
+
+    def rerank(self, query: str, candidates: list, k: int) -> tuple[list, dict]:
+        """
+        Returns (top-k chunks, stats). On timeout or error the first k
+        candidates are returned in stage-one order and stats["fallback"]
+        says why ("timeout" or "error"; the error message is logged).
+        """
+        stats = {"candidates": len(candidates), "rerank_ms": 0.0, "fallback": None}
+        if len(candidates) <= 1:
+            return candidates[:k], stats
+
+        start = time.monotonic()
+        future = submit_in_context(self._executor, self._score, query, candidates, start + self.budget_seconds)
+        try:
+            scores = future.result(timeout=self.budget_seconds)
+        except FutureTimeoutError:
+            scores, stats["fallback"] = None, "timeout"
+        except Exception as e:
+            scores, stats["fallback"] = None, "error"
+            app_logger.error(f"Reranking failed, keeping the stage-one order: {e}")
+        if scores is None and stats["fallback"] is None:
+            stats["fallback"] = "timeout"
+
+        if scores is None:
+            self.fallbacks += 1
+            results = candidates[:k]
+        else:
+            results = mmr_select(candidates, scores, k, self.mmr_lambda)
+        stats["rerank_ms"] = round((time.monotonic() - start) * 1000, 2)
+        return results, stats
@@ -0,0 +1,206 @@
+import re
+import math
+import time
+import threading
+from collections import OrderedDict
+
+from patient_registry import normalize_key
+from prompt_builder import select_report_fields, CORE_REPORT_FIELDS, REPORT_FIELD_PATTERNS
+
+# --- Defaults for the clinical answer cache ---
+DEFAULT_SIMILARITY_THRESHOLD = 0.92
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 1000
+
+# Questions that ask about the patient's own report fields ("when is my follow-up?")
+PERSONAL_QUESTION_PATTERN = re.compile(
+    r"\b(my|mine|me)\b.*\b(medications?|medicines?|meds|pills?|doses?|dosage|prescriptions?|follow[- ]?up|"
+    r"appointments?|discharge|report|instructions?|restrictions?|warning|labs?|tests?|results?)\b",
+    re.IGNORECASE,
+)
+
+
+def _unit(vector: list[float]) -> list[float]:
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def _dot(a: list[float], b: list[float]) -> float:
+    return sum(x * y for x, y in zip(a, b))
+
+
+def report_terms(report: dict | None) -> set[str]:
+    """
+    Words and values from a report that identify this particular patient:
+    name parts, dates and medication names.
+    """
+    if not report:
+        return set()
+    terms = set(normalize_key(report.get("patient_name", "")).split())
+    if report.get("discharge_date"):
+        terms.add(normalize_key(report["discharge_date"]))
+    for medication in report.get("medications", []) or []:
+        words = normalize_key(medication).split()
+        # "Lisinopril 10mg daily" -> "lisinopril", "Hold Metformin" -> "metformin"
+        terms.update(w for w in words if len(w) > 4 and w.isalpha() and w not in {"daily", "twice", "discontinue"})
+    return {t for t in terms if t}
+
+
+def mentions_report_terms(text: str, report: dict | None) -> bool:
+    text_key = normalize_key(text)
+    words = set(re.findall(r"[\w-]+", text_key))
+    for term in report_terms(report):
+        if term in words or (("-" in term or " " in term) and term in text_key):
+            return True
+    return False
+
+
+def asks_about_report_fields(question: str, report: dict | None) -> bool:
+    """
+    True if the clinical prompt for this question would carry report fields
+    beyond the name and diagnosis (prompt_builder.select_report_fields), e.g.
+    "Can I take ibuprofen?" (medications) or "How much water can I drink?"
+    (dietary restrictions). Without a report, any field keyword counts.
+    """
+    if report:
+        return any(field not in CORE_REPORT_FIELDS for field in select_report_fields(report, question))
+    question_lower = question.lower()
+    return any(pattern.search(question_lower) for pattern in REPORT_FIELD_PATTERNS.values())
+
+
+class SemanticAnswerCache:
+    """
+    Reuses earlier clinical answers for near-identical questions from patients
+    with the same primary diagnosis.
+
+    Questions are embedded and compared (cosine similarity) only against
+    answers cached for the same normalized diagnosis. Entries expire after
+    `ttl_seconds` and the least recently used entry is evicted beyond
+    `max_entries`. Questions whose answer depends on the patient's report
+    (any question the prompt builder would send report fields for, or that
+    names the patient's own medications, dates...) are never cached or served
+    from the cache.
+
+    Only store answers generated without the patient's report (see
+    prompt_builder.build_general_prompt): entries are shared by every patient
+    with the diagnosis, so nothing in them may come from one patient's report.
+    """
+
+    def __init__(self, embed_fn, similarity_threshold: float = DEFAULT_SIMILARITY_THRESHOLD,
+                 ttl_seconds: float = DEFAULT_TTL_SECONDS, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.embed_fn = embed_fn
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # entry id -> entry dict, in LRU order
+        self._by_diagnosis = {}         # normalized diagnosis -> set of entry ids
+        self._next_id = 0
+        self.lookups = 0
+        self.hits = 0
+        self.bypassed = 0
+        self.stores = 0
+        self.rejected_stores = 0
+        self.evictions = 0
+        self.latency_saved_seconds = 0.0
+
+    # --- Cacheability ---
+
+    @staticmethod
+    def is_patient_specific_question(question: str, report: dict | None) -> bool:
+        return (bool(PERSONAL_QUESTION_PATTERN.search(question)) or asks_about_report_fields(question, report)
+                or mentions_report_terms(question, report))
+
+    # --- Cache operations ---
+
+    def _drop(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        ids = self._by_diagnosis.get(entry["diagnosis"])
+        if ids is not None:
+            ids.discard(entry_id)
+            if not ids:
+                del self._by_diagnosis[entry["diagnosis"]]
+
+    def lookup(self, question: str, diagnosis: str, report: dict | None = None) -> dict | None:
+        """
+        Returns {"answer", "similarity", "cached_question"} for the closest
+        cached question above the threshold, or None.
+        """
+        diagnosis_key = normalize_key(diagnosis)
+        if not diagnosis_key or self.is_patient_specific_question(question, report):
+            with self._lock:
+                self.bypassed += 1
+            return None
+
+        vector = _unit(self.embed_fn(question))
+        now = time.time()
+        with self._lock:
+            self.lookups += 1
+            best_id, best_similarity = None, -1.0
+            for entry_id in list(self._by_diagnosis.get(diagnosis_key, ())):
+                entry = self._entries[entry_id]
+                if now - entry["created_at"] > self.ttl_seconds:
+                    self._drop(entry_id)
+                    continue
+                similarity = _dot(vector, entry["vector"])
+                if similarity > best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+
+            if best_id is None or best_similarity < self.similarity_threshold:
+                return None
+
+            entry = self._entries[best_id]
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            self.latency_saved_seconds += entry["latency_seconds"]
+            return {"answer": entry["answer"], "similarity": best_similarity, "cached_question": entry["question"]}
+
+    def store(self, question: str, diagnosis: str, answer: str, latency_seconds: float,
+              report: dict | None = None) -> bool:
+        """
+        Caches an answer to a general question. `answer` must come from a
+        prompt without report fields (build_general_prompt); the question is
+        checked again so report-specific ones are never shared.
+        `latency_seconds` is what producing it cost, credited on every hit.
+        """
+        diagnosis_key = normalize_key(diagnosis)
+        if not diagnosis_key or self.is_patient_specific_question(question, report):
+            with self._lock:
+                self.rejected_stores += 1
+            return False
+
+        vector = _unit(self.embed_fn(question))
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {
+                "diagnosis": diagnosis_key,
+                "question": question,
+                "answer": answer,
+                "vector": vector,
+                "created_at": time.time(),
+                "latency_seconds": latency_seconds,
+            }
+            self._by_diagnosis.setdefault(diagnosis_key, set()).add(entry_id)
+            self.stores += 1
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+        return True
+
+    def stats(self) -> dict:
+        """
+        Hit rate and latency saved, for logging / metrics.
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+                "bypassed_patient_specific": self.bypassed,
+                "stores": self.stores,
+                "rejected_stores": self.rejected_stores,
+                "evictions": self.evictions,
+                "latency_saved_seconds": round(self.latency_saved_seconds, 3),
+            }
@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# logger.py opens its log file on import: keep test runs out of chat_log.jsonl
+os.environ.setdefault("LOG_FILE", os.path.join(tempfile.mkdtemp(prefix="medical-ai-tests-"), "chat_log.jsonl"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,71 @@
+import json
+import os
+
+import pytest
+
+from patient_registry import PATIENT_DATA_DIR
+from semantic_cache import SemanticAnswerCache
+
+REPORT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), PATIENT_DATA_DIR,
+                           "patient-1.json")
+
+
+@pytest.fixture
+def report():
+    # John Smith, CKD stage 3: Lisinopril, Furosemide, 1.5 L/day fluid restriction
+    with open(REPORT_PATH, 'r') as f:
+        return json.load(f)
+
+
+def fake_embed(question: str) -> list[float]:
+    # Letter counts: identical questions are identical vectors
+    text = question.lower()
+    return [float(text.count(c)) for c in "abcdefghijklmnopqrstuvwxyz"]
+
+
+@pytest.mark.parametrize("question", [
+    "Can I take ibuprofen for pain?",          # medications (NSAID interactions), warning signs
+    "how much water can I drink",              # fluid restriction
+    "Is it safe to eat bananas?",              # dietary restrictions
+    "When is my follow-up appointment?",
+    "What does lisinopril do?",                # the patient's own medication
+    "Is swelling in the legs dangerous?",      # warning signs
+    "Should I weigh myself every day?",        # discharge instructions
+    "Can John Smith exercise?",
+])
+def test_questions_about_the_report_are_personal(report, question):
+    assert SemanticAnswerCache.is_patient_specific_question(question, report)
+
+
+@pytest.mark.parametrize("question", [
+    "What is eGFR?",
+    "What causes chronic kidney disease?",
+    "What is CKD stage 3?",
+])
+def test_generic_questions_are_general(report, question):
+    assert not SemanticAnswerCache.is_patient_specific_question(question, report)
+
+
+def test_field_keywords_count_without_a_report():
+    assert SemanticAnswerCache.is_patient_specific_question("how much water can I drink", None)
+    assert not SemanticAnswerCache.is_patient_specific_question("What is eGFR?", None)
+
+
+def test_personal_questions_are_never_stored_or_served(report):
+    cache = SemanticAnswerCache(fake_embed)
+    question = "Can I take ibuprofen for pain?"
+    assert not cache.store(question, report["primary_diagnosis"], "answer", 1.0, report)
+    assert cache.lookup(question, report["primary_diagnosis"], report) is None
+    stats = cache.stats()
+    assert stats["entries"] == 0
+    assert stats["rejected_stores"] == 1
+    assert stats["bypassed_patient_specific"] == 1
+
+
+def test_general_answers_are_shared_within_a_diagnosis(report):
+    cache = SemanticAnswerCache(fake_embed)
+    assert cache.store("What is eGFR?", report["primary_diagnosis"], "eGFR estimates kidney function.", 2.0, report)
+
+    hit = cache.lookup("What is eGFR?", "chronic kidney disease stage 3", None)
+    assert hit["answer"] == "eGFR estimates kidney function."
+    assert cache.lookup("What is eGFR?", "Acute Kidney Injury", None) is None